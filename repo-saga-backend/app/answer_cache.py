@@ -0,0 +1,171 @@
+"""
+/chat 的語意答案快取：近似重複的第一輪問題直接回傳過去的回答，不呼叫上游。
+
+問題以雜湊的字元 n-gram 與詞向量化（離線、無模型，中文不需斷詞），
+每種語言一個記憶體內索引：倒排表找候選，再以餘弦相似度挑出最近鄰，
+超過門檻才算命中。容量有上限，依最近使用淘汰，並有 TTL。
+"""
+
+import os
+import re
+import math
+import time
+import zlib
+import logging
+from collections import Counter as TermCounts, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+CHAT_CACHE_ENABLED = os.environ.get("SAGA_CHAT_CACHE", "1") == "1"
+CHAT_CACHE_THRESHOLD = float(os.environ.get("SAGA_CHAT_CACHE_THRESHOLD", "0.85"))
+CHAT_CACHE_SIZE = int(os.environ.get("SAGA_CHAT_CACHE_SIZE", "500"))  # 每種語言
+CHAT_CACHE_TTL = float(os.environ.get("SAGA_CHAT_CACHE_TTL", "86400"))
+
+FEATURE_BUCKETS = 1 << 20
+NGRAM_SIZES = (2, 3)
+
+LOOKUPS = Counter("saga_chat_cache_lookups_total", "Semantic chat cache lookups", ("language", "result"))
+SAVED_SECONDS = Counter(
+    "saga_chat_cache_saved_seconds_total", "Upstream latency avoided by semantic chat cache hits", ("language",),
+)
+SIMILARITY = Histogram(
+    "saga_chat_cache_similarity", "Similarity of the nearest cached question",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0),
+)
+ENTRIES = Gauge("saga_chat_cache_entries", "Questions held in the semantic chat cache", ("language",))
+
+Vector = Dict[int, float]
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def vectorize(text: str) -> Vector:
+    """字元 2/3-gram 與整詞雜湊成稀疏向量（次線性 TF，L2 正規化）"""
+    normalized = normalize(text)
+    terms = TermCounts(normalized.split())
+    padded = f" {normalized} "
+    for n in NGRAM_SIZES:
+        terms.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    vector: Vector = {}
+    for term, count in terms.items():
+        index = zlib.crc32(term.encode("utf-8")) % FEATURE_BUCKETS
+        vector[index] = vector.get(index, 0.0) + 1.0 + math.log(count)
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    return {i: w / norm for i, w in vector.items()} if norm else {}
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    vector: Vector
+    upstream_seconds: float  # 產生這個回答時的上游耗時，命中時計入節省的時間
+    expires_at: float
+
+
+class SemanticIndex:
+    """單一語言的有界最近鄰索引"""
+
+    def __init__(self, maxsize: int = CHAT_CACHE_SIZE, ttl: float = CHAT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._postings: Dict[int, Set[int]] = {}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def nearest(self, vector: Vector) -> Tuple[Optional[CachedAnswer], float]:
+        scores: Dict[int, float] = {}
+        for feature, weight in vector.items():
+            for entry_id in self._postings.get(feature, ()):
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * self._entries[entry_id].vector[feature]
+        now = time.time()
+        for entry_id, score in sorted(scores.items(), key=lambda item: -item[1]):
+            entry = self._entries[entry_id]
+            if entry.expires_at <= now:
+                self._remove(entry_id)
+                continue
+            self._entries.move_to_end(entry_id)
+            return entry, score
+        return None, 0.0
+
+    def add(self, question: str, answer: str, vector: Vector, upstream_seconds: float) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = CachedAnswer(question, answer, vector, upstream_seconds, time.time() + self.ttl)
+        for feature in vector:
+            self._postings.setdefault(feature, set()).add(entry_id)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for feature in entry.vector:
+            ids = self._postings.get(feature)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._postings[feature]
+
+
+class AnswerCache:
+    def __init__(self, threshold: float = CHAT_CACHE_THRESHOLD, maxsize: int = CHAT_CACHE_SIZE, ttl: float = CHAT_CACHE_TTL):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._indexes: Dict[str, SemanticIndex] = {}
+
+    def _index(self, language: str) -> SemanticIndex:
+        index = self._indexes.get(language)
+        if index is None:
+            index = self._indexes[language] = SemanticIndex(self.maxsize, self.ttl)
+        return index
+
+    def lookup(self, language: str, question: str) -> Optional[str]:
+        started = time.perf_counter()
+        vector = vectorize(question)
+        entry, score = self._index(language).nearest(vector) if vector else (None, 0.0)
+        if entry is not None:
+            SIMILARITY.observe(score)
+        if entry is None or score < self.threshold:
+            LOOKUPS.inc(language=language, result="miss")
+            return None
+        LOOKUPS.inc(language=language, result="hit")
+        SAVED_SECONDS.inc(max(0.0, entry.upstream_seconds - (time.perf_counter() - started)), language=language)
+        logger.info(f"🧠 Chat cache hit ({score:.2f}) for {question[:40]!r} ~ {entry.question[:40]!r}")
+        return entry.answer
+
+    def add(self, language: str, question: str, answer: str, upstream_seconds: float) -> None:
+        vector = vectorize(question)
+        if not vector:
+            return
+        index = self._index(language)
+        index.add(question, answer, vector, upstream_seconds)
+        ENTRIES.set(len(index), language=language)
+
+
+_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """SAGA_CHAT_CACHE=0 時為 None"""
+    global _cache
+    if _cache is None and CHAT_CACHE_ENABLED:
+        _cache = AnswerCache()
+    return _cache
+
+
+def set_answer_cache(cache: Optional[AnswerCache]) -> None:
+    """替換答案快取（測試用）"""
+    global _cache
+    _cache = cache
@@ -0,0 +1,260 @@
+"""
+批次生成：一次為大量倉庫產生作品。
+
+    python -m app.batch repos.txt --out sagas.jsonl --concurrency 4 --lang en
+
+輸入檔每行一個倉庫 URL，或一個 JSON 物件 {"url": ..., "poem_style": ..., "lang": ...}。
+結果逐筆附加到 JSONL；中斷後以相同指令重跑會略過已成功的項目。
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from .limits import current_priority
+from .services import build_presets, canonical_repo, generate_saga_from_repo, saga_key
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_CONCURRENCY = int(os.environ.get("SAGA_BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.environ.get("SAGA_BATCH_MAX_ITEMS", "500"))
+
+
+@dataclass
+class BatchItem:
+    url: str
+    presets: Dict[str, Optional[str]]
+
+    @property
+    def key(self) -> str:
+        """正規化倉庫 + presets；相同的鍵視為重複項目"""
+        return saga_key(canonical_repo(self.url), self.presets)
+
+
+@dataclass
+class BatchStats:
+    total: int = 0
+    duplicates: int = 0
+    skipped: int = 0
+    ok: int = 0
+    failed: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        done = self.ok + self.failed
+        return {
+            "total": self.total,
+            "duplicates": self.duplicates,
+            "skipped": self.skipped,
+            "ok": self.ok,
+            "failed": self.failed,
+            "elapsed_s": round(elapsed, 2),
+            "per_minute": round(done / elapsed * 60, 2) if elapsed > 0 else None,
+        }
+
+
+def dedupe(items: Iterable[BatchItem], stats: BatchStats, done: Optional[Set[str]] = None) -> List[BatchItem]:
+    """
+    去除重複項目與已完成的項目；同一倉庫的項目排在一起，
+    讓不同 presets 的請求依序命中同一份快取的洞察報告。
+    """
+    seen: Set[str] = set()
+    unique: List[BatchItem] = []
+    for item in items:
+        stats.total += 1
+        key = item.key
+        if key in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(key)
+        if done and key in done:
+            stats.skipped += 1
+            continue
+        unique.append(item)
+    order: Dict[str, int] = {}
+    for item in unique:
+        order.setdefault(canonical_repo(item.url), len(order))
+    return sorted(unique, key=lambda item: order[canonical_repo(item.url)])
+
+
+async def _generate(item: BatchItem) -> Dict[str, Any]:
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    record: Dict[str, Any] = {
+        "key": item.key,
+        "repo_url": item.url,
+        "repo": canonical_repo(item.url),
+        "presets": item.presets,
+    }
+    try:
+        insight, poem, novel = await generate_saga_from_repo(item.url, item.presets, timings=timings)
+        record.update(status="ok", insight_report=insight, poem=poem, novel=novel)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+    record["timings_ms"] = {name: round(seconds * 1000) for name, seconds in timings.items()}
+    return record
+
+
+async def run_batch(items: List[BatchItem], concurrency: int, stats: BatchStats) -> AsyncIterator[Dict[str, Any]]:
+    """
+    以最多 concurrency 個並發執行，依完成順序逐筆產出結果。
+    呼叫端提前停止迭代（例如客戶端斷線）時會取消其餘仍在執行的項目。
+    上游呼叫以最低的 batch 優先等級排程，不影響互動式請求。
+    """
+    current_priority.set("batch")
+    pending: "asyncio.Queue[BatchItem]" = asyncio.Queue()
+    for item in items:
+        pending.put_nowait(item)
+    results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    async def worker() -> None:
+        while True:
+            try:
+                item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await results.put(await _generate(item))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(items))))]
+    try:
+        for _ in range(len(items)):
+            record = await results.get()
+            if record["status"] == "ok":
+                stats.ok += 1
+            else:
+                stats.failed += 1
+            done = stats.ok + stats.failed
+            logger.info(
+                f"📦 [{done}/{len(items)}] {record['repo']} {record['status']} in {record['elapsed_ms'] / 1000:.1f}s"
+            )
+            yield record
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def batch_ndjson(items: List[BatchItem], concurrency: int) -> AsyncIterator[str]:
+    """POST /generate/batch 的回應主體：每完成一筆輸出一行 JSON，最後一行為 {"summary": ...}"""
+    stats = BatchStats()
+    todo = dedupe(items, stats)
+    async for record in run_batch(todo, concurrency, stats):
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+    summary = stats.summary()
+    logger.info(f"📦 Batch finished: {summary}")
+    yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+
+# ---- CLI ----
+
+def load_completed(path: str) -> Set[str]:
+    """讀取既有的 JSONL，回傳已成功的項目鍵；崩潰時寫了一半的最後一行會被忽略"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok" and record.get("key"):
+                done.add(record["key"])
+    return done
+
+
+def _drop_partial_line(path: str) -> None:
+    """截掉崩潰時未寫完的最後一行，避免續跑時新紀錄接在半行之後"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def parse_items(lines: Iterable[str], defaults: Dict[str, Optional[str]]) -> List[BatchItem]:
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = dict(defaults)
+        if line.startswith("{"):
+            fields.update({k: v for k, v in json.loads(line).items() if v is not None})
+        else:
+            fields["url"] = line
+        items.append(BatchItem(
+            url=fields["url"],
+            presets=build_presets(
+                fields.get("poem_style"), fields.get("novel_genre"), fields.get("tone"),
+                fields.get("lang"), fields.get("locale"),
+            ),
+        ))
+    return items
+
+
+async def run_to_file(items: List[BatchItem], out: str, concurrency: int, resume: bool = True) -> Dict[str, Any]:
+    stats = BatchStats()
+    done = set()
+    if resume:
+        done = load_completed(out)
+        _drop_partial_line(out)
+    todo = dedupe(items, stats, done)
+    logger.info(
+        f"📦 Batch: {stats.total} items, {stats.duplicates} duplicates, "
+        f"{stats.skipped} already done, {len(todo)} to run at concurrency {concurrency}"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "a" if resume else "w", encoding="utf-8") as f:
+        async for record in run_batch(todo, concurrency, stats):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            # 每筆都落盤，崩潰後重跑只需補做未完成的項目
+            f.flush()
+            os.fsync(f.fileno())
+    summary = stats.summary()
+    logger.info(f"📦 Batch finished: {summary}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate sagas for many repositories into a JSONL file")
+    parser.add_argument("input", help="file with one repo URL or JSON item per line ('-' for stdin)")
+    parser.add_argument("--out", required=True, help="JSONL output; existing successful entries are skipped")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--no-resume", action="store_true", help="overwrite the output instead of resuming")
+    parser.add_argument("--lang", default=None)
+    parser.add_argument("--locale", default=None)
+    parser.add_argument("--poem-style", default=None)
+    parser.add_argument("--novel-genre", default=None)
+    parser.add_argument("--tone", default=None)
+    args = parser.parse_args(argv)
+
+    defaults = {
+        "lang": args.lang, "locale": args.locale, "poem_style": args.poem_style,
+        "novel_genre": args.novel_genre, "tone": args.tone,
+    }
+    if args.input == "-":
+        items = parse_items(sys.stdin, defaults)
+    else:
+        with open(args.input, "r", encoding="utf-8") as f:
+            items = parse_items(f, defaults)
+
+    summary = asyncio.run(run_to_file(items, args.out, args.concurrency, resume=not args.no_resume))
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
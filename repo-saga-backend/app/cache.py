@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from .metrics import Counter
+from .storage import SQLiteDB
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = float(os.environ.get("SAGA_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MEMORY_SIZE = int(os.environ.get("SAGA_CACHE_MEMORY_SIZE", "512"))
+# 設為空字串即停用磁碟層（僅保留行程內 LRU）
+CACHE_PATH = os.environ.get("SAGA_CACHE_PATH", os.path.join("data", "saga_cache.sqlite3"))
+
+CACHE_LOOKUPS = Counter(
+    "saga_cache_lookups_total", "Result cache lookups by key namespace; result=memory_hit|disk_hit|miss",
+    ("namespace", "result"),
+)
+
+
+def make_key(namespace: str, **fields: Optional[str]) -> str:
+    """
+    由命名空間與欄位產生穩定的快取鍵，例如 make_key("insight", repo="tiangolo/fastapi", language="English")
+    """
+    digest = hashlib.sha256(
+        json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:32]
+    return f"{namespace}:{digest}"
+
+
+class MemoryLRU:
+    """行程內 LRU，每個項目帶有到期時間"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStore(SQLiteDB):
+    """
+    持久化的磁碟層，重啟後內容仍在，並由同一台機器上的所有 worker 共用。
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    PURGE_EVERY = 200
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= time.time():
+            self.delete(key)
+            return None
+        return row[0], row[1]
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class TieredCache:
+    """
+    兩層快取：行程內 LRU（含 TTL）在前，SQLite 磁碟層在後。
+    磁碟命中時會回填到記憶體層。磁碟 I/O 在執行緒中進行，不阻塞 event loop。
+    """
+
+    def __init__(self, memory_size: int = CACHE_MEMORY_SIZE, path: Optional[str] = CACHE_PATH, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self.memory = MemoryLRU(memory_size)
+        self.disk = SQLiteStore(path) if path else None
+        self.stats: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    async def get(self, key: str) -> Optional[str]:
+        namespace = key.split(":", 1)[0]
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            CACHE_LOOKUPS.inc(namespace=namespace, result="memory_hit")
+            return value
+        if self.disk is not None:
+            try:
+                row = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Cache disk read failed: {e}")
+                row = None
+            if row is not None:
+                self.stats["disk_hits"] += 1
+                CACHE_LOOKUPS.inc(namespace=namespace, result="disk_hit")
+                self.memory.set(key, row[0], row[1])
+                return row[0]
+        self.stats["misses"] += 1
+        CACHE_LOOKUPS.inc(namespace=namespace, result="miss")
+        return None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self.memory.set(key, value, expires_at)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Cache disk write failed: {e}")
+
+    async def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
+
+
+async def cached(
+    cache: Optional[TieredCache], key: str, produce: Callable[[], Awaitable[str]], refresh: bool = False,
+) -> str:
+    """
+    先查快取，未命中才呼叫 produce() 並寫回。cache 為 None 時直接執行。
+    refresh=True 時不讀取既有項目，重新產生並覆寫。
+    """
+    if cache is None:
+        return await produce()
+    value = None if refresh else await cache.get(key)
+    if value is not None:
+        logger.info(f"💾 Cache hit: {key}")
+        return value
+    value = await produce()
+    await cache.set(key, value)
+    return value
+
+
+_cache: Optional[TieredCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TieredCache:
+    """取得全域的生成結果快取（首次呼叫時依環境變數建立）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TieredCache()
+        return _cache
+
+
+def set_cache(cache: Optional[TieredCache]) -> None:
+    """替換全域快取（測試用；傳入 None 則下次呼叫時重新建立）"""
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,139 @@
+"""
+上游 LLM 呼叫的錄製 / 重播（cassette）。
+
+    SAGA_CASSETTE_MODE=record  呼叫真正的上游，並把每個成功的回應（含串流 chunk 時間）附加到 cassette
+    SAGA_CASSETTE_MODE=replay  完全不連上游、不需 API key，從 cassette 回放；找不到時拋出 CassetteMiss
+
+cassette 是 JSONL，每行一筆：{"key", "model", "chunks": [[距請求開始的毫秒數, 文字], ...]}；
+非串流回應是一個 chunk。鍵為模型、溫度與正規化後 messages 的雜湊。
+同一個鍵錄到多筆時依序輪流回放，讓重複的提示詞也能重現原本的回應順序。
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+OFF, RECORD, REPLAY = "off", "record", "replay"
+
+CASSETTE_MODE = os.environ.get("SAGA_CASSETTE_MODE", OFF)
+CASSETTE_PATH = os.environ.get("SAGA_CASSETTE_PATH", "data/cassettes/upstream.jsonl")
+# 重播時的時間倍率：0 立即回應，1 依錄製時的原始時間，0.5 以兩倍速回放
+CASSETTE_TIME_SCALE = float(os.environ.get("SAGA_CASSETTE_TIME_SCALE", "0"))
+
+CASSETTE_CALLS = Counter("saga_cassette_calls_total", "Upstream calls served or captured by the cassette", ("mode", "result"))
+
+Chunk = Tuple[int, str]
+
+
+class CassetteMiss(RuntimeError):
+    """重播模式下 cassette 沒有對應的錄製"""
+
+
+def cassette_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    """正規化（合併空白）後的提示詞雜湊，格式上的小差異不影響命中"""
+    normalized = [[m.get("role", ""), " ".join(str(m.get("content", "")).split())] for m in messages]
+    raw = json.dumps([model, round(temperature, 3), normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, time_scale: float = CASSETTE_TIME_SCALE):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self._entries: Optional[Dict[str, List[List[Chunk]]]] = None
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, List[List[Chunk]]]:
+        if self._entries is None:
+            entries: Dict[str, List[List[Chunk]]] = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # 錄製中斷時寫了一半的行
+                        entries.setdefault(entry["key"], []).append([(int(ms), text) for ms, text in entry["chunks"]])
+            self._entries = entries
+            logger.info(f"📼 Loaded {sum(len(v) for v in entries.values())} recordings from {self.path}")
+        return self._entries
+
+    def lookup(self, key: str) -> List[Chunk]:
+        recordings = self._load().get(key)
+        if not recordings:
+            CASSETTE_CALLS.inc(mode=self.mode, result="miss")
+            raise CassetteMiss(f"No cassette recording for prompt {key} in {self.path}")
+        CASSETTE_CALLS.inc(mode=self.mode, result="hit")
+        index = self._cursor.get(key, 0)
+        self._cursor[key] = index + 1
+        return recordings[index % len(recordings)]
+
+    def record(self, key: str, model: str, chunks: List[Chunk]) -> None:
+        line = json.dumps({"key": key, "model": model, "chunks": chunks}, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            if self._entries is not None:
+                self._entries.setdefault(key, []).append(chunks)
+        CASSETTE_CALLS.inc(mode=self.mode, result="recorded")
+
+    async def _wait_until(self, started: float, ms: int) -> None:
+        if self.time_scale > 0:
+            await asyncio.sleep(max(0.0, started + ms / 1000 * self.time_scale - time.perf_counter()))
+
+    async def replay_completion(self, model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+        started = time.perf_counter()
+        chunks = self.lookup(cassette_key(model, messages, temperature))
+        await self._wait_until(started, chunks[-1][0])
+        return "".join(text for _, text in chunks)
+
+    async def replay_stream(
+        self, model: str, messages: List[Dict[str, str]], temperature: float,
+    ) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        for ms, text in self.lookup(cassette_key(model, messages, temperature)):
+            await self._wait_until(started, ms)
+            yield text
+
+
+class StreamRecorder:
+    """錄製串流時記下每個 delta 距請求開始的時間"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.chunks: List[Chunk] = []
+
+    def add(self, text: str) -> None:
+        self.chunks.append((round((time.perf_counter() - self.started) * 1000), text))
+
+
+_cassette: Optional[Cassette] = None
+
+
+def get_cassette() -> Optional[Cassette]:
+    """依 SAGA_CASSETTE_MODE 建立的 cassette；off 時為 None"""
+    global _cassette
+    if _cassette is None and CASSETTE_MODE != OFF:
+        _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+        logger.info(f"📼 Upstream cassette in {CASSETTE_MODE} mode: {CASSETTE_PATH}")
+    return _cassette
+
+
+def set_cassette(cassette: Optional[Cassette]) -> None:
+    """替換目前的 cassette（測試用）"""
+    global _cassette
+    _cassette = cassette
@@ -0,0 +1,194 @@
+"""
+聊天助手的 /ws/chat WebSocket 傳輸（系統提示詞見 prompts.py）。
+
+/ws/chat?session_id=...&lang=en 一個連線對應一段對話，訊息皆為 JSON：
+    客戶端 -> {"type": "message", "text": "..."} 或 {"type": "cancel"}
+    伺服器 -> session / start / token / done / cancelled / error
+回覆逐段以 token 送出；cancel 會中止進行中的上游串流。
+輸出防護（guards.py）觸發時同樣中止上游，done 事件帶 truncated 與截斷後的全文。
+送出時若客戶端讀取太慢（超過 SAGA_WS_SEND_TIMEOUT）會暫停讀取上游，逾時則關閉連線。
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .answer_cache import get_answer_cache
+from .context import pack_chat_history
+from .guards import GUARDS_ENABLED, GuardTripped, OutputGuard, clean_cut, guarded, record_trip
+from .limits import ADMISSION_MAX_QUEUE, client_identity, current_client, current_priority, get_limiter
+from .metrics import Counter, Gauge
+from .monitoring import current_stage
+from .openrouter import openrouter_stream
+from .prompts import get_prompts
+from .routing import resolve_route
+from .sessions import ChatSession, SessionStore, get_session_store
+
+logger = logging.getLogger(__name__)
+
+WS_MAX_CONNECTIONS = int(os.environ.get("SAGA_WS_MAX_CONNECTIONS", "1000"))
+WS_SEND_TIMEOUT = float(os.environ.get("SAGA_WS_SEND_TIMEOUT", "30"))
+
+WS_CONNECTIONS = Gauge("saga_ws_chat_connections", "Open /ws/chat connections")
+WS_REPLIES = Counter("saga_ws_chat_replies_total", "WebSocket chat replies by outcome", ("outcome",))
+
+EXPECTED_FRAME = "Expected {\"type\": \"message\", \"text\": ...} or cancel"
+
+
+def chat_system_prompt(is_english: bool) -> str:
+    return get_prompts().get("chat", is_english).system
+
+
+class SlowClient(Exception):
+    """客戶端在 WS_SEND_TIMEOUT 內沒有讀走資料"""
+
+
+class ChatSocket:
+    def __init__(self, websocket: WebSocket, store: SessionStore, session: ChatSession):
+        self.websocket = websocket
+        self.store = store
+        self.session = session
+        self.reply: Optional[asyncio.Task] = None
+        self.turns = 0
+        # 回覆 task 與接收迴圈都會送出訊息，序列化寫入
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, data: Dict[str, Any]) -> None:
+        """
+        送出一則訊息；底層緩衝滿時會等待客戶端讀取（背壓），
+        此時回覆 task 也不再讀取上游。等待超過 WS_SEND_TIMEOUT 視為客戶端失聯。
+        """
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(self.websocket.send_json(data), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise SlowClient()
+
+    async def serve(self) -> None:
+        await self.send({"type": "session", "session_id": self.session.id})
+        while True:
+            raw = await self.websocket.receive_text()
+            try:
+                data = json.loads(raw)
+            except json.JSONDecodeError:
+                data = None
+            # 格式錯誤的訊息只回報錯誤，不關閉連線
+            if not isinstance(data, dict):
+                await self.send({"type": "error", "message": EXPECTED_FRAME})
+                continue
+            kind = data.get("type")
+            if kind == "cancel":
+                if self.reply is not None and not self.reply.done():
+                    self.reply.cancel()
+                continue
+            text = str(data.get("text") or "").strip()
+            if kind != "message" or not text:
+                await self.send({"type": "error", "message": EXPECTED_FRAME})
+                continue
+            if self.reply is not None and not self.reply.done():
+                await self.send({"type": "error", "message": "A reply is still streaming; cancel it first"})
+                continue
+            limiter = get_limiter()
+            if limiter.waiting >= ADMISSION_MAX_QUEUE:
+                await self.send({
+                    "type": "error", "message": "Server is busy, please retry later",
+                    "retry_after": limiter.retry_after_hint(),
+                })
+                continue
+            self.turns += 1
+            self.reply = asyncio.create_task(self._reply(self.turns, text), name=f"ws-chat:{self.session.id}")
+
+    async def _reply(self, turn: int, text: str) -> None:
+        current_stage.set("chat")
+        session = self.session
+        messages, _ = pack_chat_history(
+            chat_system_prompt(session.is_english), session.turns, text,
+            is_english=session.is_english, summary=session.summary,
+        )
+        language = "English" if session.is_english else "Traditional Chinese"
+        answers = get_answer_cache() if not (session.turns or session.summary) else None
+        parts = []
+        truncated = None
+        try:
+            await self.send({"type": "start", "id": turn})
+            cached = answers.lookup(language, text) if answers is not None else None
+            if cached is not None:
+                parts.append(cached)
+                await self.send({"type": "token", "id": turn, "text": cached})
+            else:
+                route = resolve_route("chat", {"language": language})
+                started = time.perf_counter()
+                deltas = openrouter_stream(
+                    messages, model=route.model, temperature=route.temperature,
+                    max_tokens=route.max_tokens, timeout=route.timeout,
+                )
+                guard = OutputGuard("chat", language, route.max_tokens) if GUARDS_ENABLED else None
+                try:
+                    async for delta in (deltas if guard is None else guarded(deltas, guard)):
+                        parts.append(delta)
+                        await self.send({"type": "token", "id": turn, "text": delta})
+                except GuardTripped as trip:
+                    # 上游串流已關閉；保留截斷後的回覆，done 事件附上 text 供客戶端取代
+                    record_trip("chat", trip, "truncated", guard.text, route.max_tokens)
+                    parts = [clean_cut(guard.text, trip.cut)]
+                    truncated = trip.reason
+                    if not parts[0]:
+                        raise RuntimeError(f"Output guard left no usable chat reply ({trip.reason})")
+                if answers is not None and truncated is None:
+                    answers.add(language, text, "".join(parts), time.perf_counter() - started)
+        except asyncio.CancelledError:
+            # 取消（客戶端要求或連線關閉）會關閉上游串流；未完成的回覆不記入對話
+            WS_REPLIES.inc(outcome="cancelled")
+            try:
+                await self.send({"type": "cancelled", "id": turn})
+            except Exception:
+                pass
+            return
+        except SlowClient:
+            WS_REPLIES.inc(outcome="slow_client")
+            logger.warning(f"🐌 Closing chat socket {session.id}: client stopped reading")
+            await self.websocket.close(code=1008, reason="client too slow")
+            return
+        except Exception as e:
+            WS_REPLIES.inc(outcome="error")
+            logger.error(f"❌ Chat reply failed for session {session.id}: {e!r}")
+            await self.send({"type": "error", "id": turn, "message": "The assistant is temporarily unavailable"})
+            return
+
+        reply = "".join(parts)
+        self.store.append(session, text, reply)
+        WS_REPLIES.inc(outcome="cached" if cached is not None else "truncated" if truncated else "ok")
+        done = {"type": "done", "id": turn, "chars": len(reply), "cached": cached is not None}
+        if truncated:
+            done.update(truncated=truncated, text=reply)
+        await self.send(done)
+
+
+async def chat_socket(websocket: WebSocket) -> None:
+    if WS_CONNECTIONS.value() >= WS_MAX_CONNECTIONS:
+        await websocket.close(code=1013, reason="too many connections")
+        return
+    await websocket.accept()
+    # 回覆 task 繼承此 context，上游呼叫以 chat 等級排程
+    current_priority.set("chat")
+    current_client.set(client_identity(websocket.headers, websocket.client))
+    params = websocket.query_params
+    is_english = params.get("lang") == "en" or params.get("locale", "").startswith("en")
+    store = get_session_store()
+    session = store.get(params.get("session_id")) or store.create(is_english=is_english)
+    socket = ChatSocket(websocket, store, session)
+    WS_CONNECTIONS.inc()
+    try:
+        await socket.serve()
+    except (WebSocketDisconnect, SlowClient):
+        pass
+    finally:
+        WS_CONNECTIONS.dec()
+        if socket.reply is not None:
+            socket.reply.cancel()
+            await asyncio.gather(socket.reply, return_exceptions=True)
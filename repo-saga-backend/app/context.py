@@ -0,0 +1,220 @@
+import os
+import re
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .limits import estimate_messages_tokens, estimate_tokens
+from .metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# 各階段提示詞（含 system）的 token 預算，以本機估算為準
+PROMPT_BUDGETS = {
+    "insight": int(os.environ.get("SAGA_INSIGHT_PROMPT_TOKENS", "3000")),
+    "poem": int(os.environ.get("SAGA_POEM_PROMPT_TOKENS", "1500")),
+    "novel": int(os.environ.get("SAGA_NOVEL_PROMPT_TOKENS", "2000")),
+    "chat": int(os.environ.get("SAGA_CHAT_PROMPT_TOKENS", "3000")),
+}
+# 被丟棄的舊對話濃縮成摘要時的上限
+CHAT_SUMMARY_TOKENS = int(os.environ.get("SAGA_CHAT_SUMMARY_TOKENS", "200"))
+
+PROMPT_TOKENS = Histogram(
+    "saga_prompt_tokens", "Estimated prompt tokens sent upstream", ("stage",),
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+TOKENS_SAVED = Counter("saga_prompt_tokens_saved_total", "Estimated prompt tokens removed by context packing", ("stage",))
+
+MessageList = List[Dict[str, str]]
+
+# 洞察報告中對詩歌 / 小說最有價值的段落
+_HIGH_VALUE = re.compile(
+    r"core|overview|feature|architecture|design|philosophy|purpose|highlight|summary|"
+    r"核心|概述|概覽|功能|特點|特点|架構|架构|設計|设计|理念|亮點|亮点|總結|总结",
+    re.IGNORECASE,
+)
+_LOW_VALUE = re.compile(
+    r"install|usage|license|contribut|changelog|reference|appendix|faq|"
+    r"安裝|安装|使用方法|授權|许可|許可|貢獻|贡献|附錄|附录",
+    re.IGNORECASE,
+)
+_HEADING = re.compile(r"^(#{1,6}\s|\*\*.+\*\*\s*$|[^\s].{0,40}[:：]\s*$)")
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """截斷到大約 budget 個 token，盡量停在換行處"""
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget - 1:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    newline = cut.rfind("\n")
+    if newline > len(cut) * 0.6:
+        cut = cut[:newline]
+    return cut.rstrip() + "…"
+
+
+def _split_sections(report: str) -> List[str]:
+    """依標題切段；沒有標題時以空行分段"""
+    sections: List[str] = []
+    current: List[str] = []
+    for line in report.splitlines():
+        if _HEADING.match(line.strip()) and current:
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if current:
+        sections.append("\n".join(current).strip())
+    if len(sections) <= 1:
+        sections = [part.strip() for part in re.split(r"\n\s*\n", report)]
+    return [section for section in sections if section]
+
+
+def trim_insight(report: str, budget: int) -> str:
+    """
+    把洞察報告縮減到 budget 個 token 以內：依段落價值（核心功能、架構、設計理念優先，
+    安裝、授權等其次；同分時越前面越重要）挑選段落，再依原順序輸出。
+    """
+    if estimate_tokens(report) <= budget:
+        return report
+    sections = _split_sections(report)
+
+    def score(index: int, section: str) -> float:
+        heading = section.splitlines()[0]
+        value = 0.0
+        if _HIGH_VALUE.search(heading):
+            value += 2
+        if _LOW_VALUE.search(heading):
+            value -= 2
+        # 開頭的概述段落最有價值
+        return value + (1.5 if index == 0 else 0) - index * 0.1
+
+    ranked = sorted(range(len(sections)), key=lambda i: -score(i, sections[i]))
+    chosen: List[int] = []
+    remaining = budget
+    for i in ranked:
+        cost = estimate_tokens(sections[i]) + 1
+        if cost <= remaining:
+            chosen.append(i)
+            remaining -= cost
+    if not chosen:
+        return truncate_to_tokens(sections[ranked[0]], budget)
+    return "\n\n".join(sections[i] for i in sorted(chosen))
+
+
+def fit_prompt(
+    stage: str,
+    make_messages: Callable[[str], MessageList],
+    text: str,
+    trim: Callable[[str, int], str] = trim_insight,
+    budget: Optional[int] = None,
+) -> MessageList:
+    """
+    以 make_messages(text) 組出提示詞；超過該階段預算時以 trim 縮減 text
+    （預算扣除模板本身的開銷），並記錄前後的 token 數。
+    """
+    budget = budget if budget is not None else PROMPT_BUDGETS[stage]
+    messages = make_messages(text)
+    before = estimate_messages_tokens(messages)
+    if before > budget and text:
+        overhead = estimate_messages_tokens(make_messages(""))
+        messages = make_messages(trim(text, max(0, budget - overhead)))
+    record_prompt(stage, messages, before)
+    return messages
+
+
+def record_prompt(stage: str, messages: MessageList, before: Optional[int] = None) -> int:
+    after = estimate_messages_tokens(messages)
+    PROMPT_TOKENS.observe(after, stage=stage)
+    if before is not None and before > after:
+        TOKENS_SAVED.inc(before - after, stage=stage)
+        logger.info(f"🧮 {stage} prompt: {after} tokens (packed from {before}, budget {PROMPT_BUDGETS.get(stage)})")
+    else:
+        logger.info(f"🧮 {stage} prompt: {after} tokens")
+    return after
+
+
+def _clean_history(history: List[Any]) -> MessageList:
+    """只保留格式正確的 user / assistant 訊息"""
+    cleaned = []
+    for item in history or []:
+        if isinstance(item, dict) and item.get("role") in ("user", "assistant") and isinstance(item.get("content"), str):
+            cleaned.append({"role": item["role"], "content": item["content"]})
+    return cleaned
+
+
+def summarize_turns(turns: MessageList, budget: int, is_english: bool = True) -> str:
+    """
+    本機抽取式摘要：每則舊訊息取第一句，濃縮成一段背景說明（不額外呼叫上游）
+    """
+    header = "Earlier conversation (summarized):" if is_english else "先前對話摘要："
+    labels = {"user": "User" if is_english else "用戶", "assistant": "Assistant" if is_english else "助手"}
+    lines = []
+    for turn in turns:
+        first = re.split(r"(?<=[.!?。！？])\s*|\n", turn["content"].strip(), maxsplit=1)[0]
+        lines.append(f"- {labels[turn['role']]}: {truncate_to_tokens(first, 40)}")
+    # 摘要超出預算時保留最近的部分
+    while lines and estimate_tokens("\n".join([header] + lines)) > budget:
+        lines.pop(0)
+    return "\n".join([header] + lines) if lines else ""
+
+
+def pack_chat_history(
+    system: str,
+    history: List[Any],
+    message: str,
+    budget: Optional[int] = None,
+    is_english: bool = True,
+    summary: Optional[str] = None,
+) -> Tuple[MessageList, Dict[str, int]]:
+    """
+    組出聊天提示詞：system 與本次訊息一定保留，其餘預算由新到舊放入對話歷史；
+    放不下的舊對話濃縮成一則摘要。summary 為伺服器端對話已有的滾動摘要。
+    回傳 (messages, 統計)。
+    """
+    budget = budget if budget is not None else PROMPT_BUDGETS["chat"]
+    turns = _clean_history(history)
+    head = [{"role": "system", "content": system}]
+    if summary:
+        label = "Conversation summary so far:" if is_english else "目前為止的對話摘要："
+        head.append({"role": "system", "content": f"{label}\n{truncate_to_tokens(summary, CHAT_SUMMARY_TOKENS * 2)}"})
+    current = {"role": "user", "content": message}
+    before = estimate_messages_tokens(head + turns + [current])
+
+    fixed = estimate_messages_tokens(head + [current])
+    if fixed > budget:
+        current = {"role": "user", "content": truncate_to_tokens(message, max(1, budget - estimate_messages_tokens(head) - 4))}
+        fixed = estimate_messages_tokens(head + [current])
+    # 有舊對話會被丟棄時，預留摘要的空間
+    reserve = CHAT_SUMMARY_TOKENS if before > budget else 0
+    remaining = budget - fixed - reserve
+
+    kept: MessageList = []
+    index = len(turns)
+    while index > 0:
+        turn = turns[index - 1]
+        cost = estimate_messages_tokens([turn])
+        if cost > remaining:
+            if not kept and remaining > 50:
+                # 最近一則訊息本身就過長時，截斷後保留
+                kept.insert(0, {"role": turn["role"], "content": truncate_to_tokens(turn["content"], remaining - 4)})
+                index -= 1
+            break
+        kept.insert(0, turn)
+        remaining -= cost
+        index -= 1
+
+    dropped = turns[:index]
+    summary = summarize_turns(dropped, CHAT_SUMMARY_TOKENS + remaining, is_english) if dropped else ""
+    if summary:
+        head.append({"role": "system", "content": summary})
+
+    messages = head + kept + [current]
+    after = record_prompt("chat", messages, before)
+    return messages, {"before": before, "after": after, "kept": len(kept), "dropped": len(dropped)}
@@ -0,0 +1,231 @@
+"""
+串流輸出防護：在 token 到達時檢查輸出，及早中止失控或退化的生成。
+
+- 長度：每個段落的字元數與（估算）token 數上限（預設略低於路由的 max_tokens）；
+- 重複：最近一段輸出中的 n-gram 重複比例過高（模型陷入迴圈、反覆同一段詩句）；
+- 語言漂移：最近一段輸出（不含程式碼）大多不是 presets 要求的語言；只檢查 poem / novel / chat。
+
+觸發時關閉上游串流（不再為後續 token 付費），長度與重複在最近的段落 / 句子邊界乾淨截斷，
+語言漂移則重新生成一次（仍漂移時截斷）。
+"""
+
+import os
+import re
+import logging
+from collections import Counter as NgramCounts, deque
+from contextlib import aclosing
+from typing import AsyncIterator, Deque, Optional, Tuple
+
+from .limits import estimate_tokens
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+GUARDS_ENABLED = os.environ.get("SAGA_GUARDS", "1") == "1"
+# 各段落的字元 / token 上限（token 為本機估算）；token 上限 0 表示依路由的 max_tokens 決定
+GUARD_LIMITS = {
+    section: (
+        int(os.environ.get(f"SAGA_{section.upper()}_MAX_CHARS", chars)),
+        int(os.environ.get(f"SAGA_{section.upper()}_MAX_OUTPUT_TOKENS", "0")),
+    )
+    for section, chars in (("insight", "12000"), ("poem", "3000"), ("novel", "12000"), ("chat", "6000"))
+}
+# token 上限取路由 max_tokens 的這個比例：在上游硬上限（常切在句子中間）之前先在段落 / 句子邊界截斷
+GUARD_TOKEN_SHARE = float(os.environ.get("SAGA_GUARD_TOKEN_SHARE", "0.9"))
+GUARD_NGRAM = int(os.environ.get("SAGA_GUARD_NGRAM", "6"))
+# 以最近這麼多個單位（英文詞 / 中文字）計算重複與語言比例
+GUARD_WINDOW = int(os.environ.get("SAGA_GUARD_WINDOW", "240"))
+GUARD_REPEAT_RATIO = float(os.environ.get("SAGA_GUARD_REPEAT_RATIO", "0.5"))
+GUARD_DRIFT_RATIO = float(os.environ.get("SAGA_GUARD_DRIFT_RATIO", "0.8"))
+# 只在這些階段檢查語言漂移；insight 是技術報告，常有大量英文識別字、路徑與依賴清單
+GUARD_DRIFT_STAGES = {s.strip() for s in os.environ.get("SAGA_GUARD_DRIFT_STAGES", "poem,novel,chat").split(",") if s.strip()}
+GUARD_RETRIES = int(os.environ.get("SAGA_GUARD_RETRIES", "1"))
+
+GUARD_TRIPS = Counter("saga_guard_trips_total", "Streaming output guard trips", ("stage", "reason", "action"))
+GUARD_TOKENS_SAVED = Counter(
+    "saga_guard_tokens_saved_total",
+    "Estimated completion tokens not generated because a guard stopped the stream (up to the route's max_tokens)",
+    ("stage",),
+)
+
+LENGTH, REPETITION, LANGUAGE = "length", "repetition", "language"
+
+# 一個中文字、一個英文詞或一個標點各算一個單位
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff"
+_UNIT = re.compile(rf"[{_CJK_RANGES}]|[^\W\d_{_CJK_RANGES}]+|\d+|[^\w\s]")
+_CJK = re.compile(rf"[{_CJK_RANGES}]")
+_LATIN = re.compile(r"[A-Za-z]")
+_BOUNDARIES = (re.compile(r"\n\s*\n"), re.compile(r"[.!?。！？…]['\"”」』)]*\s*"), re.compile(r"\n"))
+
+
+class GuardTripped(Exception):
+    def __init__(self, reason: str, cut: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.cut = cut  # 可保留的輸出長度（字元）
+
+
+class OutputGuard:
+    """逐段餵入輸出；違反任一條件時 feed() 拋出 GuardTripped"""
+
+    def __init__(self, stage: str, language: Optional[str] = None, route_max_tokens: Optional[int] = None):
+        self.stage = stage
+        self.max_chars, self.max_tokens = GUARD_LIMITS.get(stage, (0, 0))
+        if route_max_tokens:
+            derived = max(1, int(route_max_tokens * GUARD_TOKEN_SHARE))
+            self.max_tokens = min(self.max_tokens, derived) if self.max_tokens else derived
+        self.expect_cjk = None if language is None or stage not in GUARD_DRIFT_STAGES else language != "English"
+        self.text = ""
+        self._ascii = 0
+        self._wide = 0
+        self._pending = ""  # 尚未切成單位的結尾（可能是被切斷的英文詞）
+        self._units: Deque[Tuple[str, int, bool, bool]] = deque()  # (單位, 起始位置, 外語, 文字)
+        self._ngrams: NgramCounts = NgramCounts()
+        self._foreign = 0
+        self._letters = 0  # 視窗內的文字單位（不含數字、標點與程式碼），語言比例以此為分母
+        # Markdown 程式碼（``` 區塊與 `行內`）不計入語言比例
+        self._fenced = False
+        self._inline = False
+        self._ticks = 0  # 連續反引號的數量
+        self._last_end = 0
+
+    def feed(self, delta: str) -> None:
+        offset = len(self.text)
+        self.text += delta
+        if self.max_chars and len(self.text) > self.max_chars:
+            raise GuardTripped(LENGTH, self.max_chars)
+        # 與 estimate_tokens 相同的估算，但只累加這一段，不必每次重掃全文
+        ascii_chars = sum(1 for ch in delta if ord(ch) < 128)
+        self._ascii += ascii_chars
+        self._wide += len(delta) - ascii_chars
+        if self.max_tokens and self.tokens > self.max_tokens:
+            raise GuardTripped(LENGTH, self._token_cut(offset, delta, ascii_chars))
+        chunk = self._pending + delta
+        start = len(self.text) - len(chunk)
+        matches = list(_UNIT.finditer(chunk))
+        # 最後一個單位可能還沒結束，留到下一段
+        if matches and matches[-1].end() == len(chunk):
+            self._pending = chunk[matches[-1].start():]
+            matches = matches[:-1]
+        else:
+            self._pending = ""
+        for match in matches:
+            self._add(match.group().lower(), start + match.start())
+
+    @property
+    def tokens(self) -> int:
+        """目前輸出的估算 token 數（同 estimate_tokens）"""
+        return self._ascii // 4 + self._wide + 1
+
+    def _token_cut(self, offset: int, delta: str, delta_ascii: int) -> int:
+        """估算 token 數超過上限的字元位置（整段輸出一次餵入時 offset 為 0）"""
+        ascii_chars = self._ascii - delta_ascii
+        wide = self._wide - (len(delta) - delta_ascii)
+        for index, ch in enumerate(delta):
+            if ord(ch) < 128:
+                ascii_chars += 1
+            else:
+                wide += 1
+            if ascii_chars // 4 + wide + 1 > self.max_tokens:
+                return offset + index
+        return offset + len(delta)
+
+    def _in_code(self, unit: str, position: int) -> bool:
+        """依反引號更新程式碼狀態，回傳此單位是否在程式碼中"""
+        if "\n" in self.text[self._last_end:position]:
+            self._inline = False  # 行內程式碼不跨行
+        contiguous = position == self._last_end
+        self._last_end = position + len(unit)
+        if unit == "`":
+            self._ticks = self._ticks + 1 if contiguous else 1
+            return True
+        if self._ticks >= 3:
+            self._fenced = not self._fenced
+            self._inline = False
+        elif self._ticks and not self._fenced:
+            self._inline = not self._inline
+        self._ticks = 0
+        return self._fenced or self._inline
+
+    def _add(self, unit: str, position: int) -> None:
+        code = self._in_code(unit, position)
+        foreign = not code and self._is_foreign(unit)
+        letter = not code and self._is_letter(unit)
+        self._units.append((unit, position, foreign, letter))
+        self._foreign += foreign
+        self._letters += letter
+        if len(self._units) >= GUARD_NGRAM:
+            self._ngrams[self._ngram(len(self._units) - GUARD_NGRAM)] += 1
+        if len(self._units) > GUARD_WINDOW:
+            oldest = self._ngram(0)
+            self._ngrams[oldest] -= 1
+            if not self._ngrams[oldest]:
+                del self._ngrams[oldest]
+            _, _, foreign, letter = self._units.popleft()
+            self._foreign -= foreign
+            self._letters -= letter
+        if len(self._units) < GUARD_WINDOW:
+            return
+        total = len(self._units) - GUARD_NGRAM + 1
+        if 1 - len(self._ngrams) / total > GUARD_REPEAT_RATIO:
+            raise GuardTripped(REPETITION, self._first_repeat())
+        if self.expect_cjk is not None and self._letters and self._foreign / self._letters > GUARD_DRIFT_RATIO:
+            raise GuardTripped(LANGUAGE, self._units[0][1])
+
+    def _ngram(self, index: int) -> Tuple[str, ...]:
+        return tuple(self._units[i][0] for i in range(index, index + GUARD_NGRAM))
+
+    @staticmethod
+    def _is_letter(unit: str) -> bool:
+        return unit[0].isalpha()
+
+    def _is_foreign(self, unit: str) -> bool:
+        if self.expect_cjk is None:
+            return False
+        if self.expect_cjk:
+            return bool(_LATIN.match(unit))
+        return bool(_CJK.match(unit))
+
+    def _first_repeat(self) -> int:
+        """迴圈的起點：從此處到結尾，重複 n-gram 的比例都超過門檻的最早一個重複位置"""
+        count = len(self._units) - GUARD_NGRAM + 1
+        seen = set()
+        repeated = []
+        for index in range(count):
+            ngram = self._ngram(index)
+            repeated.append(ngram in seen)
+            seen.add(ngram)
+        start, tail = count - 1, 0
+        for index in range(count - 1, -1, -1):
+            tail += repeated[index]
+            if repeated[index] and tail / (count - index) > GUARD_REPEAT_RATIO:
+                start = index
+        return self._units[start][1]
+
+
+def clean_cut(text: str, cut: int) -> str:
+    """在 cut 之前最後一個段落 / 句子 / 換行邊界截斷；太短時直接在 cut 截斷"""
+    head = text[:cut]
+    for boundary in _BOUNDARIES:
+        ends = [match.end() for match in boundary.finditer(head)]
+        if ends and ends[-1] >= len(head) // 2:
+            return head[:ends[-1]].rstrip()
+    return head.rstrip()
+
+
+def record_trip(stage: str, trip: GuardTripped, action: str, text: str, max_tokens: Optional[int]) -> None:
+    GUARD_TRIPS.inc(stage=stage, reason=trip.reason, action=action)
+    if max_tokens:
+        GUARD_TOKENS_SAVED.inc(max(0, max_tokens - estimate_tokens(text)), stage=stage)
+    logger.warning(f"🛑 [{stage}] Output guard tripped ({trip.reason}) after {len(text)} chars, {action}")
+
+
+async def guarded(deltas: AsyncIterator[str], guard: OutputGuard) -> AsyncIterator[str]:
+    """
+    轉交上游的 delta 並逐段檢查；觸發時關閉上游串流再拋出 GuardTripped。
+    觸發時的那一段不會轉交。
+    """
+    async with aclosing(deltas) as stream:
+        async for delta in stream:
+            guard.feed(delta)
+            yield delta
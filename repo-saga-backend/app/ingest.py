@@ -0,0 +1,510 @@
+import os
+import io
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tarfile
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .singleflight import SingleFlight
+from .storage import SQLiteDB
+
+try:  # Python 3.11+
+    import tomllib
+except ImportError:  # pragma: no cover
+    tomllib = None
+
+logger = logging.getLogger(__name__)
+
+# 本機鏡像目錄：{SAGA_REPO_MIRROR_DIR}/{owner}/{repo} 為 git 工作目錄時直接分析，不下載
+REPO_MIRROR_DIR = os.environ.get("SAGA_REPO_MIRROR_DIR", "")
+# 沒有本機鏡像時是否從 GitHub 下載 tarball
+INGEST_DOWNLOAD = os.environ.get("SAGA_INGEST_DOWNLOAD", "1") == "1"
+GITHUB_API_BASE = os.environ.get("GITHUB_API_BASE", "https://api.github.com")
+GITHUB_CODELOAD_BASE = os.environ.get("GITHUB_CODELOAD_BASE", "https://codeload.github.com")
+# commit SHA -> 摘要的索引；空字串表示不持久化
+INGEST_DB_PATH = os.environ.get("SAGA_INGEST_DB", os.path.join("data", "ingest.sqlite3"))
+INGEST_TIMEOUT = float(os.environ.get("SAGA_INGEST_TIMEOUT", "30"))
+MAX_TARBALL_BYTES = int(float(os.environ.get("SAGA_INGEST_MAX_TARBALL_MB", "50")) * 1024 * 1024)
+MAX_FILE_BYTES = int(os.environ.get("SAGA_INGEST_MAX_FILE_KB", "512")) * 1024
+MAX_FILES = int(os.environ.get("SAGA_INGEST_MAX_FILES", "20000"))
+# 檔案數達此值時改用 process pool 掃描
+POOL_MIN_FILES = int(os.environ.get("SAGA_INGEST_POOL_MIN_FILES", "2000"))
+POOL_WORKERS = int(os.environ.get("SAGA_INGEST_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+README_EXCERPT_CHARS = int(os.environ.get("SAGA_INGEST_README_CHARS", "1200"))
+
+SKIP_DIRS = frozenset({
+    ".git", ".hg", ".svn", "node_modules", "vendor", "third_party", "dist", "build", "target",
+    "__pycache__", ".venv", "venv", ".tox", ".mypy_cache", ".pytest_cache", ".idea", ".vscode",
+    ".next", ".nuxt", "coverage", "bower_components", "Pods",
+})
+
+LANGUAGES = {
+    ".py": "Python", ".pyi": "Python", ".js": "JavaScript", ".mjs": "JavaScript", ".cjs": "JavaScript",
+    ".jsx": "JavaScript", ".ts": "TypeScript", ".tsx": "TypeScript", ".vue": "Vue", ".svelte": "Svelte",
+    ".go": "Go", ".rs": "Rust", ".java": "Java", ".kt": "Kotlin", ".kts": "Kotlin", ".scala": "Scala",
+    ".c": "C", ".h": "C", ".cc": "C++", ".cpp": "C++", ".cxx": "C++", ".hpp": "C++", ".cs": "C#",
+    ".m": "Objective-C", ".mm": "Objective-C", ".swift": "Swift", ".rb": "Ruby", ".php": "PHP",
+    ".dart": "Dart", ".lua": "Lua", ".r": "R", ".jl": "Julia", ".ex": "Elixir", ".exs": "Elixir",
+    ".erl": "Erlang", ".hs": "Haskell", ".clj": "Clojure", ".zig": "Zig", ".sh": "Shell", ".bash": "Shell",
+    ".ps1": "PowerShell", ".sql": "SQL", ".html": "HTML", ".css": "CSS", ".scss": "SCSS", ".less": "Less",
+    ".md": "Markdown", ".rst": "reStructuredText", ".json": "JSON", ".yml": "YAML", ".yaml": "YAML",
+    ".toml": "TOML", ".xml": "XML", ".ipynb": "Jupyter Notebook", ".proto": "Protocol Buffers",
+}
+# 不算「程式模組」的語言（不列入最大模組）
+NON_CODE = frozenset({"Markdown", "reStructuredText", "JSON", "YAML", "TOML", "XML", "HTML", "CSS", "SCSS", "Less"})
+
+MANIFESTS = {
+    "package.json": "npm", "requirements.txt": "pip", "pyproject.toml": "python", "setup.py": "python",
+    "setup.cfg": "python", "Pipfile": "pipenv", "go.mod": "go", "Cargo.toml": "cargo", "Gemfile": "bundler",
+    "pom.xml": "maven", "build.gradle": "gradle", "build.gradle.kts": "gradle", "composer.json": "composer",
+    "pubspec.yaml": "pub", "mix.exs": "mix", "CMakeLists.txt": "cmake", "Dockerfile": "docker",
+}
+ENTRY_POINT_NAMES = frozenset({
+    "main.py", "__main__.py", "app.py", "manage.py", "wsgi.py", "asgi.py", "cli.py", "server.py",
+    "index.js", "index.ts", "main.js", "main.ts", "server.js", "server.ts", "app.js", "app.ts",
+    "main.go", "main.rs", "lib.rs", "Main.java", "Program.cs", "main.c", "main.cpp",
+})
+
+ingest_flights: SingleFlight = SingleFlight("ingest")
+
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def set_transport(transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    """替換 GitHub 的 transport（測試時指向本機假 GitHub）"""
+    global _transport
+    _transport = transport
+
+
+class DigestIndex(SQLiteDB):
+    """
+    以 (倉庫, commit SHA) 索引的倉庫摘要；同一個版本的分析結果永遠不變，因此不設 TTL。
+    fork、鏡像或改名的倉庫可能有相同的 SHA，但摘要中記錄的倉庫名稱不同，因此各自一筆。
+    """
+
+    SCHEMA = """
+        DROP TABLE IF EXISTS digests;
+        CREATE TABLE IF NOT EXISTS repo_digests (
+            repo       TEXT NOT NULL,
+            revision   TEXT NOT NULL,
+            digest     TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (repo, revision)
+        );
+    """
+
+    def get(self, repo: str, revision: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT digest FROM repo_digests WHERE repo = ? AND revision = ?", (repo.lower(), revision)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, repo: str, revision: str, digest: Dict[str, Any]) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO repo_digests (repo, revision, digest, created_at) VALUES (?, ?, ?, ?)",
+            (repo.lower(), revision, json.dumps(digest, ensure_ascii=False), time.time()),
+        )
+
+
+_indexes: Dict[str, DigestIndex] = {}
+
+
+def get_index() -> Optional[DigestIndex]:
+    if not INGEST_DB_PATH:
+        return None
+    index = _indexes.get(INGEST_DB_PATH)
+    if index is None:
+        index = _indexes[INGEST_DB_PATH] = DigestIndex(INGEST_DB_PATH)
+    return index
+
+
+# ---- 檔案掃描（可在子行程中執行，因此只用模組層級的純函式） ----
+
+def _scan_file(root: str, rel: str) -> Tuple[str, Optional[str], int, int]:
+    """回傳 (相對路徑, 語言或 None 表示二進位檔, 位元組數, 行數)"""
+    with open(os.path.join(root, rel), "rb") as f:
+        data = f.read(MAX_FILE_BYTES + 1)
+    if b"\0" in data[:8192]:
+        return rel, None, len(data), 0
+    language = LANGUAGES.get(os.path.splitext(rel)[1].lower(), "Other")
+    return rel, language, len(data), data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+
+def _scan_batch(root: str, rels: List[str]) -> List[Tuple[str, Optional[str], int, int]]:
+    results = []
+    for rel in rels:
+        try:
+            results.append(_scan_file(root, rel))
+        except OSError:
+            continue
+    return results
+
+
+def _list_tree(root: str) -> Tuple[List[Tuple[str, int, int]], Dict[str, int]]:
+    """走訪目錄，回傳 [(相對路徑, 大小, mtime_ns)] 與略過的統計"""
+    files: List[Tuple[str, int, int]] = []
+    skipped = {"excluded": 0, "too_large": 0, "binary": 0, "over_limit": 0}
+    for dirpath, dirnames, filenames in os.walk(root):
+        kept = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith(".")]
+        skipped["excluded"] += len(dirnames) - len(kept)
+        dirnames[:] = sorted(kept)
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                continue
+            if len(files) >= MAX_FILES:
+                skipped["over_limit"] += 1
+                continue
+            st = os.stat(path)
+            if st.st_size > MAX_FILE_BYTES:
+                skipped["too_large"] += 1
+                continue
+            files.append((os.path.relpath(path, root).replace(os.sep, "/"), st.st_size, st.st_mtime_ns))
+    return files, skipped
+
+
+def _scan_tree(root: str, rels: List[str]) -> List[Tuple[str, Optional[str], int, int]]:
+    if len(rels) < POOL_MIN_FILES or POOL_WORKERS <= 1:
+        return _scan_batch(root, rels)
+    chunk = max(200, len(rels) // (POOL_WORKERS * 4))
+    batches = [rels[i:i + chunk] for i in range(0, len(rels), chunk)]
+    logger.info(f"🧵 Scanning {len(rels)} files with {POOL_WORKERS} processes")
+    # spawn：本行程有多個執行緒，fork 不安全
+    with ProcessPoolExecutor(POOL_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results: List[Tuple[str, Optional[str], int, int]] = []
+        for part in pool.map(_scan_batch, [root] * len(batches), batches):
+            results.extend(part)
+    return results
+
+
+# ---- 摘要 ----
+
+def _read_text(root: str, rel: str, limit: int = 64 * 1024) -> str:
+    try:
+        with open(os.path.join(root, rel), "r", encoding="utf-8", errors="replace") as f:
+            return f.read(limit)
+    except OSError:
+        return ""
+
+
+def _manifest_dependencies(kind: str, name: str, text: str) -> Tuple[List[str], List[str]]:
+    """回傳 (相依套件, 宣告的入口點)"""
+    deps: List[str] = []
+    entries: List[str] = []
+    try:
+        if name in ("package.json", "composer.json"):
+            data = json.loads(text)
+            deps = list((data.get("dependencies") or data.get("require") or {}).keys())
+            if isinstance(data.get("main"), str):
+                entries.append(data["main"])
+            bin_field = data.get("bin")
+            if isinstance(bin_field, str):
+                entries.append(bin_field)
+            elif isinstance(bin_field, dict):
+                entries.extend(v for v in bin_field.values() if isinstance(v, str))
+        elif name == "requirements.txt":
+            for line in text.splitlines():
+                line = line.split("#")[0].strip()
+                if line and not line.startswith("-"):
+                    deps.append(_requirement_name(line))
+        elif name in ("pyproject.toml", "Cargo.toml") and tomllib is not None:
+            data = tomllib.loads(text)
+            if name == "pyproject.toml":
+                project = data.get("project", {})
+                deps = [_requirement_name(d) for d in project.get("dependencies", [])]
+                if not deps:
+                    deps = [d for d in data.get("tool", {}).get("poetry", {}).get("dependencies", {}) if d != "python"]
+                entries.extend(f"{k} = {v}" for k, v in project.get("scripts", {}).items())
+            else:
+                deps = list(data.get("dependencies", {}).keys())
+        elif name == "go.mod":
+            for line in text.splitlines():
+                parts = line.strip().split()
+                if parts and "/" in parts[0] and not parts[0].startswith("//") and parts[0] != "module":
+                    deps.append(parts[0])
+                elif len(parts) >= 2 and parts[0] == "require" and parts[1] != "(":
+                    deps.append(parts[1])
+        elif name == "Gemfile":
+            for line in text.splitlines():
+                line = line.strip()
+                if line.startswith("gem "):
+                    deps.append(line.split()[1].strip("'\","))
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.warning(f"⚠️ Could not parse {name}: {e}")
+    return deps, entries
+
+
+def _requirement_name(spec: str) -> str:
+    for sep in ("[", "=", "<", ">", "~", "!", ";", " "):
+        spec = spec.split(sep)[0]
+    return spec.strip()
+
+
+def _readme_excerpt(text: str) -> str:
+    """去掉徽章、HTML 與空行，保留開頭的說明文字"""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith(("<", "[![", "![")):
+            continue
+        lines.append(stripped)
+        if sum(len(l) for l in lines) >= README_EXCERPT_CHARS:
+            break
+    return "\n".join(lines)[:README_EXCERPT_CHARS]
+
+
+def build_digest(root: str, repo: str, revision: str, files: List[Tuple[str, int, int]],
+                 skipped: Dict[str, int]) -> Dict[str, Any]:
+    """掃描 files 並彙整成精簡的結構化摘要"""
+    scanned = _scan_tree(root, [rel for rel, _, _ in files])
+    by_language: Dict[str, Dict[str, int]] = {}
+    modules: List[Tuple[int, str]] = []
+    total_bytes = 0
+    for rel, language, size, lines in scanned:
+        if language is None:
+            skipped["binary"] += 1
+            continue
+        total_bytes += size
+        bucket = by_language.setdefault(language, {"files": 0, "lines": 0, "bytes": 0})
+        bucket["files"] += 1
+        bucket["lines"] += lines
+        bucket["bytes"] += size
+        if language not in NON_CODE and language != "Other":
+            modules.append((lines, rel))
+
+    code_bytes = sum(v["bytes"] for k, v in by_language.items() if k != "Other") or 1
+    languages = [
+        {"language": name, "files": v["files"], "lines": v["lines"], "share": round(v["bytes"] / code_bytes, 3)}
+        for name, v in sorted(by_language.items(), key=lambda item: -item[1]["bytes"])
+        if name != "Other"
+    ][:8]
+
+    manifests = []
+    entry_points: List[str] = []
+    readme = ""
+    for rel, _, _ in files:
+        name = rel.rsplit("/", 1)[-1]
+        depth = rel.count("/")
+        if name in MANIFESTS and depth <= 2:
+            deps, entries = _manifest_dependencies(MANIFESTS[name], name, _read_text(root, rel))
+            manifests.append({"path": rel, "kind": MANIFESTS[name], "dependencies": deps[:15]})
+            entry_points.extend(entries)
+        if name in ENTRY_POINT_NAMES and depth <= 3:
+            entry_points.append(rel)
+        if not readme and depth == 0 and name.lower().startswith("readme"):
+            readme = _readme_excerpt(_read_text(root, rel))
+
+    return {
+        "repo": repo,
+        "revision": revision,
+        "files": len(scanned) - skipped["binary"],
+        "bytes": total_bytes,
+        "skipped": skipped,
+        "languages": languages,
+        "manifests": manifests[:10],
+        "entry_points": list(dict.fromkeys(entry_points))[:10],
+        "readme": readme,
+        "largest_modules": [{"path": rel, "lines": lines} for lines, rel in sorted(modules, reverse=True)[:8]],
+    }
+
+
+def format_digest(digest: Dict[str, Any]) -> str:
+    """把摘要轉成注入洞察提示詞的精簡文字"""
+    out = [f"Repository: {digest['repo']} @ {digest['revision'][:12]}",
+           f"Files analysed: {digest['files']} ({digest['bytes'] // 1024} KiB)"]
+    if digest["languages"]:
+        out.append("Languages: " + ", ".join(
+            f"{item['language']} {item['share'] * 100:.0f}% ({item['files']} files)" for item in digest["languages"]
+        ))
+    for manifest in digest["manifests"]:
+        deps = ", ".join(manifest["dependencies"]) or "-"
+        out.append(f"Manifest {manifest['path']} ({manifest['kind']}): {deps}")
+    if digest["entry_points"]:
+        out.append("Entry points: " + ", ".join(digest["entry_points"]))
+    if digest["largest_modules"]:
+        out.append("Largest modules: " + ", ".join(
+            f"{item['path']} ({item['lines']} lines)" for item in digest["largest_modules"]
+        ))
+    if digest["readme"]:
+        out.append("README excerpt:\n" + digest["readme"])
+    return "\n".join(out)
+
+
+# ---- 來源：本機路徑 / 鏡像 / GitHub tarball ----
+
+def git_head_sha(path: str) -> Optional[str]:
+    """不呼叫 git 指令，直接讀 .git 取得 HEAD 的 commit SHA"""
+    git_dir = os.path.join(path, ".git")
+    if os.path.isfile(git_dir):  # worktree / submodule: "gitdir: <path>"
+        text = _read_text(path, ".git").strip()
+        if not text.startswith("gitdir:"):
+            return None
+        git_dir = os.path.join(path, text[len("gitdir:"):].strip())
+    head = _read_text(git_dir, "HEAD").strip()
+    if not head:
+        return None
+    if not head.startswith("ref:"):
+        return head
+    ref = head[len("ref:"):].strip()
+    sha = _read_text(git_dir, ref).strip()
+    if sha:
+        return sha
+    for line in _read_text(git_dir, "packed-refs", limit=4 * 1024 * 1024).splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+    return None
+
+
+def _tree_fingerprint(files: List[Tuple[str, int, int]]) -> str:
+    """非 git 目錄以檔案清單（路徑、大小、修改時間）作為版本"""
+    h = hashlib.sha256()
+    for rel, size, mtime in files:
+        h.update(f"{rel}\0{size}\0{mtime}\n".encode("utf-8"))
+    return "tree:" + h.hexdigest()[:40]
+
+
+def ingest_path(root: str, repo: str, revision: Optional[str] = None) -> Dict[str, Any]:
+    """分析本機目錄（同步，耗時；請在執行緒中呼叫）。相同版本命中索引時不重新掃描。"""
+    started = time.perf_counter()
+    revision = revision or git_head_sha(root)
+    index = get_index()
+    if revision and index is not None:
+        digest = index.get(repo, revision)
+        if digest is not None:
+            return digest
+    files, skipped = _list_tree(root)
+    if revision is None:
+        revision = _tree_fingerprint(files)
+        if index is not None:
+            digest = index.get(repo, revision)
+            if digest is not None:
+                return digest
+    digest = build_digest(root, repo, revision, files, skipped)
+    if index is not None:
+        index.put(repo, revision, digest)
+    logger.info(
+        f"🔬 Ingested {repo}@{revision[:12]}: {digest['files']} files "
+        f"in {(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    return digest
+
+
+def mirror_path(owner: str, repo: str) -> Optional[str]:
+    if not REPO_MIRROR_DIR:
+        return None
+    for candidate in (os.path.join(REPO_MIRROR_DIR, owner, repo), os.path.join(REPO_MIRROR_DIR, owner.lower(), repo.lower())):
+        if os.path.isdir(candidate):
+            return candidate
+    return None
+
+
+def github_headers() -> Dict[str, str]:
+    headers = {"User-Agent": "repo-saga"}
+    token = os.environ.get("GITHUB_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+
+async def resolve_head_sha(client: httpx.AsyncClient, owner: str, repo: str) -> str:
+    resp = await client.get(
+        f"{GITHUB_API_BASE}/repos/{owner}/{repo}/commits/HEAD",
+        headers={**github_headers(), "Accept": "application/vnd.github.sha"},
+    )
+    resp.raise_for_status()
+    return resp.text.strip()
+
+
+def _extract_tarball(data: bytes, dest: str) -> str:
+    """
+    解壓 GitHub tarball 到 dest，只取一般檔案且不超過單檔上限；
+    拒絕絕對路徑與 ".."。回傳倉庫根目錄（tarball 內唯一的頂層目錄）。
+    """
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+        top = None
+        for member in tar:
+            parts = member.name.split("/")
+            if top is None:
+                top = parts[0]
+            if not member.isfile() or member.size > MAX_FILE_BYTES:
+                continue
+            if member.name.startswith("/") or ".." in parts or parts[0] != top:
+                continue
+            if any(part in SKIP_DIRS for part in parts[1:-1]):
+                continue
+            target = os.path.join(dest, *parts)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            source = tar.extractfile(member)
+            if source is not None:
+                with open(target, "wb") as f:
+                    f.write(source.read())
+    return os.path.join(dest, top or "")
+
+
+async def _download_tarball(client: httpx.AsyncClient, owner: str, repo: str, sha: str) -> bytes:
+    chunks: List[bytes] = []
+    size = 0
+    async with client.stream(
+        "GET", f"{GITHUB_CODELOAD_BASE}/{owner}/{repo}/tar.gz/{sha}", headers=github_headers()
+    ) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            if size > MAX_TARBALL_BYTES:
+                raise ValueError(f"tarball exceeds {MAX_TARBALL_BYTES} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _ingest_from_github(owner: str, repo: str, revision: Optional[str] = None) -> Dict[str, Any]:
+    name = f"{owner}/{repo}".lower()
+    async with httpx.AsyncClient(timeout=INGEST_TIMEOUT, follow_redirects=True, transport=_transport) as client:
+        sha = revision or await resolve_head_sha(client, owner, repo)
+        index = get_index()
+        if index is not None:
+            digest = await asyncio.to_thread(index.get, name, sha)
+            if digest is not None:
+                return digest
+        data = await _download_tarball(client, owner, repo, sha)
+
+    def analyse() -> Dict[str, Any]:
+        with tempfile.TemporaryDirectory(prefix="saga-ingest-") as tmp:
+            return ingest_path(_extract_tarball(data, tmp), name, revision=sha)
+
+    return await asyncio.to_thread(analyse)
+
+
+async def _ingest(owner: str, repo: str, revision: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    mirror = mirror_path(owner, repo)
+    if mirror is not None:
+        return await asyncio.to_thread(ingest_path, mirror, f"{owner}/{repo}".lower())
+    if INGEST_DOWNLOAD:
+        return await _ingest_from_github(owner, repo, revision)
+    return None
+
+
+async def get_repo_digest(owner: str, repo: str, revision: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    取得倉庫摘要；來源依序為本機鏡像、GitHub tarball。
+    已知 head SHA（revision，見 repo_meta.py）時直接以它查索引，不再查詢 HEAD。
+    任何失敗（網路、逾時、超過大小上限）都只記錄並回傳 None，洞察階段退回純推論。
+    """
+    if owner == "unknown":
+        return None
+    try:
+        return await ingest_flights.do(
+            f"{owner}/{repo}".lower(),
+            lambda: asyncio.wait_for(_ingest(owner, repo, revision), INGEST_TIMEOUT),
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Repository ingestion failed for {owner}/{repo}: {e!r}")
+        return None
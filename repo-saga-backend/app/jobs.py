@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from dataclasses import replace
+from typing import Any, Dict, List, Optional
+
+from .limits import current_client
+from .metrics import Histogram
+from .pipeline import Stage, StageError, run_stages
+from .services import build_saga_stages, extract_repo_info_from_url
+from .storage import SQLiteDB
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.environ.get("SAGA_JOB_DB", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("SAGA_JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.environ.get("SAGA_JOB_QUEUE_SIZE", "100"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+# 本行程的識別，用於判斷 running 狀態的工作是否屬於已結束的 worker
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+JOB_QUEUE_WAIT = Histogram("saga_job_queue_wait_seconds", "Time from job submission until a worker starts it")
+
+
+class JobQueueFull(Exception):
+    """工作佇列已滿，呼叫端應回應 503 讓客戶端稍後重試"""
+
+
+class JobCancelled(Exception):
+    """工作已在（可能是其他 worker 上的）DELETE 中被取消"""
+
+
+class JobStore(SQLiteDB):
+    """
+    工作狀態的持久化儲存。每個階段完成時即寫入其輸出，
+    worker 重啟後恢復執行時不會重算已完成的階段。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        request TEXT NOT NULL,
+        stages TEXT NOT NULL,
+        error TEXT,
+        owner TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+    """
+
+    def create(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "request": request,
+            "stages": {},
+            "error": None,
+            "owner": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, request, stages, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job["id"], QUEUED, json.dumps(request, ensure_ascii=False), "{}", now, now),
+        )
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT id, status, request, stages, error, owner, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "request": json.loads(row[2]),
+            "stages": json.loads(row[3]),
+            "error": row[4],
+            "owner": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+    def claim(self, job_id: str) -> bool:
+        """原子地把 queued 工作標記為本行程執行中；多個 worker 搶同一工作時只有一個成功"""
+        cur = self._connect().execute(
+            "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, OWNER, time.time(), job_id, QUEUED),
+        )
+        return cur.rowcount == 1
+
+    def save_stages(self, job_id: str, stages: Dict[str, Any]) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET stages = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(stages, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> bool:
+        """設定最終狀態；已是最終狀態（例如已取消）的工作不會被覆寫"""
+        cur = self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status NOT IN (?, ?, ?)",
+            (status, error, time.time(), job_id, *FINAL_STATES),
+        )
+        return cur.rowcount == 1
+
+    def status(self, job_id: str) -> Optional[str]:
+        row = self._connect().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def recoverable(self) -> List[str]:
+        """
+        重啟時需要重新排入的工作：仍在排隊的，以及執行者行程已不存在的 running 工作
+        """
+        conn = self._connect()
+        for job_id, owner in conn.execute(
+            "SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)
+        ).fetchall():
+            if not _owner_alive(owner):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL WHERE id = ? AND owner IS ?",
+                    (QUEUED, job_id, owner),
+                )
+        return [
+            row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        ]
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    if not owner or owner == OWNER:
+        # 自己剛啟動，之前以同樣 pid 記錄的工作必然來自已結束的行程
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobManager:
+    """
+    有界的工作池：POST /jobs 立即回傳 id，實際生成由固定數量的 worker task 執行。
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE):
+        self.store = store
+        self.workers = workers
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        # 進行中階段的即時進度（只存在於執行該工作的行程）
+        self._live: Dict[str, Dict[str, Any]] = {}
+
+    async def start(self) -> None:
+        recovered = await asyncio.to_thread(self.store.recoverable)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)
+        ]
+        if recovered:
+            self._worker_tasks.append(asyncio.create_task(self._feed(recovered), name="job-feeder"))
+
+    async def _feed(self, job_ids: List[str]) -> None:
+        """恢復的工作可能多於佇列容量：隨 worker 消化逐一排入，超出的部分不會停在 queued"""
+        if len(job_ids) > self.queue.maxsize > 0:
+            logger.info(f"📥 Recovering {len(job_ids)} jobs, feeding them in as the queue drains")
+        for job_id in job_ids:
+            await self.queue.put(job_id)
+
+    async def stop(self) -> None:
+        # 關閉時不標記取消：running 工作保留原狀，下次啟動由 recoverable() 接手
+        tasks = list(self._running.values()) + self._worker_tasks
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, repo_url: str, presets: Dict[str, str]) -> Dict[str, Any]:
+        if self.queue.full():
+            raise JobQueueFull()
+        request = {"url": repo_url, "presets": presets, "client": current_client.get()}
+        job = await asyncio.to_thread(self.store.create, request)
+        try:
+            self.queue.put_nowait(job["id"])
+        except asyncio.QueueFull:
+            await asyncio.to_thread(self.store.finish, job["id"], FAILED, "job queue full")
+            raise JobQueueFull()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job_id in self._live:
+            job["stages"] = dict(job["stages"], **self._live[job_id])
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        await asyncio.to_thread(self.store.finish, job_id, CANCELLED)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        return await self.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                if not await asyncio.to_thread(self.store.claim, job_id):
+                    continue
+                task = asyncio.create_task(self._run(job_id), name=f"job:{job_id}")
+                self._running[job_id] = task
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    if not task.cancelled():
+                        raise
+            except Exception as e:
+                logger.error(f"❌ Job worker error on {job_id}: {e}")
+            finally:
+                self._running.pop(job_id, None)
+                self._live.pop(job_id, None)
+                self.queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        try:
+            await self._execute(job_id)
+        except Exception as e:
+            # 非階段錯誤（讀寫資料庫、無效的 URL 等）也要結束工作，否則 owner 仍存活、永遠停在 running
+            logger.error(f"❌ Job {job_id} failed: {e!r}")
+            await asyncio.to_thread(self.store.finish, job_id, FAILED, repr(e))
+
+    async def _execute(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        JOB_QUEUE_WAIT.observe(max(0.0, time.time() - job["created_at"]))
+        stages_state: Dict[str, Any] = job["stages"]
+        live = self._live.setdefault(job_id, {})
+        url, presets = job["request"]["url"], job["request"]["presets"]
+        # 上游排程仍以提交工作的客戶端計算公平份額
+        current_client.set(job["request"].get("client", "anonymous"))
+        owner, repo = extract_repo_info_from_url(url)
+        logger.info(f"🧵 Running job {job_id} for {owner}/{repo}")
+        # poem 與 novel 並發完成：寫入需序列化，並在 event loop 上取快照，避免較舊的快照覆寫較新的
+        save_lock = asyncio.Lock()
+
+        async def save_stages() -> None:
+            async with save_lock:
+                await asyncio.to_thread(self.store.save_stages, job_id, dict(stages_state))
+
+        def tracked(stage: Stage) -> Stage:
+            async def run(deps: Dict[str, str]) -> str:
+                previous = stages_state.get(stage.name, {})
+                if previous.get("status") == DONE:
+                    return previous["output"]
+                # 其他 worker 上的 DELETE 只會寫入資料庫，在每個階段開始前檢查
+                if await asyncio.to_thread(self.store.status, job_id) == CANCELLED:
+                    raise JobCancelled()
+                started = time.perf_counter()
+                live[stage.name] = {"status": RUNNING}
+                output = await stage.run(deps)
+                live.pop(stage.name, None)
+                stages_state[stage.name] = {
+                    "status": DONE,
+                    "chars": len(output),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000),
+                    "output": output,
+                }
+                await save_stages()
+                return output
+            return replace(stage, run=run)
+
+        try:
+            await run_stages([tracked(stage) for stage in build_saga_stages(owner, repo, presets)])
+        except asyncio.CancelledError:
+            logger.info(f"🛑 Job {job_id} stopped")
+            raise
+        except StageError as e:
+            if isinstance(e.cause, JobCancelled):
+                logger.info(f"🛑 Job {job_id} cancelled")
+                return
+            stages_state[e.stage] = {"status": FAILED, "error": str(e.cause)}
+            await save_stages()
+            await asyncio.to_thread(self.store.finish, job_id, FAILED, str(e))
+            return
+        await asyncio.to_thread(self.store.finish, job_id, DONE)
+        logger.info(f"✅ Job {job_id} done")
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """對外的工作狀態（不含各階段全文）"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "repo_url": job["request"]["url"],
+        "stages": {
+            name: {k: v for k, v in stage.items() if k != "output"}
+            for name, stage in job["stages"].items()
+        },
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def job_result(job: Dict[str, Any]) -> Dict[str, str]:
+    """已完成工作的生成結果（與 LiteraryWorkResponse 欄位相同）"""
+    stages = job["stages"]
+    return {
+        "repo_url": job["request"]["url"],
+        "insight_report": stages["insight"]["output"],
+        "poem": stages["poem"]["output"],
+        "novel": stages["novel"]["output"],
+    }
+
+
+_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    if _manager is None:
+        raise RuntimeError("Job manager is not running")
+    return _manager
+
+
+async def start_job_manager() -> JobManager:
+    """於應用啟動時呼叫：開啟工作資料庫並恢復未完成的工作"""
+    global _manager
+    _manager = JobManager(JobStore(JOB_DB_PATH))
+    await _manager.start()
+    return _manager
+
+
+async def stop_job_manager() -> None:
+    global _manager
+    if _manager is not None:
+        await _manager.stop()
+        _manager = None
@@ -0,0 +1,348 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# 同時在途的上游呼叫上限
+UPSTREAM_MAX_IN_FLIGHT = int(os.environ.get("UPSTREAM_MAX_IN_FLIGHT", "16"))
+# 每分鐘請求數 / token 數預算（0 表示不限）
+UPSTREAM_RPM = float(os.environ.get("UPSTREAM_RPM", "0"))
+UPSTREAM_TPM = float(os.environ.get("UPSTREAM_TPM", "0"))
+# 估算 TPM 時，每個呼叫預期的輸出 token 數（實際用量回來後會校正）
+UPSTREAM_EXPECTED_OUTPUT_TOKENS = int(os.environ.get("UPSTREAM_EXPECTED_OUTPUT_TOKENS", "1024"))
+# 上游 429 且未給 Retry-After 時的退避起點與上限（秒）
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "1"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "60"))
+# 等待上游配額的請求數超過此值時，HTTP 層直接回應 503
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "5"))
+
+# 上游名額的排程：優先等級 chat > generate > batch，同等級內依客戶端做加權公平佇列
+PRIORITIES = ("chat", "generate", "batch")
+# 每等待這麼多秒提升一個優先等級，低優先的工作不會餓死
+SCHED_AGING_SECONDS = float(os.environ.get("SAGA_SCHED_AGING_SECONDS", "10"))
+# 客戶端權重，例如 "warmer=0.5,partner=2"（未列出的為 1）
+SCHED_CLIENT_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (
+        item.partition("=") for item in os.environ.get("SAGA_SCHED_CLIENT_WEIGHTS", "").split(",") if "=" in item
+    )
+}
+# 位於可信任的閘道之後時，以此標頭識別客戶端；未設定時使用連線的來源 IP
+CLIENT_ID_HEADER = os.environ.get("SAGA_CLIENT_ID_HEADER", "")
+
+# 目前請求的優先等級與客戶端；與 current_stage 一樣會被衍生的 task 繼承
+current_priority: ContextVar[str] = ContextVar("saga_priority", default="generate")
+current_client: ContextVar[str] = ContextVar("saga_client", default="anonymous")
+
+QUEUE_DEPTH = Gauge("saga_upstream_queue_depth", "Upstream calls waiting for a limiter slot")
+IN_FLIGHT = Gauge("saga_upstream_in_flight", "Upstream calls currently in flight")
+WAIT_SECONDS = Histogram("saga_upstream_wait_seconds", "Time spent waiting for a limiter slot")
+THROTTLED = Counter("saga_upstream_throttled_total", "Upstream 429 responses")
+ADMISSION_REJECTED = Counter("saga_admission_rejected_total", "Requests rejected with 503 by admission control", ("path",))
+SCHED_WAIT = Histogram(
+    "saga_scheduler_wait_seconds", "Time queued for an upstream slot per priority class", ("priority",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+SCHED_DISPATCHED = Counter(
+    "saga_scheduler_dispatched_total", "Queued upstream calls granted a slot; aged = promoted past a higher class",
+    ("priority", "aged"),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略的本機 token 估算：ASCII 約 4 字元一個 token，CJK 約 1 字一個 token
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m.get("content", "")) + 4 for m in messages)
+
+
+class TokenBucket:
+    """
+    以預約方式運作的 token bucket：額度不足時先預扣（可為負），回傳需要等待的秒數，
+    因此先到的呼叫先取得額度。
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self, amount: float) -> None:
+        """以實際用量校正預估（amount 可為負，代表多用了）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish: float  # 同等級內的虛擬完成時間（加權公平佇列）
+    seq: int
+    priority: str = field(compare=False)
+    client: str = field(compare=False)
+    enqueued: float = field(compare=False)
+    future: "asyncio.Future[None]" = field(compare=False)
+
+
+class FairScheduler:
+    """
+    取代單純的 semaphore：名額用完時依序排隊，釋放時挑出下一個。
+    - 等級之間為嚴格優先（chat > generate > batch），但每等 aging 秒提升一級；
+    - 同等級內以加權公平佇列（WFQ）在客戶端之間分配，成本為預估的 token 數，
+      同一客戶端送出再多工作，也只是排在自己的序列後面。
+    """
+
+    def __init__(self, slots: int, aging: float = SCHED_AGING_SECONDS, weights: Optional[Dict[str, float]] = None):
+        self.free = slots
+        self.aging = aging
+        self.weights = SCHED_CLIENT_WEIGHTS if weights is None else weights
+        self._queues: Dict[str, List[_Waiter]] = {priority: [] for priority in PRIORITIES}
+        self._virtual: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._seq = 0
+
+    def queued(self) -> int:
+        return sum(1 for queue in self._queues.values() for waiter in queue if not waiter.future.done())
+
+    async def acquire(self, priority: str, client: str, cost: float) -> None:
+        if priority not in self._queues:
+            priority = "generate"
+        if self.free > 0 and not self.queued():
+            self.free -= 1
+            SCHED_WAIT.observe(0.0, priority=priority)
+            return
+        flow = (priority, client)
+        start = max(self._virtual[priority], self._last_finish.get(flow, 0.0))
+        finish = start + max(1.0, cost) / self.weights.get(client, 1.0)
+        self._last_finish[flow] = finish
+        self._seq += 1
+        waiter = _Waiter(finish, self._seq, priority, client, time.monotonic(), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[priority], waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # 已分配到名額後才被取消：交給下一個
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        waiter = self._next()
+        if waiter is None:
+            self.free += 1
+            return
+        waited = time.monotonic() - waiter.enqueued
+        SCHED_WAIT.observe(waited, priority=waiter.priority)
+        waiter.future.set_result(None)
+
+    def _next(self) -> Optional[_Waiter]:
+        now = time.monotonic()
+        best: Optional[Tuple[float, int, str]] = None
+        for rank, priority in enumerate(PRIORITIES):
+            queue = self._queues[priority]
+            while queue and queue[0].future.done():  # 已取消的等待者
+                heapq.heappop(queue)
+            if not queue:
+                continue
+            head = queue[0]
+            effective = rank - (now - head.enqueued) / self.aging if self.aging > 0 else rank
+            candidate = (effective, head.seq, priority)
+            if best is None or candidate < best:
+                best = candidate
+        if best is None:
+            self._last_finish.clear()  # 佇列清空時重設，閒置的客戶端不累積額度
+            return None
+        effective, _, priority = best
+        waiter = heapq.heappop(self._queues[priority])
+        self._virtual[priority] = max(self._virtual[priority], waiter.finish)
+        aged = effective < PRIORITIES.index(priority) and any(
+            queue for other, queue in self._queues.items() if PRIORITIES.index(other) < PRIORITIES.index(priority)
+        )
+        SCHED_DISPATCHED.inc(priority=priority, aged="true" if aged else "false")
+        return waiter
+
+
+class UpstreamLimiter:
+    """
+    上游呼叫的全域限制器：並發上限、RPM/TPM 預算，以及依 429 / Retry-After 的自適應退避。
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = UPSTREAM_MAX_IN_FLIGHT,
+        rpm: float = UPSTREAM_RPM,
+        tpm: float = UPSTREAM_TPM,
+    ):
+        self.max_in_flight = max_in_flight
+        self.scheduler = FairScheduler(max_in_flight)
+        self.rpm = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm = TokenBucket(tpm) if tpm > 0 else None
+        self.blocked_until = 0.0
+        self._consecutive_throttles = 0
+        self.waiting = 0
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0) -> AsyncIterator["Reservation"]:
+        """
+        取得一個上游呼叫名額；離開時釋放。可透過 Reservation.settle() 回報實際 token 用量。
+        名額不足時依 current_priority / current_client 排隊（見 FairScheduler）。
+        """
+        started = time.monotonic()
+        self.waiting += 1
+        QUEUE_DEPTH.inc()
+        try:
+            delay = 0.0
+            if self.rpm is not None:
+                delay = max(delay, self.rpm.reserve(1))
+            if self.tpm is not None:
+                delay = max(delay, self.tpm.reserve(estimated_tokens))
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.scheduler.acquire(current_priority.get(), current_client.get(), estimated_tokens)
+            try:
+                await self.wait_backoff()
+            except BaseException:
+                self.scheduler.release()
+                raise
+        finally:
+            self.waiting -= 1
+            QUEUE_DEPTH.dec()
+        WAIT_SECONDS.observe(time.monotonic() - started)
+
+        self.in_flight += 1
+        IN_FLIGHT.inc()
+        try:
+            yield Reservation(self, estimated_tokens)
+        finally:
+            self.in_flight -= 1
+            IN_FLIGHT.dec()
+            self.scheduler.release()
+
+    async def wait_backoff(self) -> None:
+        while True:
+            remaining = self.blocked_until - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    def throttled(self, retry_after: Optional[float]) -> float:
+        """
+        上游回應 429：暫停所有呼叫到 Retry-After 指定的時間；沒有 Retry-After 時以指數退避。
+        回傳退避秒數。
+        """
+        THROTTLED.inc()
+        self._consecutive_throttles += 1
+        if retry_after is None:
+            retry_after = min(
+                UPSTREAM_BACKOFF_MAX,
+                UPSTREAM_BACKOFF_BASE * 2 ** (self._consecutive_throttles - 1),
+            )
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.warning(f"⏳ Upstream throttled, backing off {retry_after:.1f}s")
+        return retry_after
+
+    def succeeded(self) -> None:
+        self._consecutive_throttles = 0
+
+    def retry_after_hint(self) -> int:
+        """給被拒絕的客戶端的 Retry-After 秒數：正在退避時取剩餘時間，否則用預設值"""
+        remaining = self.blocked_until - time.monotonic()
+        return math.ceil(remaining) if remaining > 0 else ADMISSION_RETRY_AFTER
+
+
+class Reservation:
+    def __init__(self, limiter: UpstreamLimiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+
+    def settle(self, actual_tokens: Optional[int]) -> None:
+        if actual_tokens is not None and self.limiter.tpm is not None:
+            self.limiter.tpm.refund(self.estimated_tokens - actual_tokens)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+# FairScheduler 的等待者是以目前 event loop 建立的 Future，只能在同一個 loop 上喚醒，因此每個 loop 一個限制器
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, UpstreamLimiter]" = weakref.WeakKeyDictionary()
+
+
+def get_limiter() -> UpstreamLimiter:
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = UpstreamLimiter()
+    return limiter
+
+
+def set_limiter(limiter: UpstreamLimiter) -> None:
+    """替換目前 event loop 的限制器（測試或重新設定時使用）"""
+    _limiters[asyncio.get_running_loop()] = limiter
+
+
+def client_identity(headers, client) -> str:
+    if CLIENT_ID_HEADER and headers.get(CLIENT_ID_HEADER):
+        return headers[CLIENT_ID_HEADER][:100]
+    return client.host if client else "anonymous"
+
+
+def scheduling(priority: str) -> Callable:
+    """FastAPI 依賴：標記此請求的上游呼叫所屬的優先等級與客戶端"""
+    async def classify(request: Request) -> None:
+        current_priority.set(priority)
+        current_client.set(client_identity(request.headers, request.client))
+    return classify
+
+
+async def require_capacity(request: Request) -> None:
+    """
+    FastAPI 依賴：等待上游配額的佇列過深時直接回應 503 + Retry-After，
+    而不是讓請求無限排隊。
+    """
+    limiter = get_limiter()
+    if limiter.waiting >= ADMISSION_MAX_QUEUE:
+        ADMISSION_REJECTED.inc(path=request.url.path)
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(limiter.retry_after_hint())},
+        )
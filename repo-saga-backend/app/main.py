@@ -1,17 +1,59 @@
 import os
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI
+
+# Load environment variables from .env file（須在匯入服務模組前載入，模組層級設定才會生效）
+load_dotenv()
+
+from fastapi import Depends, FastAPI, Header, HTTPException, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-from .services import generate_saga_from_repo, openrouter_chat, FASTAPI_EXAMPLE
+from typing import Dict, List, Optional
+from .answer_cache import get_answer_cache
+from .batch import BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS, BatchItem, batch_ndjson
+from .chat import chat_socket, chat_system_prompt
+from .jobs import (
+    DONE, JobQueueFull, get_job_manager, job_result, public_view,
+    start_job_manager, stop_job_manager,
+)
+from .context import pack_chat_history
+from .limits import require_capacity, scheduling
+from .metrics import CONTENT_TYPE_LATEST, render_latest
+from .monitoring import configure_logging, current_stage, server_timing, start_loop_monitor, stop_loop_monitor
+from .openrouter import aclose_client
+from .routing import resolve_route
+from .sessions import close_session_store, get_session_store
+from .pipeline import StageSkipped
+from .prompts import load_prompts
+from .sagas import SAGA_RESPONSES, cache_headers, load_saga, not_modified, saga_id_for, saga_path
+from .services import build_presets, openrouter_chat_async, FASTAPI_EXAMPLE
+from .streaming import SSE_HEADERS, saga_event_stream
+from .warming import cached_saga, start_warmer, stop_warmer
+
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_prompts()
+    start_loop_monitor()
+    await start_job_manager()
+    start_warmer()
+    yield
+    await stop_warmer()
+    await stop_job_manager()
+    await close_session_store()
+    await stop_loop_monitor()
+    # 關閉共享的上游連線池
+    await aclose_client()
 
-# Load environment variables from .env file
-load_dotenv()
 
 app = FastAPI(
     title="Repo Saga Engine",
     description="An API that turns GitHub repositories into literature.",
+    lifespan=lifespan,
 )
 
 # 配置 CORS，允许前端访问
@@ -31,20 +73,42 @@ class RepoURLRequest(BaseModel):
     lang: Optional[str] = None  # e.g., 'en', 'zh-TW'
     locale: Optional[str] = None  # e.g., 'en-GB', 'zh-TW'
 
+class BatchRequest(BaseModel):
+    # 逐項指定（url + 選填 presets），或以 urls 搭配下方共用的 presets
+    items: List[RepoURLRequest] = []
+    urls: List[str] = []
+    poem_style: Optional[str] = None
+    novel_genre: Optional[str] = None
+    tone: Optional[str] = None
+    lang: Optional[str] = None
+    locale: Optional[str] = None
+    concurrency: int = 4
+
 class ChatRequest(BaseModel):
     message: str
-    conversation_history: list = []
+    session_id: Optional[str] = None  # 伺服器端對話；未提供且沒有 conversation_history 時會建立新的
+    conversation_history: list = []  # 舊版客戶端：每次送出完整歷史
     lang: Optional[str] = None  # e.g., 'en', 'zh-TW'
     locale: Optional[str] = None  # e.g., 'en-GB', 'zh-TW'
 
 class ChatResponse(BaseModel):
     response: str
+    session_id: Optional[str] = None
+
+class SectionStatus(BaseModel):
+    status: str  # ok / error / skipped（依賴的階段失敗）
+    error: Optional[str] = None
 
 class LiteraryWorkResponse(BaseModel):
     repo_url: str
     insight_report: str
     poem: str
     novel: str
+    sections: Dict[str, SectionStatus] = {}  # 失敗的段落以預設文字填入，並在此標示
+    saga_id: Optional[str] = None  # 全部段落成功時可由 GET /sagas/{saga_id} 取得（可快取、可分享）
+
+def _presets_from_request(request: RepoURLRequest) -> dict:
+    return build_presets(request.poem_style, request.novel_genre, request.tone, request.lang, request.locale)
 
 @app.get("/")
 async def root():
@@ -60,68 +124,64 @@ async def get_example():
     """
     return FASTAPI_EXAMPLE
 
-@app.post("/chat", response_model=ChatResponse)
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 格式的服務指標
+    """
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/chat", response_model=ChatResponse, dependencies=[Depends(scheduling("chat")), Depends(require_capacity)])
 async def chat_with_assistant(request: ChatRequest):
     """
     與魔法助手聊天，使用 OpenRouter AI 生成回應
     """
+    current_stage.set("chat")
     try:
         # 根據語言設定決定系統提示
         is_english = request.lang == 'en' or (request.locale and request.locale.startswith('en'))
 
-        if is_english:
-            system_content = """You are the Repo Saga Assistant, a specialized AI helper for the Repo Saga Engine platform. Your primary purpose is to help users understand and optimize their experience with transforming GitHub repositories into poetry and fiction.
-
-Your expertise includes:
-
-1. Repository Analysis: Explaining how the platform analyzes GitHub projects, what information is extracted, and how it's processed
-2. Literary Transformation: Guiding users on how to get better poetry and novel outputs, explaining different styles and tones available
-3. Platform Features: Helping users understand the interface, settings, and customization options
-4. Creative Optimization: Providing tips for selecting repositories that work well for literary transformation
-5. Technical Support: Assisting with any issues related to URL input, generation process, or output quality
-
-You should focus specifically on Repo Saga Engine functionality and avoid general programming discussions unless they directly relate to improving the literary transformation process.
-
-Always respond in English with a helpful and knowledgeable tone."""
-        else:
-            system_content = """你是 Repo Saga 助手，專門為 Repo Saga Engine 平台提供協助的 AI 助理。你的主要目的是幫助用戶理解並優化他們將 GitHub 倉庫轉化為詩歌和小說的體驗。
-
-你的專業領域包括：
-
-1. 倉庫分析：解釋平台如何分析 GitHub 專案、提取哪些資訊，以及如何處理這些資訊
-2. 文學轉化：指導用戶如何獲得更好的詩歌和小說輸出，解釋可用的不同風格和語調
-3. 平台功能：幫助用戶理解介面、設定和自訂選項
-4. 創意優化：提供選擇適合文學轉化的倉庫的技巧
-5. 技術支援：協助解決與 URL 輸入、生成過程或輸出品質相關的任何問題
-
-你應該專注於 Repo Saga Engine 的功能，避免一般性的程式設計討論，除非它們直接關係到改善文學轉化過程。
-
-請用繁體中文回應，語氣要有幫助且專業。"""
-
-        # 構建對話歷史
-        messages = [
-            {
-                "role": "system",
-                "content": system_content
-            }
-        ]
-
-        # 添加對話歷史（最多保留最近 10 輪對話）
-        if request.conversation_history:
-            recent_history = request.conversation_history[-20:]  # 最多 20 條消息（10 輪對話）
-            messages.extend(recent_history)
-
-        # 添加當前用戶消息
-        messages.append({"role": "user", "content": request.message})
-
-        # 調用 OpenRouter API
-        response = openrouter_chat(
-            messages=messages,
-            model="openai/gpt-oss-20b",
-            temperature=0.8  # 稍高的溫度讓回應更有創意
+        system_content = chat_system_prompt(bool(is_english))
+
+        # 伺服器端對話：客戶端只送 session id 與新訊息；過期或不存在時開新對話並回傳新的 id
+        store = get_session_store()
+        session = None
+        if request.session_id or not request.conversation_history:
+            session = store.get(request.session_id) or store.create(is_english=bool(is_english))
+
+        # 構建對話歷史：依 token 預算由新到舊保留，放不下的舊對話濃縮成摘要
+        messages, _ = pack_chat_history(
+            system_content,
+            session.turns if session else request.conversation_history,
+            request.message,
+            is_english=bool(is_english),
+            summary=session.summary if session else None,
         )
 
-        return ChatResponse(response=response)
+        # 第一輪問題（沒有歷史與摘要）的回答與上下文無關，可由語意快取回應近似重複的問題
+        language = "English" if is_english else "Traditional Chinese"
+        first_turn = not (session.turns or session.summary) if session else not request.conversation_history
+        answers = get_answer_cache() if first_turn else None
+        response = answers.lookup(language, request.message) if answers is not None else None
+
+        if response is None:
+            # 調用 OpenRouter API（模型、溫度與輸出上限見 routing.py 的 chat 路由）
+            route = resolve_route("chat", {"language": language})
+            started = time.perf_counter()
+            response = await openrouter_chat_async(
+                messages=messages,
+                model=route.model,
+                temperature=route.temperature,
+                max_tokens=route.max_tokens,
+                timeout=route.timeout,
+            )
+            if answers is not None:
+                answers.add(language, request.message, response, time.perf_counter() - started)
+
+        if session is None:
+            return ChatResponse(response=response)
+        store.append(session, request.message, response)
+        return ChatResponse(response=response, session_id=session.id)
 
     except Exception as e:
         # 如果 AI 調用失敗，返回一個友好的錯誤回應
@@ -143,47 +203,171 @@ Always respond in English with a helpful and knowledgeable tone."""
         import random
         return ChatResponse(response=random.choice(fallback_responses))
 
-@app.post("/generate", response_model=LiteraryWorkResponse)
-async def generate_literary_work(request: RepoURLRequest):
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """
+    WebSocket 版的 /chat：一個連線對應一段對話，逐段送出回覆，可中途取消（見 chat.py）
+    """
+    await chat_socket(websocket)
+
+@app.post("/generate", response_model=LiteraryWorkResponse, dependencies=[Depends(scheduling("generate")), Depends(require_capacity)])
+async def generate_literary_work(request: RepoURLRequest, response: Response, redirect: bool = False):
     """
     Accepts a GitHub repo URL and returns its literary transformation.
+    回應附帶 Server-Timing 標頭（insight / poem / novel / total 的毫秒數）。
+    sections 標示每個段落的狀態：部分階段失敗時仍回傳已成功的段落。
+    完整結果過期時仍立即回傳，並在背景重新生成（見 warming.py）。
+    全部成功時回傳 saga_id 與 Content-Location；?redirect=true 時改以 303 導向 /sagas/{id}。
     """
+    started = time.perf_counter()
+    timings: dict = {}
+    presets = _presets_from_request(request)
     try:
-        # 確定語言設定
-        is_english = request.lang == 'en' or (request.locale and request.locale.startswith('en'))
-
-        presets = {
-            "poem_style": request.poem_style,
-            "novel_genre": request.novel_genre,
-            "tone": request.tone,
-            "language": "English" if is_english else "Traditional Chinese",
-        }
-        insight_report, poem, novel = await generate_saga_from_repo(request.url, presets)
-
-        return LiteraryWorkResponse(
-            repo_url=request.url,
-            insight_report=insight_report,
-            poem=poem,
-            novel=novel
-        )
+        results, errors = await cached_saga(request.url, presets, timings=timings)
     except Exception as e:
-        # 根據語言返回對應的錯誤信息
-        is_english = request.lang == 'en' or (request.locale and request.locale.startswith('en'))
-
-        if is_english:
-            error_insight = f"Sorry, unable to analyze project {request.url}. Please check if the URL is correct."
-            error_poem = "The world of code is full of mystery,\nSometimes we lose our way.\nBut this is the joy of exploration,\nEvery attempt is growth."
-            error_novel = "In a corner of the digital world, a mysterious project awaits discovery. Though this exploration encountered difficulties, brave developers never give up their quest for truth."
+        results, errors = {}, {section: e for section in ("insight", "poem", "novel")}
+    timings["total"] = time.perf_counter() - started
+    response.headers["Server-Timing"] = server_timing(timings)
+
+    sid = saga_id_for(request.url, presets) if not errors else None
+    if sid is not None:
+        if redirect:
+            return RedirectResponse(saga_path(sid), status_code=303, headers=dict(response.headers))
+        response.headers["Content-Location"] = saga_path(sid)
+
+    # 成功的段落照常回傳，只有失敗的段落換成預設文字；重試時已完成的段落由檢查點接續
+    fallback = _fallback_sections(request)
+    sections = {}
+    for section in ("insight", "poem", "novel"):
+        error = errors.get(section)
+        if error is None:
+            sections[section] = SectionStatus(status="ok")
+            continue
+        cause = getattr(error, "cause", error)
+        if isinstance(cause, StageSkipped):
+            sections[section] = SectionStatus(status="skipped", error=str(cause))
         else:
-            error_insight = f"抱歉，无法分析项目 {request.url}。请检查 URL 是否正确。"
-            error_poem = "代码的世界充满未知，\n有时我们会迷失方向。\n但这正是探索的乐趣，\n每一次尝试都是成长。"
-            error_novel = "在数字世界的某个角落，一个神秘的项目等待着被发现。虽然这次的探索遇到了困难，但勇敢的开发者们永远不会放弃寻找真理的脚步。"
-
-        return LiteraryWorkResponse(
-            repo_url=request.url,
-            insight_report=error_insight,
-            poem=error_poem,
-            novel=error_novel
-        )
+            sections[section] = SectionStatus(status="error", error=f"{type(cause).__name__}: {cause}"[:300])
+
+    return LiteraryWorkResponse(
+        repo_url=request.url,
+        insight_report=results.get("insight", fallback["insight"]),
+        poem=results.get("poem", fallback["poem"]),
+        novel=results.get("novel", fallback["novel"]),
+        sections=sections,
+        saga_id=sid,
+    )
+
+@app.get("/sagas/{saga_id}")
+async def get_saga(
+    saga_id: str,
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: str = Header(""),
+):
+    """
+    以 id 取得已生成的作品：強 ETag + Cache-Control，If-None-Match 符合時回應 304，
+    依 Accept-Encoding 壓縮（見 sagas.py）
+    """
+    saga = await load_saga(saga_id, accept_encoding)
+    if saga is None:
+        raise HTTPException(status_code=404, detail="Saga not found")
+    headers = cache_headers(saga.etag)
+    encoding = saga.encoding or "identity"
+    if not_modified(if_none_match, saga.etag):
+        SAGA_RESPONSES.inc(status="304", encoding=encoding)
+        return Response(status_code=304, headers=headers)
+    if saga.encoding:
+        headers["Content-Encoding"] = saga.encoding
+    SAGA_RESPONSES.inc(status="200", encoding=encoding)
+    return Response(content=saga.body, media_type="application/json", headers=headers)
+
+def _fallback_sections(request: RepoURLRequest) -> Dict[str, str]:
+    # 根據語言返回對應的錯誤信息
+    is_english = request.lang == 'en' or (request.locale and request.locale.startswith('en'))
+
+    if is_english:
+        return {
+            "insight": f"Sorry, unable to analyze project {request.url}. Please check if the URL is correct.",
+            "poem": "The world of code is full of mystery,\nSometimes we lose our way.\nBut this is the joy of exploration,\nEvery attempt is growth.",
+            "novel": "In a corner of the digital world, a mysterious project awaits discovery. Though this exploration encountered difficulties, brave developers never give up their quest for truth.",
+        }
+    return {
+        "insight": f"抱歉，无法分析项目 {request.url}。请检查 URL 是否正确。",
+        "poem": "代码的世界充满未知，\n有时我们会迷失方向。\n但这正是探索的乐趣，\n每一次尝试都是成长。",
+        "novel": "在数字世界的某个角落，一个神秘的项目等待着被发现。虽然这次的探索遇到了困难，但勇敢的开发者们永远不会放弃寻找真理的脚步。",
+    }
+
+@app.post("/generate/stream", dependencies=[Depends(scheduling("generate")), Depends(require_capacity)])
+async def generate_literary_work_stream(request: RepoURLRequest):
+    """
+    串流版的 /generate：以 Server-Sent Events 逐字送出 insight / poem / novel，
+    並附帶 stage_start、stage_done 與最後的 summary 事件。
+    """
+    return StreamingResponse(
+        saga_event_stream(request.url, _presets_from_request(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+@app.post("/generate/batch", dependencies=[Depends(scheduling("batch")), Depends(require_capacity)])
+async def generate_batch(request: BatchRequest):
+    """
+    批次生成：以有限並發處理多個倉庫（重複項目只生成一次，同倉庫共用快取的洞察報告），
+    以 NDJSON 逐筆回傳完成的結果，最後一行為 {"summary": ...}。客戶端斷線時取消其餘項目。
+    """
+    items = [BatchItem(item.url, _presets_from_request(item)) for item in request.items]
+    shared = build_presets(request.poem_style, request.novel_genre, request.tone, request.lang, request.locale)
+    items += [BatchItem(url, shared) for url in request.urls]
+    if not items:
+        raise HTTPException(status_code=422, detail="Provide items or urls")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = max(1, min(request.concurrency, BATCH_MAX_CONCURRENCY))
+    return StreamingResponse(
+        batch_ndjson(items, concurrency),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+@app.post("/jobs", status_code=202, dependencies=[Depends(scheduling("generate"))])
+async def submit_job(request: RepoURLRequest):
+    """
+    非同步生成：立即回傳 job id，生成在背景工作池中執行
+    """
+    try:
+        job = await get_job_manager().submit(request.url, _presets_from_request(request))
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, please retry later", headers={"Retry-After": "30"})
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"}
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    查詢工作狀態與各階段進度
+    """
+    job = await get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_view(job)
 
+@app.get("/jobs/{job_id}/result", response_model=LiteraryWorkResponse)
+async def get_job_result(job_id: str):
+    """
+    取得已完成工作的生成結果
+    """
+    job = await get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return LiteraryWorkResponse(**job_result(job))
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    取消工作，並中止其進行中的上游呼叫
+    """
+    job = await get_job_manager().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_view(job)
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from .metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# event loop 延遲取樣間隔（秒），0 表示停用
+LOOP_LAG_INTERVAL = float(os.environ.get("SAGA_LOOP_LAG_INTERVAL", "0.1"))
+# 開啟後記錄上游請求 / 回應的內容預覽與標頭（格式化這些字串有成本，正式環境請保持關閉）
+DEBUG_PAYLOADS = os.environ.get("SAGA_DEBUG_PAYLOADS", "0") == "1"
+
+# 目前執行中的生成階段（insight / poem / novel / chat ...），作為上游指標的標籤；
+# asyncio task 建立時會複製 context，因此階段內衍生的 task 也帶有相同的值
+current_stage: ContextVar[str] = ContextVar("saga_stage", default="other")
+
+LOOP_LAG = Histogram(
+    "saga_event_loop_lag_seconds", "Delay of a timer callback beyond its scheduled time",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_LAG_MAX = Gauge("saga_event_loop_lag_max_seconds", "Largest event loop lag observed since start")
+
+_monitor: Optional[asyncio.Task] = None
+
+
+async def monitor_event_loop(interval: float) -> None:
+    """
+    每 interval 秒排一次計時器，量測它比預定時間晚了多久；
+    有同步阻塞（CPU 運算、同步 I/O）時這個值會明顯升高。
+    """
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.observe(lag)
+        if lag > worst:
+            worst = lag
+            LOOP_LAG_MAX.set(worst)
+        if lag > 0.25:
+            logger.warning(f"🐢 Event loop lagged {lag * 1000:.0f}ms")
+
+
+def start_loop_monitor() -> None:
+    global _monitor
+    if LOOP_LAG_INTERVAL > 0 and _monitor is None:
+        _monitor = asyncio.create_task(monitor_event_loop(LOOP_LAG_INTERVAL), name="loop-lag-monitor")
+
+
+async def stop_loop_monitor() -> None:
+    global _monitor
+    if _monitor is not None:
+        _monitor.cancel()
+        await asyncio.gather(_monitor, return_exceptions=True)
+        _monitor = None
+
+
+def configure_logging() -> None:
+    """未開啟 SAGA_DEBUG_PAYLOADS 時，不讓 httpx 為每個上游請求輸出一行 INFO"""
+    if not DEBUG_PAYLOADS:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """{名稱: 秒} -> Server-Timing 標頭值，例如 "insight;dur=812.4, poem;dur=655.0" """
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
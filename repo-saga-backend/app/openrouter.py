@@ -0,0 +1,447 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+import httpx
+
+from .cassette import REPLAY, StreamRecorder, cassette_key, get_cassette
+from .limits import (
+    UPSTREAM_EXPECTED_OUTPUT_TOKENS,
+    estimate_messages_tokens,
+    estimate_tokens,
+    get_limiter,
+    parse_retry_after,
+)
+from .metrics import Counter, Gauge, Histogram
+from .monitoring import DEBUG_PAYLOADS, current_stage
+from .resilience import DEFAULT_POLICY, EmptyCompletion, ResiliencePolicy
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_API_BASE = os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
+DEFAULT_MODEL = os.environ.get("OPENROUTER_MODEL", "openai/gpt-oss-20b")
+OPENROUTER_TIMEOUT = float(os.environ.get("OPENROUTER_TIMEOUT", "60"))
+# 連線池大小：一個 worker 同時在途的上游請求上限與保留的 keep-alive 連線數
+OPENROUTER_MAX_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_CONNECTIONS", "100"))
+OPENROUTER_MAX_KEEPALIVE = int(os.environ.get("OPENROUTER_MAX_KEEPALIVE", "20"))
+
+UPSTREAM_SECONDS = Histogram(
+    "saga_upstream_request_seconds", "Upstream request latency per attempt (limiter wait excluded)",
+    ("stage", "model", "outcome"),
+)
+UPSTREAM_FIRST_TOKEN = Histogram(
+    "saga_upstream_first_token_seconds", "Time to the first streamed delta", ("stage", "model"),
+)
+UPSTREAM_TOKENS = Counter(
+    "saga_upstream_tokens_total", "Upstream tokens (reported usage, or a local estimate when none is reported)",
+    ("stage", "model", "kind"),
+)
+# 上游回報 cached_tokens 時才記錄（見 prompts.py 的固定前綴）
+PROMPT_CACHE_TOKENS = Counter(
+    "saga_prompt_cache_tokens_total", "Prompt tokens in responses that reported cache usage, and how many were cached",
+    ("stage", "model", "kind"),
+)
+PROMPT_CACHE_HIT_RATIO = Gauge(
+    "saga_prompt_cache_hit_ratio", "Fraction of prompt tokens served from the upstream prompt cache", ("stage", "model"),
+)
+UPSTREAM_TRUNCATED = Counter(
+    "saga_upstream_truncated_total", "Completions cut off by max_tokens (finish_reason=length)", ("stage", "model"),
+)
+
+# 每個 event loop 一個共享的 AsyncClient（httpx 連線綁定於建立它的 loop）
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+# 可替換的底層 transport，供測試或本機假上游使用
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+# 同步包裝使用的背景 event loop
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_lock = threading.Lock()
+
+
+class UpstreamConfigError(RuntimeError):
+    """上游設定錯誤（例如缺少 API key），重試也無法解決"""
+
+
+def _require_openrouter_api_key() -> str:
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise UpstreamConfigError(
+            "Missing OPENROUTER_API_KEY environment variable. Please set it to use OpenRouter."
+        )
+    return api_key
+
+
+def set_transport(transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    """
+    替換上游 transport（例如 httpx.ASGITransport 指向本機假 OpenRouter）。
+    已建立的客戶端會被丟棄，下一次呼叫時以新的 transport 重建。
+    """
+    global _transport
+    _transport = transport
+    _clients.clear()
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    取得目前 event loop 共享的 AsyncClient（具連線池與 keep-alive）
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=OPENROUTER_API_BASE,
+            timeout=OPENROUTER_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            ),
+            transport=_transport,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose_client() -> None:
+    """
+    關閉目前 event loop 的共享客戶端（應用關閉時呼叫）
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def _build_headers() -> Dict[str, str]:
+    headers = {
+        "Authorization": f"Bearer {_require_openrouter_api_key()}",
+        "Content-Type": "application/json",
+    }
+    site_url = os.environ.get("OPENROUTER_SITE_URL")
+    app_title = os.environ.get("OPENROUTER_APP_TITLE")
+    if site_url:
+        headers["HTTP-Referer"] = site_url
+    if app_title:
+        headers["X-Title"] = app_title
+    return headers
+
+
+def _outcome(status_code: int) -> str:
+    if status_code < 400:
+        return "ok"
+    return "429" if status_code == 429 else f"{status_code // 100}xx"
+
+
+def _record_tokens(model: str, usage: Optional[Dict[str, Any]], messages: List[Dict[str, str]], text: str) -> None:
+    stage = current_stage.get()
+    usage = usage or {}
+    prompt = usage.get("prompt_tokens") or estimate_messages_tokens(messages)
+    completion = usage.get("completion_tokens") or estimate_tokens(text)
+    UPSTREAM_TOKENS.inc(prompt, stage=stage, model=model, kind="prompt")
+    UPSTREAM_TOKENS.inc(completion, stage=stage, model=model, kind="completion")
+    details = usage.get("prompt_tokens_details") or {}
+    if usage.get("prompt_tokens") and details.get("cached_tokens") is not None:
+        PROMPT_CACHE_TOKENS.inc(prompt, stage=stage, model=model, kind="prompt")
+        PROMPT_CACHE_TOKENS.inc(details["cached_tokens"], stage=stage, model=model, kind="cached")
+        PROMPT_CACHE_HIT_RATIO.set(
+            PROMPT_CACHE_TOKENS.value(stage=stage, model=model, kind="cached")
+            / PROMPT_CACHE_TOKENS.value(stage=stage, model=model, kind="prompt"),
+            stage=stage, model=model,
+        )
+
+
+def _build_payload(
+    model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int], stream: bool = False,
+) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+    }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+    if stream:
+        payload["stream"] = True
+        # 最後一個 chunk 附上 usage（含 cached_tokens）
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+
+def _record_finish(model: str, finish_reason: Optional[str]) -> None:
+    if finish_reason == "length":
+        UPSTREAM_TRUNCATED.inc(stage=current_stage.get(), model=model)
+        logger.warning(f"✂️ [{current_stage.get()}] {model} output hit max_tokens")
+
+
+def _log_request(model: str, payload: Dict[str, Any]) -> None:
+    if DEBUG_PAYLOADS:
+        messages = payload["messages"]
+        logger.info(f"📤 [{current_stage.get()}] {model} payload keys: {list(payload)}, {len(messages)} messages")
+        logger.info(f"📤 Last message preview: {messages[-1]['content'][:200] if messages else 'No messages'}")
+
+
+async def _complete_once(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> str:
+    """單次上游呼叫（經過限制器）；429 會通知限制器退避後以 HTTPStatusError 拋出"""
+    payload = _build_payload(model, messages, temperature, max_tokens)
+    limiter = get_limiter()
+    estimated = estimate_messages_tokens(messages) + (max_tokens or UPSTREAM_EXPECTED_OUTPUT_TOKENS)
+    stage = current_stage.get()
+    _log_request(model, payload)
+
+    async with limiter.slot(estimated) as reservation:
+        started = time.perf_counter()
+        try:
+            resp = await get_client().post(
+                "/chat/completions", json=payload, headers=_build_headers(), timeout=timeout or OPENROUTER_TIMEOUT,
+            )
+        except httpx.HTTPError:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, stage=stage, model=model, outcome="network")
+            raise
+        UPSTREAM_SECONDS.observe(
+            time.perf_counter() - started, stage=stage, model=model, outcome=_outcome(resp.status_code),
+        )
+        if DEBUG_PAYLOADS:
+            logger.info(f"📥 Response status: {resp.status_code} ({model}), headers: {dict(resp.headers)}")
+        if resp.status_code == 429:
+            limiter.throttled(parse_retry_after(resp.headers.get("Retry-After")))
+        if resp.status_code >= 400:
+            logger.error(f"❌ Request failed: {resp.status_code} {resp.text[:500]}")
+        resp.raise_for_status()
+        limiter.succeeded()
+        data = resp.json()
+        usage = data.get("usage") or {}
+        reservation.settle(usage.get("total_tokens"))
+
+    # Expecting choices[0].message.content
+    choice = data.get("choices", [{}])[0]
+    content = choice.get("message", {}).get("content", "")
+    _record_finish(model, choice.get("finish_reason"))
+
+    if not content:
+        detail = data if DEBUG_PAYLOADS else list(data)
+        logger.error(f"❌ OpenRouter returned empty content. Response: {detail}")
+        raise EmptyCompletion("OpenRouter returned empty content")
+    _record_tokens(model, usage, messages, content)
+    if DEBUG_PAYLOADS:
+        logger.info(f"✅ Content preview: {content[:100]}...")
+    return content
+
+
+async def openrouter_chat_async(
+    messages: List[Dict[str, str]],
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+    policy: Optional[ResiliencePolicy] = None,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> str:
+    """
+    Call OpenRouter chat completions API without blocking the event loop.
+    Requires env OPENROUTER_API_KEY. Optional envs:
+      - OPENROUTER_SITE_URL (HTTP-Referer)
+      - OPENROUTER_APP_TITLE (X-Title)
+    呼叫經過全域上游限制器，並依 ResiliencePolicy 重試、hedge 與改用備援模型。
+    max_tokens 限制輸出長度，timeout 覆寫單次請求的逾時（見 routing.py）。
+    延遲與 token 數以 current_stage 為標籤記錄在 /metrics。
+    設定 SAGA_CASSETTE_MODE 時錄製或重播回應（見 app/cassette.py）。
+    """
+    cassette = get_cassette()
+    if cassette is not None and cassette.mode == REPLAY:
+        content = await cassette.replay_completion(model, messages, temperature)
+        logger.info(f"📼 [{current_stage.get()}] Replayed {len(content)} chars for {model}")
+        return content
+    _require_openrouter_api_key()
+
+    started = time.perf_counter()
+    try:
+        content = await (policy or DEFAULT_POLICY).run(
+            model, lambda m: _complete_once(m, messages, temperature, max_tokens, timeout)
+        )
+    except httpx.HTTPError as e:
+        logger.error(f"❌ Request failed: {e!r}")
+        raise
+
+    if cassette is not None:
+        elapsed_ms = round((time.perf_counter() - started) * 1000)
+        cassette.record(cassette_key(model, messages, temperature), model, [(elapsed_ms, content)])
+    logger.info(f"✅ [{current_stage.get()}] Got {len(content)} chars from {model}")
+    return content
+
+
+async def _iter_deltas(
+    resp: httpx.Response, finish: Optional[List[str]] = None, usage: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """逐一產生 delta；提供 finish / usage 時填入上游的 finish_reason 與 usage"""
+    async for line in resp.aiter_lines():
+        # 空行分隔事件；以 ":" 開頭的是註解（例如 OPENROUTER PROCESSING 心跳）
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise RuntimeError(f"OpenRouter stream error: {chunk['error']}")
+        if usage is not None and chunk.get("usage"):
+            usage.update(chunk["usage"])
+        choice = (chunk.get("choices") or [{}])[0]
+        if finish is not None and choice.get("finish_reason"):
+            finish.append(choice["finish_reason"])
+        delta = choice.get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+class _OpenStream(NamedTuple):
+    stack: AsyncExitStack  # 需由呼叫端關閉（釋放連線與限制器名額）
+    first: str
+    deltas: AsyncIterator[str]
+    model: str
+    started: float
+    finish: List[str]  # 讀完串流後包含上游的 finish_reason
+    usage: Dict[str, Any]  # 讀完串流後為上游回報的 usage（有回報時）
+
+
+async def _open_stream(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> _OpenStream:
+    """
+    建立串流並讀到第一個 delta 為止。
+    在第一個 delta 之前的失敗都可由韌性策略重試或改用備援模型。
+    """
+    payload = _build_payload(model, messages, temperature, max_tokens, stream=True)
+    limiter = get_limiter()
+    estimated = estimate_messages_tokens(messages) + (max_tokens or UPSTREAM_EXPECTED_OUTPUT_TOKENS)
+    stage = current_stage.get()
+    _log_request(model, payload)
+
+    stack = AsyncExitStack()
+    try:
+        # 串流期間持續佔用一個限制器名額
+        await stack.enter_async_context(limiter.slot(estimated))
+        started = time.perf_counter()
+        resp = await stack.enter_async_context(
+            get_client().stream(
+                "POST", "/chat/completions", json=payload, headers=_build_headers(),
+                timeout=timeout or OPENROUTER_TIMEOUT,
+            )
+        )
+        if resp.status_code == 429:
+            limiter.throttled(parse_retry_after(resp.headers.get("Retry-After")))
+        if resp.status_code >= 400:
+            UPSTREAM_SECONDS.observe(
+                time.perf_counter() - started, stage=stage, model=model, outcome=_outcome(resp.status_code),
+            )
+            await resp.aread()
+            logger.error(f"❌ Streaming request failed: {resp.status_code} {resp.text[:500]}")
+            resp.raise_for_status()
+        limiter.succeeded()
+
+        finish: List[str] = []
+        usage: Dict[str, Any] = {}
+        deltas = _iter_deltas(resp, finish, usage)
+        try:
+            first = await deltas.__anext__()
+        except StopAsyncIteration:
+            raise EmptyCompletion("OpenRouter returned empty content")
+        UPSTREAM_FIRST_TOKEN.observe(time.perf_counter() - started, stage=stage, model=model)
+        return _OpenStream(stack, first, deltas, model, started, finish, usage)
+    except BaseException:
+        await stack.aclose()
+        raise
+
+
+async def openrouter_stream(
+    messages: List[Dict[str, str]],
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+    policy: Optional[ResiliencePolicy] = None,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    以串流模式呼叫 OpenRouter（stream=true），逐段產生上游送來的文字 delta。
+    上游的 SSE 逐行解析後直接轉交，不做額外緩衝。
+    第一個 delta 之前的錯誤依韌性策略重試／改用備援模型（串流不做 hedging）。
+    錄製時保留每個 delta 的時間，重播時可依原始節奏送出。
+    """
+    stage = current_stage.get()
+    cassette = get_cassette()
+    if cassette is not None and cassette.mode == REPLAY:
+        async for delta in cassette.replay_stream(model, messages, temperature):
+            yield delta
+        logger.info(f"📼 [{stage}] Replayed stream for {model}")
+        return
+    _require_openrouter_api_key()
+    recorder = StreamRecorder() if cassette is not None else None
+
+    opened = await (policy or DEFAULT_POLICY).run(
+        model, lambda m: _open_stream(m, messages, temperature, max_tokens, timeout), hedge=False
+    )
+    parts = [opened.first]
+    outcome = "error"
+    async with opened.stack:
+        try:
+            if recorder is not None:
+                recorder.add(opened.first)
+            yield opened.first
+            async for delta in opened.deltas:
+                parts.append(delta)
+                if recorder is not None:
+                    recorder.add(delta)
+                yield delta
+            outcome = "ok"
+            _record_finish(opened.model, opened.finish[-1] if opened.finish else None)
+        finally:
+            UPSTREAM_SECONDS.observe(
+                time.perf_counter() - opened.started, stage=stage, model=opened.model, outcome=outcome,
+            )
+            _record_tokens(opened.model, opened.usage, messages, "".join(parts))
+    # 只錄製完整讀完的串流
+    if recorder is not None:
+        cassette.record(cassette_key(model, messages, temperature), model, recorder.chunks)
+    logger.info(f"✅ [{stage}] Streamed {sum(len(p) for p in parts)} chars from {opened.model}")
+
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    global _sync_loop
+    with _sync_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_sync_loop.run_forever,
+                name="openrouter-sync-loop",
+                daemon=True,
+            ).start()
+        return _sync_loop
+
+
+def openrouter_chat(
+    messages: List[Dict[str, str]],
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.7,
+) -> str:
+    """
+    同步包裝，供腳本使用。請求在背景 event loop 上執行，
+    因此多次呼叫之間同樣共用連線池。不要在 async 程式碼中呼叫。
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        openrouter_chat_async(messages, model=model, temperature=temperature),
+        _get_sync_loop(),
+    )
+    return future.result()
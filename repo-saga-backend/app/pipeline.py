@@ -0,0 +1,146 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .metrics import Histogram
+from .monitoring import current_stage
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = Histogram("saga_stage_seconds", "Stage duration (dependencies excluded)", ("stage", "outcome"))
+
+# 階段執行函式：接收其依賴階段的輸出（名稱 -> 文字），回傳本階段輸出
+StageFn = Callable[[Dict[str, str]], Awaitable[str]]
+
+
+@dataclass
+class Stage:
+    """
+    生成流程中的一個階段。deps 列出需要先完成的階段名稱；
+    互不依賴的階段會並發執行。timeout 為本階段的秒數上限（None 表示不限）。
+    """
+    name: str
+    run: StageFn
+    deps: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+
+
+class StageError(Exception):
+    """某個階段失敗（或逾時），其餘未完成的階段已被取消"""
+
+    def __init__(self, stage: str, cause: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {cause!r}")
+        self.stage = stage
+        self.cause = cause
+
+
+class StageSkipped(Exception):
+    """依賴的階段失敗，本階段沒有執行"""
+
+    def __init__(self, dep: str):
+        super().__init__(f"dependency '{dep}' failed")
+        self.dep = dep
+
+
+def _toposort(stages: List[Stage]) -> List[Stage]:
+    by_name: Dict[str, Stage] = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        by_name[stage.name] = stage
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    ordered: List[Stage] = []
+    state: Dict[str, int] = {}  # 1 = visiting, 2 = done
+
+    def visit(stage: Stage) -> None:
+        mark = state.get(stage.name)
+        if mark == 2:
+            return
+        if mark == 1:
+            raise ValueError(f"Stage dependency cycle at '{stage.name}'")
+        state[stage.name] = 1
+        for dep in stage.deps:
+            visit(by_name[dep])
+        state[stage.name] = 2
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+async def run_stages(
+    stages: List[Stage],
+    timings: Optional[Dict[str, float]] = None,
+    errors: Optional[Dict[str, StageError]] = None,
+) -> Dict[str, str]:
+    """
+    依照依賴關係執行所有階段，回傳 {階段名稱: 輸出}。
+    任一階段失敗時會取消其餘仍在執行的階段，並拋出 StageError。
+    提供 errors 時改為部分結果模式：失敗的階段記入 errors（依賴它的階段以 StageSkipped 記入），
+    不影響其他獨立的階段，回傳值只包含成功的階段。
+    提供 timings 時填入每個階段本身的耗時（秒，不含等待依賴的時間）。
+    """
+    ordered = _toposort(stages)
+    results: Dict[str, str] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_one(stage: Stage) -> str:
+        if stage.deps:
+            outcomes = await asyncio.gather(*(tasks[dep] for dep in stage.deps), return_exceptions=errors is not None)
+            for dep, outcome in zip(stage.deps, outcomes):
+                if isinstance(outcome, BaseException):
+                    raise StageError(stage.name, StageSkipped(dep))
+        inputs = {dep: results[dep] for dep in stage.deps}
+        current_stage.set(stage.name)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            output = await asyncio.wait_for(stage.run(inputs), stage.timeout)
+            outcome = "ok"
+        except asyncio.TimeoutError as e:
+            outcome = "timeout"
+            raise StageError(stage.name, TimeoutError(f"timed out after {stage.timeout}s")) from e
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            raise StageError(stage.name, e) from e
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage=stage.name, outcome=outcome)
+            if timings is not None:
+                timings[stage.name] = elapsed
+        results[stage.name] = output
+        return output
+
+    # 依拓撲順序建立 task，確保依賴的 task 一定已存在
+    for stage in ordered:
+        tasks[stage.name] = asyncio.create_task(run_one(stage), name=f"stage:{stage.name}")
+
+    try:
+        pending = set(tasks.values())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.cancelled():
+                    raise asyncio.CancelledError()
+                if task.exception() is not None:
+                    error = task.exception()
+                    logger.error(f"❌ {error}")
+                    if errors is None:
+                        raise error
+                    errors[error.stage] = error
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    return results
@@ -0,0 +1,271 @@
+"""
+提示詞模板：啟動時載入一次，每個階段 × 語言一組預先編譯的模板。
+
+上游（OpenRouter / 各供應商）的提示詞快取以「位元組完全相同的前綴」命中，因此模板把
+冗長的固定指示全部放在 system 訊息，倉庫名稱、洞察報告、風格提示等變動內容一律放在後面的
+user 訊息（變動較少的在前，風格 / 語氣提示最後）。相同階段的請求共用同一段前綴。
+
+SAGA_PROMPTS_FILE 可指定 JSON 覆寫個別模板，例如：
+
+    {"poem": {"en": {"system": "You are a poet..."}}}
+"""
+
+import os
+import json
+import string
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from .limits import estimate_tokens
+from .metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_FILE = os.environ.get("SAGA_PROMPTS_FILE", "")
+
+PROMPT_PREFIX_TOKENS = Gauge(
+    "saga_prompt_prefix_tokens", "Estimated tokens in each template's static, cacheable prefix", ("stage", "language"),
+)
+
+MessageList = List[Dict[str, str]]
+
+LANGUAGES = ("en", "zh")
+
+# 各階段 user 模板可用的欄位；hints 為依 presets 組出的風格 / 語氣提示
+STAGE_FIELDS = {
+    "insight": {"repo", "digest"},
+    "insight_inferred": {"repo"},
+    "poem": {"repo", "insight", "hints"},
+    "novel": {"repo", "insight", "hints"},
+    "chat": set(),
+    "chat_summary": {"summary", "transcript"},
+}
+# 每個階段使用的 presets 提示，依此順序附加在 user 訊息最後
+STAGE_HINTS = {
+    "poem": ("poem_style", "tone"),
+    "novel": ("novel_genre", "tone"),
+}
+
+_INSIGHT_SYSTEM_EN = (
+    "You are a senior open-source code reviewer and technical writer.\n\n"
+    "Write a project insight report for the GitHub project named in the user message. "
+    "Include the project's core functionality, technical features, design philosophy, etc."
+)
+_INSIGHT_SYSTEM_ZH = (
+    "你是一位资深的开源代码审阅者与技术作家。\n\n"
+    "请为用户消息中的 GitHub 项目生成一份项目洞察报告，需要包含项目的核心功能、技术特点、设计理念等。"
+)
+
+DEFAULT_TEMPLATES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "insight": {
+        "en": {
+            "system": _INSIGHT_SYSTEM_EN,
+            "user": "Project: {repo}\n\nBase the report on the following analysis of the repository's actual contents:\n\n{digest}",
+        },
+        "zh": {
+            "system": _INSIGHT_SYSTEM_ZH,
+            "user": "项目：{repo}\n\n请依据以下对仓库实际内容的分析：\n\n{digest}",
+        },
+    },
+    "insight_inferred": {
+        "en": {
+            "system": _INSIGHT_SYSTEM_EN,
+            "user": "Project: {repo}\n\nMake reasonable inferences based on README and common directory structures.",
+        },
+        "zh": {
+            "system": _INSIGHT_SYSTEM_ZH,
+            "user": "项目：{repo}\n\n请尽量参考 README 与常见目录结构进行合理推断。",
+        },
+    },
+    "poem": {
+        "en": {
+            "system": (
+                "You are a modern poet who specializes in technical themes.\n\n"
+                "Based on the project insight report in the user message, create a poem about the project. "
+                "Requirements: Be imaginative, reflect the beauty of code and the spirit of the project, "
+                "with clear stanzas for easy interface display. Follow any style and tone given after the report."
+            ),
+            "user": "Project: {repo}\n\nProject insight report:\n{insight}\n\n{hints}",
+            "hints": {"poem_style": "Style: {}. ", "tone": "Tone: {}. "},
+        },
+        "zh": {
+            "system": (
+                "你是一位擅长技术题材的现代诗歌创作者。\n\n"
+                "请基于用户消息中的项目洞察报告，创作一首关于该项目的诗歌。"
+                "要求：富有想象力，体现代码的美感和项目的精神，分段清晰，便于界面展示。若报告后附有风格与语气，请遵循。"
+            ),
+            "user": "项目：{repo}\n\n项目洞察报告：\n{insight}\n\n{hints}",
+            "hints": {"poem_style": "風格：{}。", "tone": "語氣：{}。"},
+        },
+    },
+    "novel": {
+        "en": {
+            "system": (
+                "You are a novelist who can blend technology with humanities.\n\n"
+                "Based on the project insight report in the user message, create a short story about the project. "
+                "Requirements: Include plot and characters, reflect the story behind the project "
+                "and the spirit of the developers, with appropriate length. "
+                "Follow any genre and tone given after the report."
+            ),
+            "user": "Project: {repo}\n\nProject insight report:\n{insight}\n\n{hints}",
+            "hints": {"novel_genre": "Novel genre: {}. ", "tone": "Tone: {}. "},
+        },
+        "zh": {
+            "system": (
+                "你是一位能够将技术与人文融合的小说作者。\n\n"
+                "请基于用户消息中的项目洞察报告，创作一篇关于该项目的短篇小说。"
+                "要求：有情节，有人物，体现项目背后的故事和开发者的精神，篇幅适中。若报告后附有类型与语气，请遵循。"
+            ),
+            "user": "项目：{repo}\n\n项目洞察报告：\n{insight}\n\n{hints}",
+            "hints": {"novel_genre": "小說類型：{}。", "tone": "語氣：{}。"},
+        },
+    },
+    "chat": {
+        "en": {
+            "system": """You are the Repo Saga Assistant, a specialized AI helper for the Repo Saga Engine platform. Your primary purpose is to help users understand and optimize their experience with transforming GitHub repositories into poetry and fiction.
+
+Your expertise includes:
+
+1. Repository Analysis: Explaining how the platform analyzes GitHub projects, what information is extracted, and how it's processed
+2. Literary Transformation: Guiding users on how to get better poetry and novel outputs, explaining different styles and tones available
+3. Platform Features: Helping users understand the interface, settings, and customization options
+4. Creative Optimization: Providing tips for selecting repositories that work well for literary transformation
+5. Technical Support: Assisting with any issues related to URL input, generation process, or output quality
+
+You should focus specifically on Repo Saga Engine functionality and avoid general programming discussions unless they directly relate to improving the literary transformation process.
+
+Always respond in English with a helpful and knowledgeable tone.""",
+        },
+        "zh": {
+            "system": """你是 Repo Saga 助手，專門為 Repo Saga Engine 平台提供協助的 AI 助理。你的主要目的是幫助用戶理解並優化他們將 GitHub 倉庫轉化為詩歌和小說的體驗。
+
+你的專業領域包括：
+
+1. 倉庫分析：解釋平台如何分析 GitHub 專案、提取哪些資訊，以及如何處理這些資訊
+2. 文學轉化：指導用戶如何獲得更好的詩歌和小說輸出，解釋可用的不同風格和語調
+3. 平台功能：幫助用戶理解介面、設定和自訂選項
+4. 創意優化：提供選擇適合文學轉化的倉庫的技巧
+5. 技術支援：協助解決與 URL 輸入、生成過程或輸出品質相關的任何問題
+
+你應該專注於 Repo Saga Engine 的功能，避免一般性的程式設計討論，除非它們直接關係到改善文學轉化過程。
+
+請用繁體中文回應，語氣要有幫助且專業。""",
+        },
+    },
+    # 聊天歷史的背景滾動摘要（sessions.py）
+    "chat_summary": {
+        "en": {
+            "system": (
+                "Update the running summary of this conversation between a user and the Repo Saga Assistant. "
+                "Keep facts, user preferences, repositories mentioned and open questions; at most 120 words."
+            ),
+            "user": "Current summary:\n{summary}\n\nNew messages:\n{transcript}",
+        },
+        "zh": {
+            "system": (
+                "請更新以下用戶與 Repo Saga 助手之間對話的滾動摘要，保留事實、用戶偏好、提到的倉庫與未解決的問題，"
+                "不超過 200 字。"
+            ),
+            "user": "目前摘要：\n{summary}\n\n新的訊息：\n{transcript}",
+        },
+    },
+}
+
+
+def _fields(template: str) -> set:
+    return {name for _, name, _, _ in string.Formatter().parse(template) if name}
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    stage: str
+    language: str
+    system: str  # 固定前綴，不做任何格式化
+    user: str
+    hints: Tuple[Tuple[str, str], ...] = ()
+    prefix_tokens: int = 0
+    prefix_hash: str = ""
+
+    @classmethod
+    def compile(cls, stage: str, language: str, spec: Dict[str, Any]) -> "PromptTemplate":
+        user = spec.get("user", "")
+        unknown = _fields(user) - STAGE_FIELDS[stage]
+        if unknown:
+            raise ValueError(f"Prompt template {stage}/{language} uses unknown fields: {sorted(unknown)}")
+        hint_specs = spec.get("hints", {})
+        hints = tuple((name, hint_specs[name]) for name in STAGE_HINTS.get(stage, ()) if name in hint_specs)
+        system = spec["system"]
+        return cls(
+            stage, language, system, user, hints,
+            prefix_tokens=estimate_tokens(system),
+            prefix_hash=hashlib.sha256(system.encode("utf-8")).hexdigest()[:12],
+        )
+
+    def render(self, presets: Optional[Dict[str, Optional[str]]] = None, **fields: str) -> MessageList:
+        if self.hints:
+            fields["hints"] = "".join(fmt.format(presets[name]) for name, fmt in self.hints if (presets or {}).get(name))
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**fields).rstrip()},
+        ]
+
+
+class PromptRegistry:
+    def __init__(self, templates: Dict[Tuple[str, str], PromptTemplate]):
+        self.templates = templates
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> "PromptRegistry":
+        """以預設模板為底，套用 config 中個別階段 / 語言的覆寫"""
+        config = config or {}
+        unknown = set(config) - set(DEFAULT_TEMPLATES)
+        if unknown:
+            raise ValueError(f"Unknown prompt stages: {sorted(unknown)}")
+        templates = {}
+        for stage, languages in DEFAULT_TEMPLATES.items():
+            for language in LANGUAGES:
+                spec = {**languages[language], **config.get(stage, {}).get(language, {})}
+                template = PromptTemplate.compile(stage, language, spec)
+                templates[(stage, language)] = template
+                PROMPT_PREFIX_TOKENS.set(template.prefix_tokens, stage=stage, language=language)
+        return cls(templates)
+
+    def get(self, stage: str, is_english: bool) -> PromptTemplate:
+        return self.templates[(stage, "en" if is_english else "zh")]
+
+    def render(
+        self, stage: str, is_english: bool, presets: Optional[Dict[str, Optional[str]]] = None, **fields: str,
+    ) -> MessageList:
+        return self.get(stage, is_english).render(presets, **fields)
+
+
+_registry: Optional[PromptRegistry] = None
+
+
+def load_prompts() -> PromptRegistry:
+    """啟動時呼叫：載入並編譯全部模板，記錄各模板固定前綴的長度"""
+    global _registry
+    config = None
+    if PROMPTS_FILE:
+        with open(PROMPTS_FILE, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    _registry = PromptRegistry.from_config(config)
+    prefixes = ", ".join(
+        f"{stage}/{language} {template.prefix_tokens}"
+        for (stage, language), template in sorted(_registry.templates.items())
+    )
+    logger.info(f"📝 Loaded {len(_registry.templates)} prompt templates{' from ' + PROMPTS_FILE if PROMPTS_FILE else ''}; "
+                f"static prefix tokens: {prefixes}")
+    return _registry
+
+
+def get_prompts() -> PromptRegistry:
+    return _registry or load_prompts()
+
+
+def set_prompts(registry: Optional[PromptRegistry]) -> None:
+    """替換模板（測試用；None 表示下次重新載入）"""
+    global _registry
+    _registry = registry
@@ -0,0 +1,182 @@
+"""
+倉庫版本偵測：取得預設分支的 head commit SHA 與基本資訊，作為快取失效的依據。
+
+來源依序為本機鏡像（直接讀 .git）與 GitHub API。GitHub 以條件式請求查詢
+（If-None-Match / If-Modified-Since），未變更時回應 304，不計入速率限制；
+結果在 SAGA_REPO_META_TTL 秒內直接沿用，不發出任何請求。
+快取的作品以 head SHA 標記，只有倉庫真的有新 commit 時才重新生成。
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from . import ingest
+from .metrics import Counter
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+REPO_META_TTL = float(os.environ.get("SAGA_REPO_META_TTL", "60"))
+# 0 表示不查詢 GitHub（只使用本機鏡像）
+REPO_META_REMOTE = os.environ.get("SAGA_REPO_META_REMOTE", "1") == "1"
+# 在請求路徑上執行，逾時要短；失敗時沿用上次的結果
+REPO_META_TIMEOUT = float(os.environ.get("SAGA_REPO_META_TIMEOUT", "5"))
+REPO_META_MAXSIZE = 10000
+
+REPO_META_LOOKUPS = Counter(
+    "saga_repo_meta_lookups_total",
+    "Repository head lookups; memo = within TTL, not_modified = conditional request answered 304",
+    ("result",),
+)
+
+
+@dataclass
+class RepoMeta:
+    owner: str
+    repo: str
+    head_sha: Optional[str]
+    default_branch: Optional[str] = None
+    description: Optional[str] = None
+    stars: Optional[int] = None
+    pushed_at: Optional[str] = None
+    checked_at: float = 0.0
+
+
+class RepoMetaResolver:
+    """
+    查詢並記住各倉庫的 head。base_url / transport 可替換，測試時指向本機的假 GitHub。
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        ttl: float = REPO_META_TTL,
+        remote: bool = REPO_META_REMOTE,
+    ):
+        self.base_url = base_url or ingest.GITHUB_API_BASE
+        self.transport = transport
+        self.ttl = ttl
+        self.remote = remote
+        self._memo: Dict[str, RepoMeta] = {}
+        # URL -> (ETag, Last-Modified, 上次的回應內容)
+        self._validators: Dict[str, Tuple[Optional[str], Optional[str], str]] = {}
+        self._flights: SingleFlight = SingleFlight("repo_meta")
+
+    async def lookup(self, owner: str, repo: str) -> Optional[RepoMeta]:
+        """目前的 head 與基本資訊；無法取得（未知倉庫、離線且沒有鏡像）時為 None"""
+        if owner == "unknown":
+            return None
+        key = f"{owner}/{repo}".lower()
+        memo = self._memo.get(key)
+        if memo is not None and time.time() - memo.checked_at < self.ttl:
+            REPO_META_LOOKUPS.inc(result="memo")
+            return memo if memo.head_sha else None
+        meta = await self._flights.do(key, lambda: self._refresh(owner, repo, memo))
+        return meta if meta.head_sha else None
+
+    async def head_sha(self, owner: str, repo: str) -> Optional[str]:
+        meta = await self.lookup(owner, repo)
+        return meta.head_sha if meta else None
+
+    def forget(self, owner: str, repo: str) -> None:
+        """丟棄記住的結果，下一次查詢立即重新確認（例如收到 push webhook）"""
+        self._memo.pop(f"{owner}/{repo}".lower(), None)
+
+    async def _refresh(self, owner: str, repo: str, memo: Optional[RepoMeta]) -> RepoMeta:
+        key = f"{owner}/{repo}".lower()
+        try:
+            meta = await self._resolve(owner, repo, memo)
+        except Exception as e:
+            REPO_META_LOOKUPS.inc(result="error")
+            logger.warning(f"⚠️ Could not check {key} for new commits: {e!r}")
+            # 沿用上次的結果（或記住「未知」），TTL 內不再重試
+            meta = replace(memo) if memo is not None else RepoMeta(owner, repo, None)
+        meta.checked_at = time.time()
+        self._memo[key] = meta
+        while len(self._memo) > REPO_META_MAXSIZE:
+            del self._memo[next(iter(self._memo))]
+        return meta
+
+    async def _resolve(self, owner: str, repo: str, memo: Optional[RepoMeta]) -> RepoMeta:
+        mirror = ingest.mirror_path(owner, repo)
+        if mirror is not None:
+            REPO_META_LOOKUPS.inc(result="mirror")
+            return RepoMeta(owner, repo, await asyncio.to_thread(ingest.git_head_sha, mirror))
+        if not self.remote:
+            REPO_META_LOOKUPS.inc(result="disabled")
+            return RepoMeta(owner, repo, None)
+
+        async with httpx.AsyncClient(timeout=REPO_META_TIMEOUT, transport=self.transport) as client:
+            info, changed = await self._conditional_get(
+                client, f"{self.base_url}/repos/{owner}/{repo}", "application/vnd.github+json",
+            )
+            if memo is not None and memo.head_sha and not changed:
+                # 倉庫資訊含 pushed_at，任何 push 都會改變其 ETag；304 代表 head 也沒變
+                REPO_META_LOOKUPS.inc(result="not_modified")
+                return replace(memo)
+            data = json.loads(info)
+            meta = RepoMeta(
+                owner, repo, None,
+                default_branch=data.get("default_branch"),
+                description=data.get("description"),
+                stars=data.get("stargazers_count"),
+                pushed_at=data.get("pushed_at"),
+            )
+            if (
+                memo is not None and memo.head_sha
+                and memo.pushed_at == meta.pushed_at and memo.default_branch == meta.default_branch
+            ):
+                REPO_META_LOOKUPS.inc(result="not_modified")
+                meta.head_sha = memo.head_sha
+                return meta
+            sha, _ = await self._conditional_get(
+                client,
+                f"{self.base_url}/repos/{owner}/{repo}/commits/{meta.default_branch or 'HEAD'}",
+                "application/vnd.github.sha",
+            )
+            meta.head_sha = sha.decode("utf-8").strip()
+        REPO_META_LOOKUPS.inc(result="fetched")
+        if memo is not None and memo.head_sha and memo.head_sha != meta.head_sha:
+            logger.info(f"🆕 {owner}/{repo} moved {memo.head_sha[:12]} -> {meta.head_sha[:12]}")
+        return meta
+
+    async def _conditional_get(self, client: httpx.AsyncClient, url: str, accept: str) -> Tuple[bytes, bool]:
+        """回傳 (內容, 是否有變更)；304 時回傳上次的內容"""
+        headers = {**ingest.github_headers(), "Accept": accept}
+        etag, last_modified, previous = self._validators.get(url, (None, None, ""))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        resp = await client.get(url, headers=headers)
+        if resp.status_code == 304 and url in self._validators:
+            return previous.encode("utf-8"), False
+        resp.raise_for_status()
+        self._validators[url] = (resp.headers.get("etag"), resp.headers.get("last-modified"), resp.text)
+        if len(self._validators) > 2 * REPO_META_MAXSIZE:
+            del self._validators[next(iter(self._validators))]
+        return resp.content, True
+
+
+_resolver: Optional[RepoMetaResolver] = None
+
+
+def get_repo_meta() -> RepoMetaResolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = RepoMetaResolver()
+    return _resolver
+
+
+def set_repo_meta(resolver: Optional[RepoMetaResolver]) -> None:
+    """替換倉庫版本查詢（測試用）"""
+    global _resolver
+    _resolver = resolver
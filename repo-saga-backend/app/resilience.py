@@ -0,0 +1,177 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, FrozenSet, List, Optional, Tuple, TypeVar
+
+import httpx
+
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# 換模型也無法解決的錯誤（金鑰或權限問題），直接拋出
+FATAL_STATUSES = frozenset({401, 403})
+
+ATTEMPTS = Counter("saga_upstream_attempts_total", "Upstream attempts by model and outcome", ("model", "outcome"))
+RETRIES = Counter("saga_upstream_retries_total", "Upstream retries by reason", ("reason",))
+HEDGES = Counter("saga_upstream_hedges_total", "Hedged upstream requests; result=fired|won", ("result",))
+FALLBACKS = Counter("saga_upstream_fallbacks_total", "Calls that moved on to a fallback model", ("model",))
+
+
+class EmptyCompletion(RuntimeError):
+    """上游回傳了空內容（視為可重試）"""
+
+
+def _env_list(name: str) -> Tuple[str, ...]:
+    return tuple(item.strip() for item in os.environ.get(name, "").split(",") if item.strip())
+
+
+class LatencyTracker:
+    """每個模型最近成功呼叫的延遲，用來估算 hedge 的觸發時間"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = self._samples[model] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def quantile(self, model: str, q: float, min_samples: int) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@dataclass
+class ResiliencePolicy:
+    """
+    上游呼叫的韌性策略：
+      - 對可重試的狀態碼 / 網路錯誤以帶抖動的指數退避重試
+      - （可選）hedging：請求超過近期 p95 延遲仍未完成時，再送出一次並取先回來的
+      - 依序改用 fallback_models
+    """
+    max_attempts: int = int(os.environ.get("UPSTREAM_MAX_ATTEMPTS", "3"))
+    backoff_base: float = float(os.environ.get("UPSTREAM_RETRY_BASE", "0.5"))
+    backoff_max: float = float(os.environ.get("UPSTREAM_RETRY_MAX", "8"))
+    retry_statuses: FrozenSet[int] = RETRY_STATUSES
+    hedge: bool = os.environ.get("UPSTREAM_HEDGE", "0") == "1"
+    hedge_quantile: float = float(os.environ.get("UPSTREAM_HEDGE_QUANTILE", "0.95"))
+    hedge_min_delay: float = float(os.environ.get("UPSTREAM_HEDGE_MIN_DELAY", "2"))
+    hedge_min_samples: int = int(os.environ.get("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+    fallback_models: Tuple[str, ...] = field(default_factory=lambda: _env_list("OPENROUTER_FALLBACK_MODELS"))
+    latencies: LatencyTracker = field(default_factory=LatencyTracker)
+
+    def models(self, primary: str) -> List[str]:
+        return [primary] + [m for m in self.fallback_models if m != primary]
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.retry_statuses
+        return isinstance(error, (httpx.TransportError, EmptyCompletion))
+
+    def is_fatal(self, error: BaseException) -> bool:
+        """重試與換模型都無濟於事的錯誤"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in FATAL_STATUSES
+        return not self.is_retryable(error)
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """full jitter；429 的等待已由限制器依 Retry-After 處理，這裡只稍作錯開"""
+        cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            cap = min(cap, self.backoff_base)
+        return random.uniform(0, cap)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p = self.latencies.quantile(model, self.hedge_quantile, self.hedge_min_samples)
+        if p is None:
+            return None
+        return max(self.hedge_min_delay, p)
+
+    async def run(self, primary: str, attempt_fn: Callable[[str], Awaitable[T]], hedge: bool = True) -> T:
+        """
+        依策略執行 attempt_fn(model)：同一模型重試 max_attempts 次，遇到不可重試的錯誤
+        （例如 400/404 模型不存在）或重試用盡時改用下一個 fallback 模型。
+        401/403 與非上游錯誤直接拋出。全部失敗時拋出最後一個錯誤。
+        """
+        last_error: Optional[BaseException] = None
+        for index, model in enumerate(self.models(primary)):
+            if index > 0:
+                FALLBACKS.inc(model=model)
+                logger.warning(f"🔀 Falling back to model {model}")
+            for attempt in range(self.max_attempts):
+                try:
+                    return await self._attempt(model, attempt_fn, hedge)
+                except Exception as e:
+                    last_error = e
+                    ATTEMPTS.inc(model=model, outcome=_reason(e))
+                    if self.is_fatal(e):
+                        raise
+                    if not self.is_retryable(e):
+                        logger.warning(f"⚠️ Non-retryable upstream error on {model}: {e}")
+                        break
+                    if attempt + 1 < self.max_attempts:
+                        RETRIES.inc(reason=_reason(e))
+                        delay = self.backoff(attempt, e)
+                        logger.warning(f"🔁 Retrying {model} in {delay:.2f}s after: {e}")
+                        await asyncio.sleep(delay)
+        assert last_error is not None
+        raise last_error
+
+    async def _attempt(self, model: str, attempt_fn: Callable[[str], Awaitable[T]], hedge: bool) -> T:
+        started = time.perf_counter()
+        delay = self.hedge_delay(model) if hedge else None
+        if delay is None:
+            result = await attempt_fn(model)
+        else:
+            result = await self._hedged(model, attempt_fn, delay)
+        self.latencies.record(model, time.perf_counter() - started)
+        ATTEMPTS.inc(model=model, outcome="ok")
+        return result
+
+    async def _hedged(self, model: str, attempt_fn: Callable[[str], Awaitable[T]], delay: float) -> T:
+        primary = asyncio.create_task(attempt_fn(model))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                HEDGES.inc(result="fired")
+                logger.info(f"🪞 Hedging slow request to {model} after {delay:.2f}s")
+                tasks.add(asyncio.create_task(attempt_fn(model)))
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            HEDGES.inc(result="won")
+                        return task.result()
+                    if not tasks:
+                        raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _reason(error: BaseException) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    return type(error).__name__
+
+
+DEFAULT_POLICY = ResiliencePolicy()
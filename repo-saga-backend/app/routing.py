@@ -0,0 +1,118 @@
+"""
+各階段（insight / poem / novel / chat / chat_summary）的模型路由：模型、溫度、輸出上限 max_tokens 與單次上游逾時。
+
+預設值來自環境變數 SAGA_<STAGE>_MODEL / _TEMPERATURE / _MAX_TOKENS / _UPSTREAM_TIMEOUT；
+SAGA_ROUTING_FILE 可指定 JSON 路由表覆寫，並依請求 presets 再覆寫，例如：
+
+    {
+      "poem": {"model": "openai/gpt-oss-20b", "max_tokens": 400,
+               "overrides": [{"when": {"poem_style": "haiku"}, "max_tokens": 120}]},
+      "novel": {"overrides": [{"when": {"language": "English"}, "temperature": 0.8}]}
+    }
+"""
+
+import os
+import json
+import logging
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from .metrics import Counter
+from .openrouter import DEFAULT_MODEL, OPENROUTER_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+ROUTING_FILE = os.environ.get("SAGA_ROUTING_FILE", "")
+
+ROUTE_DECISIONS = Counter(
+    "saga_route_decisions_total", "Model routing decisions per stage", ("stage", "model", "source"),
+)
+
+ROUTE_FIELDS = ("model", "temperature", "max_tokens", "timeout")
+
+
+@dataclass(frozen=True)
+class Route:
+    model: str
+    temperature: float
+    max_tokens: Optional[int]  # None 表示不限制
+    timeout: float  # 單次上游呼叫的逾時（秒）；整個階段另有 STAGE_TIMEOUTS
+
+
+def _env_route(stage: str, temperature: float, max_tokens: int) -> Route:
+    prefix = f"SAGA_{stage.upper()}"
+    limit = int(os.environ.get(f"{prefix}_MAX_TOKENS", str(max_tokens)))
+    return Route(
+        model=os.environ.get(f"{prefix}_MODEL", DEFAULT_MODEL),
+        temperature=float(os.environ.get(f"{prefix}_TEMPERATURE", str(temperature))),
+        max_tokens=limit or None,
+        timeout=float(os.environ.get(f"{prefix}_UPSTREAM_TIMEOUT", str(OPENROUTER_TIMEOUT))),
+    )
+
+
+DEFAULT_ROUTES: Dict[str, Route] = {
+    "insight": _env_route("insight", 0.7, 1500),
+    "poem": _env_route("poem", 0.9, 400),
+    "novel": _env_route("novel", 0.7, 1500),
+    "chat": _env_route("chat", 0.8, 800),
+    # 聊天歷史的背景滾動摘要（sessions.py）
+    "chat_summary": _env_route("chat_summary", 0.2, 400),
+}
+
+
+def _pick(config: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: config[name] for name in ROUTE_FIELDS if name in config}
+
+
+class RoutingTable:
+    def __init__(self, routes: Dict[str, Route], overrides: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        self.routes = routes
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], base: Dict[str, Route] = DEFAULT_ROUTES) -> "RoutingTable":
+        routes = dict(base)
+        overrides: Dict[str, List[Dict[str, Any]]] = {}
+        for stage, stage_config in config.items():
+            if stage not in routes:
+                raise ValueError(f"Unknown stage in routing config: {stage}")
+            routes[stage] = replace(routes[stage], **_pick(stage_config))
+            overrides[stage] = list(stage_config.get("overrides", []))
+        return cls(routes, overrides)
+
+    def resolve(self, stage: str, presets: Optional[Dict[str, Optional[str]]] = None) -> Route:
+        """依 presets 套用第一個符合的覆寫規則，並記錄路由決策"""
+        route = self.routes[stage]
+        source = "default"
+        for rule in self.overrides.get(stage, []):
+            if all((presets or {}).get(name) == value for name, value in rule.get("when", {}).items()):
+                route = replace(route, **_pick(rule))
+                source = "override"
+                break
+        ROUTE_DECISIONS.inc(stage=stage, model=route.model, source=source)
+        return route
+
+
+_table: Optional[RoutingTable] = None
+
+
+def get_routing() -> RoutingTable:
+    global _table
+    if _table is None:
+        if ROUTING_FILE:
+            with open(ROUTING_FILE, "r", encoding="utf-8") as f:
+                _table = RoutingTable.from_config(json.load(f))
+            logger.info(f"🧭 Loaded model routing from {ROUTING_FILE}")
+        else:
+            _table = RoutingTable(dict(DEFAULT_ROUTES))
+    return _table
+
+
+def set_routing(table: Optional[RoutingTable]) -> None:
+    """替換路由表（測試用；None 表示下次重新載入）"""
+    global _table
+    _table = table
+
+
+def resolve_route(stage: str, presets: Optional[Dict[str, Optional[str]]] = None) -> Route:
+    return get_routing().resolve(stage, presets)
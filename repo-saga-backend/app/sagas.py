@@ -0,0 +1,130 @@
+"""
+以 id 定址的作品資源：GET /sagas/{id}。
+
+id 由正規化倉庫、presets 與各階段路由（模型、溫度、max_tokens）導出（即 saga_key 的雜湊），相同請求永遠得到相同的 id，
+可直接分享。回應帶強 ETag（內容雜湊，每種編碼各自一個）、Cache-Control，
+支援 If-None-Match（304），並依 Accept-Encoding 以 brotli（有安裝時）或 gzip 壓縮。
+"""
+
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .cache import MemoryLRU
+from .metrics import Counter
+from .services import canonical_repo, saga_key
+from .warming import load_result
+
+try:
+    import brotli
+except ImportError:  # 選用依賴；未安裝時只提供 gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SAGA_MAX_AGE = int(os.environ.get("SAGA_SAGA_MAX_AGE", "3600"))
+# 內容在背景重新生成後 ETag 才會改變，允許 CDN 在重新驗證期間先回傳舊版本
+SAGA_STALE_WHILE_REVALIDATE = int(os.environ.get("SAGA_SAGA_STALE_WHILE_REVALIDATE", "86400"))
+SAGA_COMPRESS_MIN_BYTES = int(os.environ.get("SAGA_COMPRESS_MIN_BYTES", "1024"))
+
+SAGA_RESPONSES = Counter("saga_resource_responses_total", "GET /sagas/{id} responses", ("status", "encoding"))
+
+_ID = re.compile(r"^[0-9a-f]{32}$")
+# 壓縮後的內容以 (id, etag, encoding) 快取，重複瀏覽不必重新壓縮
+_encoded = MemoryLRU(512)
+
+
+def saga_id(request_key: str) -> str:
+    return request_key.split(":", 1)[1]
+
+
+def saga_id_for(repo_url: str, presets: Dict[str, Optional[str]]) -> str:
+    return saga_id(saga_key(canonical_repo(repo_url), presets))
+
+
+def saga_path(sid: str) -> str:
+    return f"/sagas/{sid}"
+
+
+@dataclass
+class Representation:
+    body: bytes
+    etag: str
+    encoding: Optional[str]
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    # mtime=0 讓相同內容得到相同位元組，ETag 才穩定
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+async def load_saga(sid: str, accept_encoding: str = "") -> Optional[Representation]:
+    if not _ID.match(sid):
+        return None
+    entry = await load_result(f"saga:{sid}")
+    if entry is None:
+        return None
+    document = {
+        "id": sid,
+        "repo_url": entry["repo_url"],
+        "presets": entry["presets"],
+        "insight_report": entry["sections"]["insight"],
+        "poem": entry["sections"]["poem"],
+        "novel": entry["sections"]["novel"],
+        "generated_at": entry["generated_at"],
+    }
+    body = json.dumps(document, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    encoding = _choose_encoding(accept_encoding) if len(body) >= SAGA_COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return Representation(body, f'"{digest}"', None)
+    # 不同編碼是不同的位元組，強 ETag 也必須不同
+    etag = f'"{digest}-{encoding}"'
+    cache_key = f"{sid}:{etag}"
+    encoded = _encoded.get(cache_key)
+    if encoded is None:
+        encoded = _compress(body, encoding)
+        _encoded.set(cache_key, encoded, expires_at=float("inf"))
+    return Representation(encoded, etag, encoding)
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比較：忽略 W/ 前綴，"*" 符合任何現有資源"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == "*" or tag.removeprefix("W/") == etag for tag in tags)
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={SAGA_MAX_AGE}, stale-while-revalidate={SAGA_STALE_WHILE_REVALIDATE}",
+        "Vary": "Accept-Encoding",
+    }
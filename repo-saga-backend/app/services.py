@@ -1,216 +1,416 @@
 import os
 import re
-import requests
+import json
+import time
+import asyncio
 import logging
-from typing import Tuple, List, Dict
+from dataclasses import replace
+from typing import Any, Awaitable, Callable, Optional, Tuple, List, Dict
+
+from .openrouter import (
+    DEFAULT_MODEL,
+    OPENROUTER_API_BASE,
+    openrouter_chat,
+    openrouter_chat_async,
+    openrouter_stream,
+)
+from .cache import TieredCache, cached, get_cache, make_key
+from .context import fit_prompt, truncate_to_tokens
+from .guards import (
+    GUARD_RETRIES,
+    GUARDS_ENABLED,
+    LANGUAGE,
+    GuardTripped,
+    OutputGuard,
+    clean_cut,
+    guarded,
+    record_trip,
+)
+from .ingest import format_digest, get_repo_digest
+from .metrics import Counter
+from .pipeline import Stage, StageError, StageFn, run_stages
+from .prompts import get_prompts
+from .repo_meta import get_repo_meta
+from .routing import Route, resolve_route
+from .singleflight import SingleFlight
 
 # 設置 logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-OPENROUTER_API_BASE = "https://openrouter.ai/api/v1"
-DEFAULT_MODEL = os.environ.get("OPENROUTER_MODEL", "openai/gpt-oss-20b")
-
-
-def _require_openrouter_api_key() -> str:
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
-        raise RuntimeError(
-            "Missing OPENROUTER_API_KEY environment variable. Please set it to use OpenRouter."
-        )
-    return api_key
-
-
-def openrouter_chat(messages: List[Dict[str, str]], model: str = DEFAULT_MODEL, temperature: float = 0.7) -> str:
-    """
-    Call OpenRouter chat completions API and return text content.
-    Requires env OPENROUTER_API_KEY. Optional envs:
-      - OPENROUTER_SITE_URL (HTTP-Referer)
-      - OPENROUTER_APP_TITLE (X-Title)
-    """
-    logger.info(f"🚀 Starting OpenRouter API call with model: {model}")
-    logger.info(f"📝 Messages count: {len(messages)}")
-    logger.info(f"🌡️ Temperature: {temperature}")
+# 各階段逾時秒數（單一上游呼叫本身另有 OPENROUTER_TIMEOUT 限制）
+STAGE_TIMEOUTS = {
+    "insight": float(os.environ.get("SAGA_INSIGHT_TIMEOUT", "90")),
+    "poem": float(os.environ.get("SAGA_POEM_TIMEOUT", "90")),
+    "novel": float(os.environ.get("SAGA_NOVEL_TIMEOUT", "120")),
+}
 
-    api_key = _require_openrouter_api_key()
-    logger.info(f"🔑 API key loaded: {api_key[:10]}...{api_key[-4:] if len(api_key) > 14 else 'short'}")
+# 部分失敗的請求保留已完成階段的檢查點，重試時從最後完成的階段接續（全部成功後刪除）
+CHECKPOINT_TTL = float(os.environ.get("SAGA_CHECKPOINT_TTL", "3600"))
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    site_url = os.environ.get("OPENROUTER_SITE_URL")
-    app_title = os.environ.get("OPENROUTER_APP_TITLE")
-    if site_url:
-        headers["HTTP-Referer"] = site_url
-        logger.info(f"🌐 HTTP-Referer: {site_url}")
-    if app_title:
-        headers["X-Title"] = app_title
-        logger.info(f"📋 X-Title: {app_title}")
-
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-    }
+SECTIONS = ("insight", "poem", "novel")
 
-    logger.info(f"📤 Request URL: {OPENROUTER_API_BASE}/chat/completions")
-    logger.info(f"📤 Request headers: {dict((k, v if k != 'Authorization' else f'Bearer {v[7:17]}...' ) for k, v in headers.items())}")
-    logger.info(f"📤 Request payload keys: {list(payload.keys())}")
-    logger.info(f"📤 First message preview: {messages[0] if messages else 'No messages'}")
+CHECKPOINT_RESUMED = Counter(
+    "saga_checkpoint_resumed_stages_total", "Stages restored from a request checkpoint instead of re-running", ("stage",),
+)
 
-    try:
-        resp = requests.post(f"{OPENROUTER_API_BASE}/chat/completions", json=payload, headers=headers, timeout=60)
-        logger.info(f"📥 Response status: {resp.status_code}")
-        logger.info(f"📥 Response headers: {dict(resp.headers)}")
-
-        resp.raise_for_status()
-        data = resp.json()
-        logger.info(f"📥 Response data keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
-
-        # Expecting choices[0].message.content
-        content = (
-            data.get("choices", [{}])[0]
-                .get("message", {})
-                .get("content", "")
-        )
+# 串流事件回呼：emit(event, data)
+EmitFn = Callable[[str, Dict[str, Any]], Awaitable[None]]
 
-        if not content:
-            logger.error(f"❌ OpenRouter returned empty content. Full response: {data}")
-            raise RuntimeError("OpenRouter returned empty content")
-
-        logger.info(f"✅ Successfully got content, length: {len(content)} chars")
-        logger.info(f"✅ Content preview: {content[:100]}...")
-        return content
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ Request failed: {e}")
-        logger.error(f"❌ Response text (if any): {getattr(e.response, 'text', 'No response text')}")
-        raise
-    except Exception as e:
-        logger.error(f"❌ Unexpected error: {e}")
-        raise
+# 進行中的生成合併：整個請求層級與單一階段層級
+saga_flights: SingleFlight = SingleFlight("saga")
+stage_flights: SingleFlight = SingleFlight("stage")
 
 
 def extract_repo_info_from_url(url: str) -> Tuple[str, str]:
     """
     从 GitHub URL 中提取仓库信息
+    支援 .git 結尾、/tree/<branch> 等子路徑、查詢字串與 git@github.com:owner/repo 形式
     """
-    pattern = r'github\.com/([^/]+)/([^/]+)'
-    match = re.search(pattern, url)
+    pattern = r'github\.com[/:]([^/\s?#]+)/([^/\s?#]+)'
+    match = re.search(pattern, url.strip(), re.IGNORECASE)
 
     if match:
         owner = match.group(1)
         repo = match.group(2)
-        repo = repo.replace('.git', '')
+        if repo.lower().endswith('.git'):
+            repo = repo[:-4]
         return owner, repo
     else:
         return "unknown", "unknown"
 
 
-async def generate_saga_from_repo(repo_url: str, presets: Dict[str, str] | None = None) -> Tuple[str, str, str]:
+def canonical_repo(url: str) -> str:
     """
-    从 GitHub 仓库 URL 生成文学作品（通过 OpenRouter）
-    返回: (洞察报告, 诗歌, 小说)
-    可選 presets: {poem_style, novel_genre, tone, language}
+    正規化的 owner/repo（GitHub 不分大小寫，因此一律小寫），作為快取鍵使用
+    """
+    owner, repo = extract_repo_info_from_url(url)
+    return f"{owner}/{repo}".lower()
+
+
+def build_presets(
+    poem_style: Optional[str] = None,
+    novel_genre: Optional[str] = None,
+    tone: Optional[str] = None,
+    lang: Optional[str] = None,
+    locale: Optional[str] = None,
+) -> Dict[str, Optional[str]]:
+    """由請求欄位組出 presets（lang 為 'en' 或 locale 以 en 開頭時使用英文）"""
+    is_english = lang == 'en' or bool(locale and locale.startswith('en'))
+    return {
+        "poem_style": poem_style,
+        "novel_genre": novel_genre,
+        "tone": tone,
+        "language": "English" if is_english else "Traditional Chinese",
+    }
+
+
+def _insight_messages(owner: str, repo: str, is_english: bool, digest: Optional[str] = None) -> List[Dict[str, str]]:
+    if digest is not None:
+        return get_prompts().render("insight", is_english, repo=f"{owner}/{repo}", digest=digest)
+    return get_prompts().render("insight_inferred", is_english, repo=f"{owner}/{repo}")
+
+
+def _poem_messages(owner: str, repo: str, insight_report: str, presets: Dict[str, str], is_english: bool) -> List[Dict[str, str]]:
+    return get_prompts().render("poem", is_english, presets, repo=f"{owner}/{repo}", insight=insight_report)
+
+
+def _novel_messages(owner: str, repo: str, insight_report: str, presets: Dict[str, str], is_english: bool) -> List[Dict[str, str]]:
+    return get_prompts().render("novel", is_english, presets, repo=f"{owner}/{repo}", insight=insight_report)
+
+
+def stage_cache_key(
+    section: str,
+    repo_key: str,
+    presets: Dict[str, str],
+    revision: Optional[str] = None,
+    insight: Optional[str] = None,
+    route: Optional[Route] = None,
+) -> str:
+    """
+    各階段的快取鍵，只包含會影響該階段輸出的欄位：
+    洞察報告取決於倉庫版本（commit SHA）與語言；詩歌與小說取決於洞察報告內容與各自的 presets，
+    因此只改 poem_style 時可重用洞察報告與小說，倉庫有新 commit 時則全部重新生成。
+    路由（模型、溫度、max_tokens）也是鍵的一部分，調整路由表後不會讀到舊模型的結果。
     """
-    logger.info(f"🎭 Starting saga generation for repo: {repo_url}")
-    presets = presets or {}
-    poem_style = presets.get("poem_style")
-    novel_genre = presets.get("novel_genre")
-    tone = presets.get("tone")
     language = presets.get("language", "Traditional Chinese")
-    is_english = language == "English"
+    routing = {"model": DEFAULT_MODEL}
+    if route is not None:
+        routing = {"model": route.model, "temperature": route.temperature, "max_tokens": route.max_tokens}
+    if section == "insight":
+        return make_key("insight", repo=repo_key, language=language, revision=revision, **routing)
+    fields = {
+        "poem": {"poem_style": presets.get("poem_style"), "tone": presets.get("tone")},
+        "novel": {"novel_genre": presets.get("novel_genre"), "tone": presets.get("tone")},
+    }[section]
+    return make_key(
+        section, repo=repo_key, language=language,
+        insight=make_key("text", text=insight), **routing, **fields,
+    )
+
+
+def saga_key(repo_key: str, presets: Dict[str, str]) -> str:
+    """
+    整個生成請求的鍵（正規化倉庫 + 全部 presets + 各階段路由）。
+    路由與 stage_cache_key 相同只取影響輸出的欄位；調整路由表後得到新的鍵（以及新的 saga id）。
+    """
+    routes = {}
+    for section in SECTIONS:
+        route = resolve_route(section, presets)
+        routes[section] = [route.model, route.temperature, route.max_tokens]
+    return make_key(
+        "saga", repo=repo_key, language=presets.get("language", "Traditional Chinese"),
+        poem_style=presets.get("poem_style"), novel_genre=presets.get("novel_genre"),
+        tone=presets.get("tone"), routes=routes,
+    )
+
+
+async def _shared_stage(
+    cache: TieredCache, key: str, produce: Callable[[], Awaitable[str]], refresh: bool = False,
+) -> str:
+    """
+    快取 + 單飛：相同階段鍵的並發請求共用一次上游呼叫，
+    例如兩個只有詩歌風格不同的請求共用同一個進行中的洞察報告。
+    refresh 時略過快取重新生成（不與一般請求合併，避免拿到正在讀取的舊內容）。
+    """
+    flight = f"{key}:refresh" if refresh else key
+    return await stage_flights.do(flight, lambda: cached(cache, key, produce, refresh=refresh))
 
-    owner, repo = extract_repo_info_from_url(repo_url)
-    logger.info(f"📂 Extracted repo info: {owner}/{repo}")
-    logger.info(f"🌐 Language setting: {language}")
-
-    if is_english:
-        analysis_prompt = (
-            f"Please analyze the GitHub project {owner}/{repo} and generate a project insight report.\n"
-            f"Include the project's core functionality, technical features, design philosophy, etc., "
-            f"and make reasonable inferences based on README and common directory structures."
-        )
-    else:
-        analysis_prompt = (
-            f"请分析 GitHub 项目 {owner}/{repo}，生成一份项目洞察报告。\n"
-            f"需要包含项目的核心功能、技术特点、设计理念等，并尽量参考 README 与常见目录结构进行合理推断。"
-        )
 
-    try:
-        logger.info("📊 Step 1/3: Generating insight report...")
-        system_content = (
-            "You are a senior open-source code reviewer and technical writer."
-            if is_english else
-            "你是一位资深的开源代码审阅者与技术作家。"
+def build_saga_stages(
+    owner: str, repo: str, presets: Dict[str, str], emit: Optional[EmitFn] = None, refresh: bool = False,
+) -> List[Stage]:
+    """
+    建立生成流程的階段圖：insight -> (poem, novel)。
+    poem 與 novel 只依賴 insight，因此並發執行；新增階段（例如俳句、變更日誌）
+    只需在此加入一個依賴 insight 的 Stage，不會增加端到端延遲。
+    每個階段的輸出都經過分層快取。insight 會先取得倉庫內容摘要（見 ingest.py）放進提示詞；
+    各階段提示詞依 context.PROMPT_BUDGETS 縮減（poem / novel 只保留洞察報告中價值最高的段落）。
+
+    每個階段的模型、溫度、max_tokens 與上游逾時由 routing.py 依 presets 決定。
+
+    提供 emit 時改用上游串流，並送出 stage_start / token / stage_done 事件。
+    refresh=True 時各階段略過快取重新生成（背景重新驗證用）。
+    輸出經 guards.py 檢查：失控的長度或重複迴圈提早中止並截斷，語言漂移重新生成一次
+    （串流時另送出 stage_retry / stage_truncated 事件）。
+    """
+    is_english = presets.get("language", "Traditional Chinese") == "English"
+    repo_key = f"{owner}/{repo}".lower()
+    cache = get_cache()
+    streamed: set = set()
+    routes = {section: resolve_route(section, presets) for section in ("insight", "poem", "novel")}
+
+    async def stream(section: str, messages: List[Dict[str, str]], options: Dict[str, Any], guard: Optional[OutputGuard]) -> str:
+        parts: List[str] = []
+        deltas = openrouter_stream(messages, **options)
+        async for delta in (deltas if guard is None else guarded(deltas, guard)):
+            parts.append(delta)
+            streamed.add(section)
+            await emit("token", {"section": section, "text": delta})
+        text = "".join(parts)
+        if not text:
+            raise RuntimeError("OpenRouter returned empty content")
+        return text
+
+    async def complete(section: str, messages: List[Dict[str, str]]) -> str:
+        route = routes[section]
+        options = dict(
+            model=route.model, temperature=route.temperature, max_tokens=route.max_tokens, timeout=route.timeout,
+        )
+        for attempt in range(GUARD_RETRIES + 1):
+            guard = None
+            if GUARDS_ENABLED:
+                guard = OutputGuard(section, presets.get("language", "Traditional Chinese"), route.max_tokens)
+            try:
+                if emit is None:
+                    text = await openrouter_chat_async(messages, **options)
+                    # 非串流（保留 hedging）只能事後檢查：截斷或重試，無法省下 token
+                    if guard is not None:
+                        guard.feed(text)
+                else:
+                    text = await stream(section, messages, options, guard)
+            except GuardTripped as trip:
+                retry = trip.reason == LANGUAGE and attempt < GUARD_RETRIES
+                saved = route.max_tokens if emit is not None else None
+                record_trip(section, trip, "retried" if retry else "truncated", guard.text, saved)
+                if retry:
+                    if emit is not None:
+                        await emit("stage_retry", {"section": section, "reason": trip.reason})
+                    continue
+                text = clean_cut(guard.text, trip.cut)
+                if not text:
+                    # 沒有可保留的內容時當作階段失敗，不把空字串寫入快取
+                    raise RuntimeError(f"Output guard left no usable {section} output ({trip.reason})")
+                if emit is not None:
+                    # 已送出的 token 可能包含迴圈內容，讓前端以截斷後的全文取代
+                    await emit("stage_truncated", {"section": section, "reason": trip.reason, "text": text.strip()})
+            return text.strip()
+
+    async def finish(section: str, text: str, started: float) -> None:
+        if emit is not None:
+            # 命中快取或合併到其他請求時沒有逐字串流，直接整段送出
+            if section not in streamed:
+                await emit("token", {"section": section, "text": text})
+            await emit("stage_done", {
+                "section": section,
+                "chars": len(text),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000),
+            })
+
+    def stage(section: str, make_messages: Callable[[Dict[str, str]], List[Dict[str, str]]]) -> StageFn:
+        async def run(deps: Dict[str, str]) -> str:
+            started = time.perf_counter()
+            if emit is not None:
+                await emit("stage_start", {"section": section})
+            key = stage_cache_key(section, repo_key, presets, insight=deps.get("insight"), route=routes[section])
+            text = await _shared_stage(cache, key, lambda: complete(section, make_messages(deps)), refresh)
+            await finish(section, text, started)
+            return text
+        return run
+
+    async def insight(deps: Dict[str, str]) -> str:
+        started = time.perf_counter()
+        if emit is not None:
+            await emit("stage_start", {"section": "insight"})
+        # 先分析倉庫實際內容（依 commit SHA 索引），洞察報告也以該 SHA 為快取鍵；
+        # head 由 repo_meta 以條件式請求確認（短時間內直接沿用），沒有摘要時也能以它區分版本
+        head = await get_repo_meta().head_sha(owner, repo)
+        digest = await get_repo_digest(owner, repo, revision=head)
+        revision = digest["revision"] if digest else head
+        key = stage_cache_key("insight", repo_key, presets, revision=revision, route=routes["insight"])
+        text = await _shared_stage(
+            cache, key, lambda: complete("insight", fit_prompt(
+                "insight",
+                # 有摘要時一律用摘要模板（包括 fit_prompt 以空字串量測模板開銷時）
+                lambda text: _insight_messages(owner, repo, is_english, text if digest else None),
+                format_digest(digest) if digest else "",
+                trim=truncate_to_tokens,
+            )), refresh,
         )
-        insight_report = openrouter_chat([
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": analysis_prompt},
-        ])
-        logger.info(f"✅ Step 1/3 completed. Insight report length: {len(insight_report)} chars")
-
-        logger.info("🎨 Step 2/3: Generating poem...")
-        if is_english:
-            style_hint = f"Style: {poem_style}. " if poem_style else ""
-            tone_hint = f"Tone: {tone}. " if tone else ""
-            poem_prompt = (
-                f"Based on the following project insight report, create a poem about the {owner}/{repo} project:\n"
-                f"{insight_report}\n\n"
-                f"{style_hint}{tone_hint}"
-                f"Requirements: Be imaginative, reflect the beauty of code and the spirit of the project, "
-                f"with clear stanzas for easy interface display."
-            )
-            system_content = "You are a modern poet who specializes in technical themes."
-        else:
-            style_hint = f"風格：{poem_style}。" if poem_style else ""
-            tone_hint = f"語氣：{tone}。" if tone else ""
-            poem_prompt = (
-                f"基于以下项目洞察报告，创作一首关于 {owner}/{repo} 项目的诗歌：\n"
-                f"{insight_report}\n\n"
-                f"{style_hint}{tone_hint}"
-                f"要求：富有想象力，体现代码的美感和项目的精神，分段清晰，便于界面展示。"
-            )
-            system_content = "你是一位擅长技术题材的现代诗歌创作者。"
-
-        poem = openrouter_chat([
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": poem_prompt},
-        ], temperature=0.9)
-        logger.info(f"✅ Step 2/3 completed. Poem length: {len(poem)} chars")
-
-        logger.info("📚 Step 3/3: Generating novel...")
-        if is_english:
-            genre_hint = f"Novel genre: {novel_genre}. " if novel_genre else ""
-            tone_hint2 = f"Tone: {tone}. " if tone else ""
-            novel_prompt = (
-                f"Based on the following project insight report, create a short story about the {owner}/{repo} project:\n"
-                f"{insight_report}\n\n"
-                f"{genre_hint}{tone_hint2}"
-                f"Requirements: Include plot and characters, reflect the story behind the project "
-                f"and the spirit of the developers, with appropriate length."
-            )
-            system_content = "You are a novelist who can blend technology with humanities."
-        else:
-            genre_hint = f"小說類型：{novel_genre}。" if novel_genre else ""
-            tone_hint2 = f"語氣：{tone}。" if tone else ""
-            novel_prompt = (
-                f"基于以下项目洞察报告，创作一篇关于 {owner}/{repo} 项目的短篇小说：\n"
-                f"{insight_report}\n\n"
-                f"{genre_hint}{tone_hint2}"
-                f"要求：有情节，有人物，体现项目背后的故事和开发者的精神，篇幅适中。"
-            )
-            system_content = "你是一位能够将技术与人文融合的小说作者。"
-
-        novel = openrouter_chat([
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": novel_prompt},
-        ])
-        logger.info(f"✅ Step 3/3 completed. Novel length: {len(novel)} chars")
+        await finish("insight", text, started)
+        return text
+
+    return [
+        Stage("insight", insight, timeout=STAGE_TIMEOUTS["insight"]),
+        Stage(
+            "poem",
+            stage("poem", lambda deps: fit_prompt(
+                "poem", lambda text: _poem_messages(owner, repo, text, presets, is_english), deps["insight"],
+            )),
+            deps=("insight",),
+            timeout=STAGE_TIMEOUTS["poem"],
+        ),
+        Stage(
+            "novel",
+            stage("novel", lambda deps: fit_prompt(
+                "novel", lambda text: _novel_messages(owner, repo, text, presets, is_english), deps["insight"],
+            )),
+            deps=("insight",),
+            timeout=STAGE_TIMEOUTS["novel"],
+        ),
+    ]
+
+
+class StageCheckpoint:
+    """
+    單一請求（saga_key，含路由）已完成階段的輸出，存在分層快取中。
+    重試時直接沿用，連 insight 前的倉庫內容擷取也不必重做。
+    """
 
+    def __init__(self, cache: TieredCache, request_key: str):
+        self.cache = cache
+        self.key = make_key("checkpoint", saga=request_key)
+        self.done: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> Dict[str, str]:
+        raw = await self.cache.get(self.key)
+        self.done = json.loads(raw) if raw else {}
+        return self.done
+
+    async def save(self, section: str, text: str) -> None:
+        # poem 與 novel 並發完成，序列化寫入避免較舊的內容覆蓋較新的
+        async with self._lock:
+            self.done[section] = text
+            await self.cache.set(self.key, json.dumps(self.done, ensure_ascii=False), ttl=CHECKPOINT_TTL)
+
+    async def clear(self) -> None:
+        await self.cache.delete(self.key)
+
+    def wrap(self, stage: Stage) -> Stage:
+        async def run(deps: Dict[str, str]) -> str:
+            if stage.name in self.done:
+                CHECKPOINT_RESUMED.inc(stage=stage.name)
+                return self.done[stage.name]
+            output = await stage.run(deps)
+            await self.save(stage.name, output)
+            return output
+        return replace(stage, run=run)
+
+
+async def _run_checkpointed(
+    owner: str, repo: str, presets: Dict[str, str], request_key: str, refresh: bool = False,
+) -> Tuple[Dict[str, str], Dict[str, StageError], Dict[str, float]]:
+    checkpoint = StageCheckpoint(get_cache(), request_key)
+    if await checkpoint.load():
+        logger.info(f"♻️ Resuming {owner}/{repo} from checkpoint: {', '.join(sorted(checkpoint.done))}")
+    timings: Dict[str, float] = {}
+    errors: Dict[str, StageError] = {}
+    stages = [checkpoint.wrap(stage) for stage in build_saga_stages(owner, repo, presets, refresh=refresh)]
+    results = await run_stages(stages, timings=timings, errors=errors)
+    if not errors:
+        await checkpoint.clear()
+    return results, errors, timings
+
+
+async def generate_saga_sections(
+    repo_url: str,
+    presets: Dict[str, str] | None = None,
+    timings: Optional[Dict[str, float]] = None,
+    refresh: bool = False,
+) -> Tuple[Dict[str, str], Dict[str, StageError]]:
+    """
+    部分結果版本：回傳 (成功的各段輸出, 失敗或被略過的各段錯誤)。
+    已完成的階段寫入檢查點，相同請求重試時只重跑失敗的階段。
+    refresh=True 時略過各階段快取重新生成（見 warming.regenerate）。
+    """
+    presets = presets or {}
+    owner, repo = extract_repo_info_from_url(repo_url)
+    logger.info(f"🎭 Starting saga generation for {owner}/{repo} ({presets.get('language', 'Traditional Chinese')})")
+    request_key = saga_key(f"{owner}/{repo}".lower(), presets)
+
+    # 相同倉庫與 presets 的並發請求合併為一次流程執行（合併的請求共用同一份耗時）
+    results, errors, stage_timings = await saga_flights.do(
+        f"{request_key}:refresh" if refresh else request_key,
+        lambda: _run_checkpointed(owner, repo, presets, request_key, refresh),
+    )
+    if timings is not None:
+        timings.update(stage_timings)
+    if errors:
+        logger.warning(f"⚠️ Partial saga for {owner}/{repo}: failed {', '.join(sorted(errors))}")
+    else:
         logger.info("🎉 All steps completed successfully!")
-        return insight_report.strip(), poem.strip(), novel.strip()
+    return results, errors
+
+
+async def generate_saga_from_repo(
+    repo_url: str,
+    presets: Dict[str, str] | None = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[str, str, str]:
+    """
+    从 GitHub 仓库 URL 生成文学作品（通过 OpenRouter）
+    返回: (洞察报告, 诗歌, 小说)
+    可選 presets: {poem_style, novel_genre, tone, language}
+    提供 timings 時填入各階段耗時（秒），供 Server-Timing 標頭使用
+    任一階段失敗時拋出該階段的 StageError（已完成的階段仍保留在檢查點中）
+    """
+    try:
+        results, errors = await generate_saga_sections(repo_url, presets, timings=timings)
+        for section in SECTIONS:
+            if section in errors:
+                raise errors[section]
+        return results["insight"], results["poem"], results["novel"]
 
     except Exception as e:
         logger.error(f"❌ Error in generate_saga_from_repo: {e}")
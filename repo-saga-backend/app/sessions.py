@@ -0,0 +1,139 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from .cache import MemoryLRU
+from .context import summarize_turns
+from .metrics import Counter, Gauge
+from .monitoring import current_stage
+from .openrouter import openrouter_chat_async
+from .prompts import get_prompts
+from .routing import resolve_route
+
+logger = logging.getLogger(__name__)
+
+# 每個行程保留的對話數上限與閒置到期時間（秒）
+CHAT_SESSIONS_MAX = int(os.environ.get("SAGA_CHAT_SESSIONS_MAX", "1000"))
+CHAT_SESSION_TTL = float(os.environ.get("SAGA_CHAT_SESSION_TTL", "3600"))
+# 歷史訊息超過此數量時在背景把較舊的部分濃縮進滾動摘要，只保留最近 KEEP 則原文
+CHAT_COMPACT_AFTER = int(os.environ.get("SAGA_CHAT_COMPACT_AFTER", "12"))
+CHAT_COMPACT_KEEP = int(os.environ.get("SAGA_CHAT_COMPACT_KEEP", "6"))
+
+SESSIONS = Gauge("saga_chat_sessions", "Chat sessions held in memory")
+COMPACTIONS = Counter("saga_chat_compactions_total", "Background chat history compactions", ("result",))
+
+
+@dataclass
+class ChatSession:
+    id: str
+    is_english: bool = False
+    summary: str = ""
+    turns: List[Dict[str, str]] = field(default_factory=list)
+    compacting: bool = False
+    updated_at: float = field(default_factory=time.time)
+
+
+class SessionStore:
+    """
+    伺服器端的聊天對話：LRU + 閒置 TTL 的有界儲存（每個行程各自一份）。
+    客戶端只需送出 session id 與新訊息，請求大小不隨對話長度增加。
+    """
+
+    def __init__(self, maxsize: int = CHAT_SESSIONS_MAX, ttl: float = CHAT_SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = MemoryLRU(maxsize)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, session_id: Optional[str]) -> Optional[ChatSession]:
+        if not session_id:
+            return None
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._touch(session)
+        return session
+
+    def create(self, is_english: bool = False) -> ChatSession:
+        session = ChatSession(id=uuid.uuid4().hex, is_english=is_english)
+        self._touch(session)
+        return session
+
+    def _touch(self, session: ChatSession) -> None:
+        session.updated_at = time.time()
+        self._sessions.set(session.id, session, expires_at=session.updated_at + self.ttl)
+        SESSIONS.set(len(self._sessions))
+
+    def append(self, session: ChatSession, user_message: str, reply: str) -> None:
+        """記錄一輪對話；歷史過長時排程背景壓縮"""
+        session.turns.append({"role": "user", "content": user_message})
+        session.turns.append({"role": "assistant", "content": reply})
+        self._touch(session)
+        if len(session.turns) > CHAT_COMPACT_AFTER and not session.compacting:
+            session.compacting = True
+            task = asyncio.create_task(self.compact(session), name=f"chat-compact:{session.id}")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def compact(self, session: ChatSession) -> None:
+        """
+        把最近 CHAT_COMPACT_KEEP 則以外的舊訊息與既有摘要合併成新的滾動摘要。
+        上游失敗時退回本機抽取式摘要，對話仍維持有界。
+        """
+        current_stage.set("chat_summary")
+        older = session.turns[:-CHAT_COMPACT_KEEP] if CHAT_COMPACT_KEEP else list(session.turns)
+        if not older:
+            session.compacting = False
+            return
+        try:
+            summary = await self._summarize(session.summary, older, session.is_english)
+            COMPACTIONS.inc(result="ok")
+        except asyncio.CancelledError:
+            session.compacting = False
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Chat summary failed for session {session.id}, using extractive summary: {e!r}")
+            summary = "\n".join(part for part in (
+                session.summary, summarize_turns(older, 300, session.is_english),
+            ) if part)
+            COMPACTIONS.inc(result="fallback")
+        # 壓縮期間可能有新的訊息加入，只移除已經濃縮的那幾則
+        del session.turns[:len(older)]
+        session.summary = summary
+        session.compacting = False
+        logger.info(f"🗜️ Compacted {len(older)} messages of chat session {session.id}")
+
+    async def _summarize(self, previous: str, turns: List[Dict[str, str]], is_english: bool) -> str:
+        transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+        messages = get_prompts().render(
+            "chat_summary", is_english, summary=previous or ("(none)" if is_english else "（無）"), transcript=transcript,
+        )
+        route = resolve_route("chat_summary", {"language": "English" if is_english else "Traditional Chinese"})
+        return (await openrouter_chat_async(
+            messages, model=route.model, temperature=route.temperature,
+            max_tokens=route.max_tokens, timeout=route.timeout,
+        )).strip()
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        _store = SessionStore()
+    return _store
+
+
+async def close_session_store() -> None:
+    global _store
+    if _store is not None:
+        await _store.aclose()
+        _store = None
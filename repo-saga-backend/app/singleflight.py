@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+
+from .metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SINGLEFLIGHT_CALLS = Counter(
+    "saga_singleflight_calls_total",
+    "Calls through single-flight groups; result=leader ran the work, result=coalesced joined an in-flight call",
+    ("scope", "result"),
+)
+SINGLEFLIGHT_HIT_RATIO = Gauge(
+    "saga_singleflight_hit_ratio",
+    "Fraction of single-flight calls that were coalesced onto an in-flight execution",
+    ("scope",),
+)
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    合併相同 key 的並發呼叫：同一時間只執行一次，所有等待者取得同一份結果（或同一個例外）。
+    共享的執行以獨立 task 進行：某個等待者取消時不影響其他等待者；
+    最後一個等待者也離開時，才取消共享的執行（連同其上游請求）。
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._inflight: Dict[str, _Call] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._inflight.get(key)
+        if call is None or call.task.done():
+            call = _Call(asyncio.create_task(fn(), name=f"singleflight:{self.scope}"))
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda t, key=key: self._forget(key, t))
+            self._record("leader")
+        else:
+            logger.info(f"🔗 Coalesced onto in-flight {self.scope}: {key}")
+            self._record("coalesced")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        call = self._inflight.get(key)
+        if call is not None and call.task is task:
+            del self._inflight[key]
+        # 確保沒有等待者時例外也會被取回，避免 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def _record(self, result: str) -> None:
+        SINGLEFLIGHT_CALLS.inc(scope=self.scope, result=result)
+        leaders = SINGLEFLIGHT_CALLS.value(scope=self.scope, result="leader")
+        coalesced = SINGLEFLIGHT_CALLS.value(scope=self.scope, result="coalesced")
+        SINGLEFLIGHT_HIT_RATIO.set(coalesced / (leaders + coalesced), scope=self.scope)
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
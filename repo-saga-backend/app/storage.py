@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteDB:
+    """
+    本機 SQLite 檔案的共用基底：WAL 模式讓同一台機器上的多個 uvicorn worker
+    可共用同一個檔案；每個執行緒使用各自的連線（搭配 asyncio.to_thread 使用）。
+    子類別在 SCHEMA 中宣告資料表。
+    """
+
+    SCHEMA: str = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        if self.SCHEMA:
+            self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from .pipeline import StageError, run_stages
+from .services import build_saga_stages, extract_repo_info_from_url
+
+logger = logging.getLogger(__name__)
+
+# 每個連線的事件佇列上限；佇列滿時上游讀取會暫停（背壓），不會無限緩衝
+STREAM_QUEUE_SIZE = int(os.environ.get("SAGA_STREAM_QUEUE_SIZE", "32"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # 關閉 nginx 之類反向代理的回應緩衝
+}
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def saga_event_stream(repo_url: str, presets: Dict[str, str]) -> AsyncIterator[str]:
+    """
+    以 Server-Sent Events 逐步輸出生成流程：
+      stage_start / token / stage_done（依 section 標記：insight、poem、novel）
+      error（某階段失敗）與最後的 summary。
+    客戶端斷線時取消流程；與其他請求共享中的階段會為其餘等待者繼續執行。
+    """
+    queue: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    closed = False
+
+    async def emit(event: str, data: Dict[str, Any]) -> None:
+        if not closed:
+            await queue.put((event, data))
+
+    started = time.perf_counter()
+    owner, repo = extract_repo_info_from_url(repo_url)
+    pipeline = asyncio.create_task(run_stages(build_saga_stages(owner, repo, presets, emit=emit)))
+    getter: Optional[asyncio.Future] = None
+
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, pipeline}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield format_sse(*getter.result())
+                continue
+            getter.cancel()
+            break
+
+        while not queue.empty():
+            yield format_sse(*queue.get_nowait())
+
+        try:
+            results = pipeline.result()
+        except StageError as e:
+            logger.error(f"❌ Streaming generation failed: {e}")
+            yield format_sse("error", {"section": e.stage, "message": str(e.cause)})
+            return
+        except Exception as e:
+            logger.error(f"❌ Streaming generation failed: {e}")
+            yield format_sse("error", {"section": None, "message": str(e)})
+            return
+
+        yield format_sse("summary", {
+            "repo_url": repo_url,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000),
+            "sections": {name: len(text) for name, text in results.items()},
+        })
+    finally:
+        closed = True
+        if getter is not None and not getter.done():
+            getter.cancel()
+        # 釋放可能卡在 queue.put 上的階段
+        while not queue.empty():
+            queue.get_nowait()
+        if not pipeline.done():
+            pipeline.cancel()
+        await asyncio.gather(pipeline, return_exceptions=True)
@@ -0,0 +1,267 @@
+"""
+熱門倉庫的快取預熱與 stale-while-revalidate。
+
+/generate 的完整結果以請求鍵（saga_key，含各階段路由，調整路由表後不會沿用舊模型的結果）快取，並標記生成時的倉庫 head SHA（見 repo_meta.py）：
+head 未變時直接回傳；倉庫有新 commit 時仍立即回傳舊結果（stale），同時在背景重新生成。
+無法確認 head（離線、查詢失敗）時退回以生成時間判斷（SAGA_FRESH_SECONDS）。
+
+背景預熱依請求頻率（指數衰減）挑出最熱門的 N 組（倉庫, presets），
+在服務閒置時為缺少或過期的項目預先生成，並受每小時上游呼叫預算限制。
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from .cache import get_cache, make_key
+from .limits import TokenBucket, current_client, current_priority, get_limiter
+from .metrics import Counter, Gauge
+from .pipeline import StageError
+from .repo_meta import get_repo_meta
+from .services import SECTIONS, build_presets, canonical_repo, extract_repo_info_from_url, generate_saga_sections, saga_key
+
+logger = logging.getLogger(__name__)
+
+# 無法確認倉庫 head 時，完整結果在此秒數內視為新鮮；之後到快取 TTL（SAGA_CACHE_TTL）為止以 stale 回傳並背景更新
+SAGA_FRESH_SECONDS = float(os.environ.get("SAGA_FRESH_SECONDS", str(6 * 3600)))
+WARM_INTERVAL = float(os.environ.get("SAGA_WARM_INTERVAL", "300"))  # 0 表示停用背景預熱
+WARM_TOP_N = int(os.environ.get("SAGA_WARM_TOP_N", "20"))
+# 每小時預熱可用的上游呼叫數；每次生成預扣 3 次（insight / poem / novel）
+WARM_UPSTREAM_BUDGET = float(os.environ.get("SAGA_WARM_UPSTREAM_BUDGET", "60"))
+WARM_HALF_LIFE = float(os.environ.get("SAGA_WARM_HALF_LIFE", "86400"))
+# 閒置判斷：最近一分鐘的生成請求數與目前在途的上游請求數都不超過門檻
+WARM_QUIET_RPM = int(os.environ.get("SAGA_WARM_QUIET_RPM", "5"))
+WARM_QUIET_IN_FLIGHT = int(os.environ.get("SAGA_WARM_QUIET_IN_FLIGHT", "2"))
+# 啟動時即列入預熱的倉庫（逗號分隔的 URL），以中英文預設 presets 預熱
+WARM_SEED_REPOS = [url.strip() for url in os.environ.get("SAGA_WARM_REPOS", "").split(",") if url.strip()]
+
+CALLS_PER_SAGA = 3
+
+SAGA_RESULTS = Counter("saga_result_cache_total", "Full saga result lookups by freshness", ("state",))
+WARM_RUNS = Counter("saga_warm_total", "Background pre-warming outcomes", ("result",))
+WARM_BUDGET = Gauge("saga_warm_budget_calls", "Upstream calls left in the pre-warming budget")
+
+Presets = Dict[str, Optional[str]]
+
+
+def _result_key(request_key: str) -> str:
+    return make_key("saga_result", saga=request_key)
+
+
+class Popularity:
+    """每組 (倉庫, presets) 的請求頻率，以半衰期指數衰減，舊的熱門項目會自然退場"""
+
+    def __init__(self, half_life: float = WARM_HALF_LIFE, maxsize: int = 10000):
+        self.half_life = half_life
+        self.maxsize = maxsize
+        self._scores: Dict[str, Tuple[float, float, str, Presets]] = {}  # key -> (score, updated, url, presets)
+        self._recent: Deque[float] = deque()
+
+    def _decayed(self, score: float, updated: float, now: float) -> float:
+        return score * math.exp(-math.log(2) * (now - updated) / self.half_life)
+
+    def record(self, repo_url: str, presets: Presets, weight: float = 1.0) -> None:
+        now = time.time()
+        key = saga_key(canonical_repo(repo_url), presets)
+        score, updated, _, _ = self._scores.get(key, (0.0, now, repo_url, presets))
+        self._scores[key] = (self._decayed(score, updated, now) + weight, now, repo_url, presets)
+        if weight > 0:
+            self._recent.append(now)
+        if len(self._scores) > self.maxsize:
+            del self._scores[min(self._scores, key=lambda k: self._decayed(*self._scores[k][:2], now))]
+
+    def recent_rpm(self) -> int:
+        cutoff = time.time() - 60
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+        return len(self._recent)
+
+    def top(self, n: int) -> List[Tuple[str, Presets]]:
+        now = time.time()
+        ranked = sorted(self._scores.values(), key=lambda item: -self._decayed(item[0], item[1], now))
+        return [(url, presets) for _, _, url, presets in ranked[:n]]
+
+
+popularity = Popularity()
+_refreshing: Set[str] = set()
+_refresh_tasks: Set[asyncio.Task] = set()
+
+
+async def load_result(request_key: str) -> Optional[Dict]:
+    """完整結果快取項目：{repo_url, presets, sections, generated_at, head_sha}"""
+    raw = await get_cache().get(_result_key(request_key))
+    return json.loads(raw) if raw else None
+
+
+async def repo_head(repo_url: str) -> Optional[str]:
+    return await get_repo_meta().head_sha(*extract_repo_info_from_url(repo_url))
+
+
+def is_fresh(entry: Dict, head: Optional[str]) -> bool:
+    """以倉庫版本判斷；雙方都有 head SHA 時不看生成時間"""
+    if head and entry.get("head_sha"):
+        return entry["head_sha"] == head
+    return time.time() - entry["generated_at"] < SAGA_FRESH_SECONDS
+
+
+async def _store(
+    request_key: str, repo_url: str, presets: Presets, results: Dict[str, str], head: Optional[str],
+) -> None:
+    entry = {
+        "repo_url": repo_url,
+        "presets": presets,
+        "sections": {section: results[section] for section in SECTIONS},
+        "generated_at": time.time(),
+        "head_sha": head,
+    }
+    await get_cache().set(_result_key(request_key), json.dumps(entry, ensure_ascii=False))
+
+
+async def regenerate(
+    repo_url: str, presets: Presets, refresh: bool = True,
+) -> Tuple[Dict[str, str], Dict[str, StageError]]:
+    """
+    重新生成並在全部段落成功時寫入完整結果快取。
+    head 已知時新版本本來就對應新的 insight 鍵；head 未知時 insight 的鍵不含版本，
+    refresh 時須略過各階段快取，否則只是重組舊段落，並沒有重新驗證。
+    """
+    # 生成前取得 head：生成期間倉庫若又移動，標記的是較舊的 SHA，下次查詢會再更新
+    head = await repo_head(repo_url)
+    results, errors = await generate_saga_sections(repo_url, presets, refresh=refresh and head is None)
+    if not errors:
+        await _store(saga_key(canonical_repo(repo_url), presets), repo_url, presets, results, head)
+    return results, errors
+
+
+def _refresh_in_background(request_key: str, repo_url: str, presets: Presets) -> None:
+    if request_key in _refreshing:
+        return
+    _refreshing.add(request_key)
+
+    async def refresh() -> None:
+        # 背景更新不與觸發它的互動式請求同等級
+        current_priority.set("batch")
+        try:
+            _, errors = await regenerate(repo_url, presets)
+            WARM_RUNS.inc(result="revalidated" if not errors else "error")
+        except Exception as e:
+            logger.warning(f"⚠️ Background refresh of {repo_url} failed: {e!r}")
+            WARM_RUNS.inc(result="error")
+        finally:
+            _refreshing.discard(request_key)
+
+    task = asyncio.create_task(refresh(), name=f"saga-refresh:{request_key}")
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def cached_saga(
+    repo_url: str, presets: Presets, timings: Optional[Dict[str, float]] = None,
+) -> Tuple[Dict[str, str], Dict[str, StageError]]:
+    """
+    /generate 的快取入口：倉庫未變的結果直接回傳，過期結果立即回傳並在背景重新生成，
+    沒有結果時照常生成（與 generate_saga_sections 相同的回傳格式）。
+    """
+    popularity.record(repo_url, presets)
+    request_key = saga_key(canonical_repo(repo_url), presets)
+    started = time.perf_counter()
+    entry = await load_result(request_key)
+    head = await repo_head(repo_url)
+    if entry is not None:
+        if timings is not None:
+            timings["saga_cache"] = time.perf_counter() - started
+        if is_fresh(entry, head):
+            SAGA_RESULTS.inc(state="fresh")
+        else:
+            SAGA_RESULTS.inc(state="stale")
+            logger.info(f"♻️ Serving stale saga for {canonical_repo(repo_url)}, revalidating in background")
+            _refresh_in_background(request_key, repo_url, presets)
+        return dict(entry["sections"]), {}
+
+    SAGA_RESULTS.inc(state="miss")
+    results, errors = await generate_saga_sections(repo_url, presets, timings=timings)
+    if not errors:
+        await _store(request_key, repo_url, presets, results, head)
+    return results, errors
+
+
+class Warmer:
+    def __init__(self, budget_per_hour: float = WARM_UPSTREAM_BUDGET, top_n: int = WARM_TOP_N):
+        self.top_n = top_n
+        self.budget = TokenBucket(budget_per_hour / 60, capacity=budget_per_hour)
+
+    def quiet(self) -> bool:
+        limiter = get_limiter()
+        return (
+            popularity.recent_rpm() <= WARM_QUIET_RPM
+            and limiter.in_flight + limiter.waiting <= WARM_QUIET_IN_FLIGHT
+        )
+
+    async def warm_once(self) -> int:
+        """為熱門項目中缺少或過期的結果預先生成；回傳本輪生成的數量"""
+        if not self.quiet():
+            WARM_RUNS.inc(result="busy")
+            return 0
+        warmed = 0
+        for repo_url, presets in popularity.top(self.top_n):
+            entry = await load_result(saga_key(canonical_repo(repo_url), presets))
+            if entry is not None and is_fresh(entry, await repo_head(repo_url)):
+                continue
+            if self.budget.reserve(CALLS_PER_SAGA) > 0:
+                self.budget.refund(CALLS_PER_SAGA)
+                WARM_RUNS.inc(result="budget")
+                break
+            if not self.quiet():
+                self.budget.refund(CALLS_PER_SAGA)
+                WARM_RUNS.inc(result="busy")
+                break
+            try:
+                # 缺少的項目可沿用各階段快取，過期的項目才需要重新生成
+                _, errors = await regenerate(repo_url, presets, refresh=entry is not None)
+            except Exception as e:
+                logger.warning(f"⚠️ Pre-warming {repo_url} failed: {e!r}")
+                errors = {"saga": e}
+            WARM_RUNS.inc(result="warmed" if not errors else "error")
+            warmed += 1
+        WARM_BUDGET.set(max(0.0, self.budget.tokens))
+        if warmed:
+            logger.info(f"🔥 Pre-warmed {warmed} popular sagas")
+        return warmed
+
+    async def run(self, interval: float) -> None:
+        current_priority.set("batch")
+        current_client.set("warmer")
+        for url in WARM_SEED_REPOS:
+            for lang in ("en", None):
+                popularity.record(url, build_presets(lang=lang), weight=0.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.warm_once()
+            except Exception as e:
+                logger.warning(f"⚠️ Pre-warming round failed: {e!r}")
+
+
+_warmer_task: Optional[asyncio.Task] = None
+
+
+def start_warmer() -> None:
+    global _warmer_task
+    if WARM_INTERVAL > 0 and WARM_UPSTREAM_BUDGET > 0 and _warmer_task is None:
+        _warmer_task = asyncio.create_task(Warmer().run(WARM_INTERVAL), name="saga-warmer")
+
+
+async def stop_warmer() -> None:
+    global _warmer_task
+    tasks = list(_refresh_tasks)
+    if _warmer_task is not None:
+        tasks.append(_warmer_task)
+        _warmer_task = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
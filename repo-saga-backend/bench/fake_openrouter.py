@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+本機假 OpenRouter：可設定延遲分佈、輸出速度與錯誤注入，供壓測使用（不需網路）
+
+    python -m bench.fake_openrouter --port 9100 --latency lognormal:0.8,0.4 --tps 60 --error-rate 0.02
+
+延遲分佈格式：
+    fixed:<秒>
+    uniform:<最小>,<最大>
+    lognormal:<中位數>,<sigma>
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "code flows like rivers through the quiet night while tests stand guard and "
+    "commits carry stories of developers who dream in functions and types"
+).split()
+
+
+def parse_distribution(spec: str):
+    """把 "lognormal:0.8,0.4" 之類的描述轉成取樣函式"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+@dataclass
+class FakeConfig:
+    latency: str = "fixed:0.5"        # 第一個 token 前的延遲（TTFT）
+    tps: float = 80.0                 # 輸出 token / 秒
+    output_tokens: int = 300
+    error_rate: float = 0.0           # 回應 500/503 的比例
+    rate_limit_rate: float = 0.0      # 回應 429 的比例
+    stream_error_rate: float = 0.0    # 串流中途送出 error chunk 的比例
+    seed: Optional[int] = None
+    stats: Dict[str, int] = field(default_factory=lambda: {
+        "calls": 0, "errors": 0, "throttled": 0, "stream_errors": 0, "in_flight": 0, "peak": 0,
+    })
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="fake-openrouter")
+    rng = random.Random(config.seed)
+    sample_latency = parse_distribution(config.latency)
+    stats = config.stats
+
+    def reply_tokens():
+        return [rng.choice(WORDS) for _ in range(config.output_tokens)]
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/{path:path}")
+    async def completions(request: Request):
+        body = await request.json()
+        stats["calls"] += 1
+        roll = rng.random()
+        if roll < config.rate_limit_rate:
+            stats["throttled"] += 1
+            return JSONResponse({"error": {"code": 429}}, status_code=429, headers={"Retry-After": "1"})
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"code": 503}}, status_code=rng.choice((500, 503)))
+
+        ttft = sample_latency(rng)
+        tokens = reply_tokens()
+        usage = {"prompt_tokens": 200, "completion_tokens": len(tokens), "total_tokens": 200 + len(tokens)}
+        if body.get("stream"):
+            fail = rng.random() < config.stream_error_rate
+            return StreamingResponse(_stream(tokens, ttft, config.tps, fail, stats), media_type="text/event-stream")
+
+        stats["in_flight"] += 1
+        stats["peak"] = max(stats["peak"], stats["in_flight"])
+        try:
+            await asyncio.sleep(ttft + len(tokens) / config.tps)
+        finally:
+            stats["in_flight"] -= 1
+        return {"choices": [{"message": {"content": " ".join(tokens)}}], "usage": usage}
+
+    return app
+
+
+async def _stream(tokens, ttft: float, tps: float, fail: bool, stats: Dict[str, int]):
+    """以約 50ms 一批的速度送出 token，總長約 ttft + len(tokens) / tps"""
+    stats["in_flight"] += 1
+    stats["peak"] = max(stats["peak"], stats["in_flight"])
+    try:
+        yield ": OPENROUTER PROCESSING\n\n"
+        await asyncio.sleep(ttft)
+        per_batch = max(1, int(tps * 0.05))
+        started = time.perf_counter()
+        for i in range(0, len(tokens), per_batch):
+            if fail and i >= len(tokens) // 2:
+                stats["stream_errors"] += 1
+                yield f"data: {json.dumps({'error': {'message': 'injected stream error'}})}\n\n"
+                return
+            text = " ".join(tokens[i:i + per_batch])
+            yield f"data: {json.dumps({'choices': [{'delta': {'content': (' ' if i else '') + text}}]})}\n\n"
+            # 依累計時間排程，避免誤差累積
+            await asyncio.sleep(max(0.0, started + (i + per_batch) / tps - time.perf_counter()))
+        yield "data: [DONE]\n\n"
+    finally:
+        stats["in_flight"] -= 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local fake OpenRouter for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="fixed:0.5", help="time to first token distribution")
+    parser.add_argument("--tps", type=float, default=80.0, help="output tokens per second")
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeConfig(
+        latency=args.latency, tps=args.tps, output_tokens=args.output_tokens,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        stream_error_rate=args.stream_error_rate, seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+壓測 / 延遲基準：啟動本機假 OpenRouter 與後端（各自獨立行程），以指定並發打
+/generate、/generate/stream 與 /chat，回報 p50/p95/p99 延遲、TTFB、req/s 與後端的 event loop 延遲，
+並把結果寫成 JSON，方便比較不同 commit。
+
+    cd repo-saga-backend
+    python -m bench.loadtest --scenarios generate,stream,chat --concurrency 16 --requests 64 \\
+        --latency lognormal:0.8,0.4 --tps 60 --error-rate 0.02
+
+已有執行中的後端時可用 --backend-url（此時假上游需自行啟動並設定 OPENROUTER_API_BASE）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("generate", "stream", "chat")
+
+
+@dataclass
+class Sample:
+    ok: bool
+    status: int
+    latency: float
+    ttfb: Optional[float] = None
+    first_token: Optional[float] = None
+    error: str = ""
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """線性內插的百分位數（q 介於 0~100）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": _ms(percentile(values, 50)),
+        "p95": _ms(percentile(values, 95)),
+        "p99": _ms(percentile(values, 99)),
+        "max": _ms(max(values)) if values else None,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+# ---- 各情境的單一請求 ----
+
+def _repo_url(scenario: str, index: int, unique: bool) -> str:
+    # 預設每個請求（跨情境）用不同倉庫，避免量到的是快取命中
+    return f"https://github.com/bench/{scenario}-{index}" if unique else "https://github.com/bench/repo"
+
+
+async def _timed_post(
+    client: httpx.AsyncClient, path: str, body: Dict[str, Any], stream_events: bool = False,
+) -> Tuple[Sample, bytes]:
+    started = time.perf_counter()
+    ttfb = first_token = None
+    chunks: List[bytes] = []
+    try:
+        async with client.stream("POST", path, json=body) as resp:
+            async for chunk in resp.aiter_bytes():
+                now = time.perf_counter() - started
+                if ttfb is None:
+                    ttfb = now
+                if stream_events and first_token is None and b"event: token" in chunk:
+                    first_token = now
+                chunks.append(chunk)
+            status = resp.status_code
+    except httpx.HTTPError as e:
+        return Sample(ok=False, status=0, latency=time.perf_counter() - started, error=repr(e)), b""
+    latency = time.perf_counter() - started
+    payload = b"".join(chunks)
+    ok = status == 200
+    error = ""
+    if ok and stream_events and b"event: error" in payload:
+        ok, error = False, "error event"
+    elif ok and path == "/generate" and b"insight_report" not in payload:
+        ok, error = False, "bad body"
+    elif not ok:
+        error = payload[:200].decode("utf-8", "replace")
+    return Sample(ok=ok, status=status, latency=latency, ttfb=ttfb, first_token=first_token, error=error), payload
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, requests: int, concurrency: int, unique: bool) -> Tuple[List[Sample], float]:
+    """封閉迴圈：concurrency 個 worker 依序取用請求編號直到做完 requests 個"""
+    counter = iter(range(requests))
+    samples: List[Sample] = []
+
+    async def worker(worker_id: int) -> None:
+        session_id = None
+        for index in counter:
+            if scenario == "generate":
+                sample, _ = await _timed_post(client, "/generate", {"url": _repo_url(scenario, index, unique), "lang": "en"})
+            elif scenario == "stream":
+                sample, _ = await _timed_post(
+                    client, "/generate/stream", {"url": _repo_url(scenario, index, unique), "lang": "en"},
+                    stream_events=True,
+                )
+            else:
+                # 每個 worker 是一個持續中的對話
+                body = {"message": f"How does the analysis work? ({index})", "lang": "en", "session_id": session_id}
+                sample, payload = await _timed_post(client, "/chat", body)
+                if sample.ok:
+                    session_id = json.loads(payload).get("session_id") or session_id
+            samples.append(sample)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+# ---- 伺服器端指標 ----
+
+_METRIC_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$')
+
+
+async def scrape(client: httpx.AsyncClient) -> Dict[str, float]:
+    try:
+        text = (await client.get("/metrics")).text
+    except httpx.HTTPError:
+        return {}
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match:
+            values[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return values
+
+
+def loop_lag(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, Optional[float]]:
+    """由兩次 /metrics 的 histogram 差值估算本情境期間的 event loop 延遲"""
+    name = "saga_event_loop_lag_seconds"
+    count = after.get(f"{name}_count", 0) - before.get(f"{name}_count", 0)
+    if count <= 0:
+        return {"samples": 0, "mean_ms": None, "p99_ms": None, "max_ms": _ms(after.get("saga_event_loop_lag_max_seconds"))}
+    total = after.get(f"{name}_sum", 0) - before.get(f"{name}_sum", 0)
+    buckets = sorted(
+        (float(key.split('le="')[1].rstrip('"}')), after[key] - before.get(key, 0))
+        for key in after if key.startswith(f"{name}_bucket")
+    )
+    p99 = None
+    for bound, cumulative in buckets:
+        if cumulative >= 0.99 * count:
+            p99 = bound
+            break
+    return {
+        "samples": int(count),
+        "mean_ms": _ms(total / count),
+        "p99_ms": _ms(p99) if p99 is not None and p99 != float("inf") else None,
+        "max_ms": _ms(after.get("saga_event_loop_lag_max_seconds")),
+    }
+
+
+def summarize(samples: List[Sample], wall: float) -> Dict[str, Any]:
+    ok = [s for s in samples if s.ok]
+    statuses: Dict[str, int] = {}
+    for s in samples:
+        statuses[str(s.status)] = statuses.get(str(s.status), 0) + 1
+    errors = [s.error for s in samples if not s.ok][:5]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else None,
+        "statuses": statuses,
+        "wall_s": round(wall, 3),
+        "req_per_s": round(len(samples) / wall, 2) if wall > 0 else None,
+        "latency_ms": distribution([s.latency for s in ok]),
+        "ttfb_ms": distribution([s.ttfb for s in ok if s.ttfb is not None]),
+        "first_token_ms": distribution([s.first_token for s in ok if s.first_token is not None]),
+        "sample_errors": errors,
+    }
+
+
+# ---- 行程管理 ----
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def _output(verbose: bool) -> Dict[str, Any]:
+    # 後端的 INFO 日誌量很大，預設不輸出以免干擾結果
+    return {} if verbose else {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+
+
+def start_fake_upstream(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "bench.fake_openrouter", "--port", str(port),
+        "--latency", args.latency, "--tps", str(args.tps), "--output-tokens", str(args.output_tokens),
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+        "--stream-error-rate", str(args.stream_error_rate),
+    ]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    return subprocess.Popen(cmd, cwd=BACKEND_ROOT, **_output(args.verbose))
+
+
+def start_backend(port: int, upstream_port: int, workdir: str, workers: int, verbose: bool) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OPENROUTER_API_KEY=os.environ.get("OPENROUTER_API_KEY", "sk-bench"),
+        OPENROUTER_API_BASE=f"http://127.0.0.1:{upstream_port}/api/v1",
+        SAGA_CACHE_PATH="",
+        SAGA_JOB_DB=os.path.join(workdir, "jobs.sqlite3"),
+        SAGA_INGEST_DOWNLOAD="0",
+        SAGA_INGEST_DB="",
+    )
+    cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=BACKEND_ROOT, env=env, **_output(verbose))
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_ROOT, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    processes: List[subprocess.Popen] = []
+    upstream_url = args.upstream_url
+    try:
+        with tempfile.TemporaryDirectory(prefix="saga-bench-") as workdir:
+            backend_url = args.backend_url
+            if backend_url is None:
+                upstream_port = free_port()
+                processes.append(start_fake_upstream(args, upstream_port))
+                upstream_url = f"http://127.0.0.1:{upstream_port}"
+                await wait_until_up(f"{upstream_url}/stats")
+                backend_port = free_port()
+                processes.append(start_backend(backend_port, upstream_port, workdir, args.workers, args.verbose))
+                backend_url = f"http://127.0.0.1:{backend_port}"
+                await wait_until_up(f"{backend_url}/")
+
+            limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+            results: Dict[str, Any] = {}
+            async with httpx.AsyncClient(base_url=backend_url, timeout=args.timeout, limits=limits) as client:
+                for scenario in args.scenarios:
+                    before = await scrape(client)
+                    upstream_before = await _upstream_stats(upstream_url)
+                    print(f"▶️  {scenario}: {args.requests} requests at concurrency {args.concurrency}")
+                    samples, wall = await run_scenario(client, scenario, args.requests, args.concurrency, not args.same_repo)
+                    result = summarize(samples, wall)
+                    result["event_loop_lag"] = loop_lag(before, await scrape(client))
+                    upstream_after = await _upstream_stats(upstream_url)
+                    if upstream_before and upstream_after:
+                        result["upstream"] = {
+                            key: upstream_after[key] - upstream_before.get(key, 0)
+                            for key in ("calls", "errors", "throttled", "stream_errors")
+                        }
+                        result["upstream"]["peak_in_flight"] = upstream_after.get("peak")
+                    results[scenario] = result
+                    print_result(scenario, result)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out",)}
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": config,
+        },
+        "scenarios": results,
+    }
+
+
+async def _upstream_stats(upstream_url: Optional[str]) -> Optional[Dict[str, int]]:
+    if not upstream_url:
+        return None
+    try:
+        async with httpx.AsyncClient() as client:
+            return (await client.get(f"{upstream_url}/stats")).json()
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def print_result(scenario: str, result: Dict[str, Any]) -> None:
+    lat, ttfb, lag = result["latency_ms"], result["ttfb_ms"], result["event_loop_lag"]
+    print(
+        f"   ok {result['ok']}/{result['requests']}  {result['req_per_s']} req/s  "
+        f"latency p50/p95/p99 {lat['p50']}/{lat['p95']}/{lat['p99']} ms  "
+        f"ttfb p50/p95 {ttfb['p50']}/{ttfb['p95']} ms  "
+        f"loop lag mean/p99 {lag['mean_ms']}/{lag['p99_ms']} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Repo Saga load test against a local fake OpenRouter")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [s for s in value.split(",") if s])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32, help="requests per scenario")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--same-repo", action="store_true", help="hit one repo repeatedly (measures cache / coalescing)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the spawned backend")
+    parser.add_argument("--backend-url", default=None, help="use an already running backend")
+    parser.add_argument("--upstream-url", default=None, help="fake upstream to read /stats from when --backend-url is set")
+    parser.add_argument("--latency", default="lognormal:0.5,0.4", help="fake upstream time-to-first-token distribution")
+    parser.add_argument("--tps", type=float, default=80.0)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show backend and fake upstream logs")
+    parser.add_argument("--out", default=None, help="result JSON path (default bench/results/<time>-<rev>.json)")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    out = args.out
+    if out is None:
+        revision = (report["meta"]["git_revision"] or "nogit")[:10]
+        out = os.path.join(BACKEND_ROOT, "bench", "results", f"{time.strftime('%Y%m%d-%H%M%S')}-{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"📝 Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
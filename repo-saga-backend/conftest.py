@@ -0,0 +1,106 @@
+"""
+共用的 pytest fixtures：本機假 OpenRouter 上游與隔離的快取
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app import answer_cache, cache, ingest, jobs, openrouter, repo_meta
+
+UPSTREAM_DELAY = 0.3
+
+
+def make_fake_upstream(delay: float = UPSTREAM_DELAY):
+    """建立一個延遲固定時間後回應的假 OpenRouter，並記錄呼叫次數與同時在途的請求峰值"""
+    fake = FastAPI()
+    state = {"in_flight": 0, "peak": 0, "calls": 0, "prompts": []}
+
+    @fake.post("/{path:path}")
+    async def completions(body: dict):
+        state["calls"] += 1
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        prompt = body["messages"][-1]["content"]
+        state["prompts"].append(prompt)
+        reply = f"fake reply to: {prompt[:30]}"
+        if body.get("stream"):
+            return StreamingResponse(_stream_reply(reply, delay, state), media_type="text/event-stream")
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state["in_flight"] -= 1
+        return {"choices": [{"message": {"content": reply}}]}
+
+    return fake, state
+
+
+async def _stream_reply(reply: str, delay: float, state: dict):
+    """以 OpenRouter 的 SSE 格式逐字回應，總耗時約為 delay"""
+    words = reply.split(" ")
+    try:
+        yield ": OPENROUTER PROCESSING\n\n"
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay / len(words))
+            delta = word if i == 0 else " " + word
+            yield f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]})}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        state["in_flight"] -= 1
+
+
+@pytest.fixture
+def fake_upstream(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    fake, state = make_fake_upstream()
+    openrouter.set_transport(httpx.ASGITransport(app=fake))
+    yield state
+    openrouter.set_transport(None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache():
+    """每個測試使用全新的純記憶體快取，避免測試之間互相命中"""
+    memory_only = cache.TieredCache(path=None)
+    cache.set_cache(memory_only)
+    yield memory_only
+    cache.set_cache(None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_answer_cache():
+    """每個測試使用全新的 /chat 語意快取"""
+    fresh = answer_cache.AnswerCache()
+    answer_cache.set_answer_cache(fresh)
+    yield fresh
+    answer_cache.set_answer_cache(None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_repo_meta():
+    """倉庫版本查詢不連線 GitHub；需要時測試自行換成指向假 GitHub 的查詢"""
+    offline = repo_meta.RepoMetaResolver(remote=False)
+    repo_meta.set_repo_meta(offline)
+    yield offline
+    repo_meta.set_repo_meta(None)
+
+
+@pytest.fixture(autouse=True)
+def job_db(tmp_path, monkeypatch):
+    """工作資料庫放在每個測試自己的暫存目錄"""
+    path = str(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(jobs, "JOB_DB_PATH", path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def ingest_index(tmp_path, monkeypatch):
+    """倉庫摘要索引放在暫存目錄，且測試中不連線 GitHub 下載 tarball"""
+    path = str(tmp_path / "ingest.sqlite3")
+    monkeypatch.setattr(ingest, "INGEST_DB_PATH", path)
+    monkeypatch.setattr(ingest, "INGEST_DOWNLOAD", False)
+    return path
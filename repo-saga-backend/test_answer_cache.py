@@ -0,0 +1,57 @@
+"""
+/chat 語意答案快取測試：近似重複的第一輪問題直接命中，依語言分開，容量有上限
+"""
+
+import asyncio
+
+import httpx
+
+from app import answer_cache
+from app.main import app
+
+
+def test_near_duplicate_question_hits():
+    cache = answer_cache.AnswerCache(threshold=0.8)
+    cache.add("English", "Which poem styles are available?", "Haiku, sonnet and free verse.", 1.5)
+
+    assert cache.lookup("English", "which poem styles are available") == "Haiku, sonnet and free verse."
+    assert cache.lookup("English", "Why did my repository URL fail?") is None
+    # 語言分開索引
+    assert cache.lookup("Traditional Chinese", "Which poem styles are available?") is None
+    assert answer_cache.SAVED_SECONDS.value(language="English") > 1.0
+
+
+def test_chinese_questions_match_without_segmentation():
+    cache = answer_cache.AnswerCache(threshold=0.8)
+    cache.add("Traditional Chinese", "倉庫分析是怎麼運作的？", "答案", 1.0)
+    assert cache.lookup("Traditional Chinese", "倉庫分析是怎麼運作的") == "答案"
+    assert cache.lookup("Traditional Chinese", "有哪些詩歌風格？") is None
+
+
+def test_size_cap_evicts_least_recently_used():
+    cache = answer_cache.AnswerCache(threshold=0.9, maxsize=2)
+    cache.add("English", "how does analysis work", "a", 1.0)
+    cache.add("English", "which poem styles exist", "b", 1.0)
+    assert cache.lookup("English", "how does analysis work") == "a"
+    cache.add("English", "why did the url fail", "c", 1.0)
+    assert cache.lookup("English", "which poem styles exist") is None
+    assert cache.lookup("English", "how does analysis work") == "a"
+
+
+def test_chat_first_turn_served_from_cache(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = (await client.post("/chat", json={"message": "How does the analysis work?", "lang": "en"})).json()
+            calls = fake_upstream["calls"]
+            again = (await client.post("/chat", json={"message": "how does the analysis work", "lang": "en"})).json()
+            # 後續輪次依賴對話上下文，不使用快取
+            follow = (await client.post("/chat", json={
+                "message": "How does the analysis work?", "session_id": again["session_id"], "lang": "en",
+            })).json()
+            return first, again, follow, calls
+
+    first, again, follow, calls = asyncio.run(run())
+    assert again["response"] == first["response"]
+    assert again["session_id"] != first["session_id"]
+    assert fake_upstream["calls"] == calls + 1
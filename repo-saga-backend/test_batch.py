@@ -0,0 +1,65 @@
+"""
+批次生成測試：重複項目去除、同倉庫共用洞察報告、中斷後續跑、NDJSON 端點
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from app import batch, openrouter
+from app.main import app
+from app.services import build_presets
+
+EN = build_presets(lang="en")
+
+
+def test_dedupe_and_shared_insight(fake_upstream, tmp_path):
+    items = [
+        batch.BatchItem("https://github.com/psf/requests", EN),
+        batch.BatchItem("https://github.com/PSF/requests.git", EN),
+        batch.BatchItem("https://github.com/psf/requests", build_presets(poem_style="haiku", lang="en")),
+    ]
+    out = str(tmp_path / "sagas.jsonl")
+    summary = asyncio.run(batch.run_to_file(items, out, concurrency=2))
+
+    assert summary["total"] == 3 and summary["duplicates"] == 1 and summary["ok"] == 2
+    records = [json.loads(line) for line in open(out, encoding="utf-8")]
+    assert [r["status"] for r in records] == ["ok", "ok"]
+    # 兩種 presets 共用同一份洞察報告與小說：1 次 insight + 2 次 poem + 1 次 novel
+    assert fake_upstream["calls"] == 4
+
+
+def test_resume_skips_completed_and_truncated_line(fake_upstream, tmp_path):
+    out = tmp_path / "sagas.jsonl"
+    done = batch.BatchItem("https://github.com/psf/requests", EN)
+    out.write_text(
+        json.dumps({"key": done.key, "status": "ok"}) + "\n" + '{"key": "half-writ',
+        encoding="utf-8",
+    )
+    items = batch.parse_items(["https://github.com/psf/requests", "https://github.com/pallets/flask"], {"lang": "en"})
+    summary = asyncio.run(batch.run_to_file(items, str(out), concurrency=2))
+
+    assert summary["skipped"] == 1 and summary["ok"] == 1
+    assert batch.load_completed(str(out)) == {done.key, items[1].key}
+
+
+def test_batch_endpoint_streams_ndjson(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/generate/batch", json={
+                "urls": ["https://github.com/psf/requests", "https://github.com/pallets/flask"],
+                "items": [{"url": "https://github.com/psf/requests", "poem_style": "haiku"}],
+                "lang": "en",
+                "concurrency": 2,
+            })
+        await openrouter.aclose_client()
+        return resp
+
+    resp = asyncio.run(run())
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(lines) == 4
+    assert {r["repo"] for r in lines[:3]} == {"psf/requests", "pallets/flask"}
+    assert lines[-1]["summary"]["ok"] == 3 and lines[-1]["summary"]["per_minute"] > 0
@@ -0,0 +1,68 @@
+"""
+壓測工具測試：百分位數、假上游的延遲分佈與錯誤注入、event loop 延遲監測
+"""
+
+import asyncio
+import random
+import time
+
+import httpx
+
+from app import monitoring, openrouter
+from app.resilience import ResiliencePolicy
+from bench import fake_openrouter, loadtest
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def test_percentile_interpolates():
+    values = [float(v) for v in range(1, 101)]
+    assert loadtest.percentile(values, 50) == 50.5
+    assert loadtest.percentile(values, 99) == 99.01
+    assert loadtest.percentile([], 50) is None
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    assert fake_openrouter.parse_distribution("fixed:0.3")(rng) == 0.3
+    assert all(0.1 <= fake_openrouter.parse_distribution("uniform:0.1,0.2")(rng) <= 0.2 for _ in range(100))
+    samples = sorted(fake_openrouter.parse_distribution("lognormal:0.5,0.3")(rng) for _ in range(2001))
+    assert 0.45 < samples[1000] < 0.55
+
+
+def test_fake_upstream_streams_and_injects_errors(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    config = fake_openrouter.FakeConfig(latency="fixed:0.01", tps=2000, output_tokens=40, error_rate=0.5, seed=3)
+    openrouter.set_transport(httpx.ASGITransport(app=fake_openrouter.create_app(config)))
+    policy = ResiliencePolicy(max_attempts=1, fallback_models=())
+
+    async def run():
+        results = await asyncio.gather(
+            *[openrouter.openrouter_chat_async(MESSAGES, policy=policy) for _ in range(20)], return_exceptions=True,
+        )
+        streamed = [delta async for delta in openrouter.openrouter_stream(MESSAGES)]
+        await openrouter.aclose_client()
+        return results, streamed
+
+    try:
+        results, streamed = asyncio.run(run())
+    finally:
+        openrouter.set_transport(None)
+    failures = sum(isinstance(r, Exception) for r in results)
+    assert 0 < failures < 20
+    assert config.stats["errors"] >= failures
+    assert len("".join(streamed).split()) == 40
+
+
+def test_loop_lag_monitor_sees_blocking_call():
+    async def run():
+        before = monitoring.LOOP_LAG.count()
+        task = asyncio.create_task(monitoring.monitor_event_loop(0.01))
+        await asyncio.sleep(0.03)
+        time.sleep(0.1)  # 故意阻塞 event loop
+        await asyncio.sleep(0.03)
+        task.cancel()
+        return monitoring.LOOP_LAG.count() - before
+
+    assert asyncio.run(run()) >= 2
+    assert monitoring.LOOP_LAG_MAX.value() >= 0.05
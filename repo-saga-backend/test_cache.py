@@ -0,0 +1,73 @@
+"""
+分層快取測試：URL 正規化、LRU/TTL、SQLite 持久層，以及只改 poem_style 時重用洞察報告
+"""
+
+import asyncio
+
+import pytest
+
+from app.cache import MemoryLRU, TieredCache
+from app.services import canonical_repo, extract_repo_info_from_url, generate_saga_from_repo
+from app import openrouter
+
+
+@pytest.mark.parametrize("url", [
+    "https://github.com/tiangolo/fastapi",
+    "https://github.com/Tiangolo/FastAPI.git",
+    "https://github.com/tiangolo/fastapi/tree/master/docs",
+    "https://github.com/tiangolo/fastapi?tab=readme-ov-file#install",
+    "git@github.com:tiangolo/fastapi.git",
+    "  http://www.github.com/tiangolo/fastapi/  ",
+])
+def test_canonical_repo(url):
+    assert canonical_repo(url) == "tiangolo/fastapi"
+
+
+def test_extract_keeps_dot_git_inside_name():
+    assert extract_repo_info_from_url("https://github.com/me/my.github.io") == ("me", "my.github.io")
+
+
+def test_memory_lru_evicts_and_expires():
+    lru = MemoryLRU(maxsize=2)
+    lru.set("a", "1", expires_at=float("inf"))
+    lru.set("b", "2", expires_at=float("inf"))
+    lru.get("a")
+    lru.set("c", "3", expires_at=float("inf"))
+    assert lru.get("b") is None
+    assert lru.get("a") == "1"
+    lru.set("old", "x", expires_at=0)
+    assert lru.get("old") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    async def run():
+        await TieredCache(path=path).set("k", "v")
+        fresh = TieredCache(path=path)
+        assert await fresh.get("k") == "v"
+        assert fresh.stats["disk_hits"] == 1
+        assert await fresh.get("k") == "v"
+        assert fresh.stats["memory_hits"] == 1
+        await fresh.set("short", "v", ttl=-1)
+        assert await TieredCache(path=path).get("short") is None
+
+    asyncio.run(run())
+
+
+def test_changing_poem_style_reuses_insight(fake_upstream):
+    async def run():
+        base = {"language": "English", "poem_style": "haiku"}
+        first = await generate_saga_from_repo("https://github.com/psf/requests", base)
+        calls_after_first = fake_upstream["calls"]
+        second = await generate_saga_from_repo(
+            "https://github.com/PSF/requests.git", dict(base, poem_style="sonnet")
+        )
+        await openrouter.aclose_client()
+        return first, second, calls_after_first
+
+    first, second, calls_after_first = asyncio.run(run())
+    assert calls_after_first == 3
+    # 只重新生成詩歌：洞察報告與小說直接命中快取
+    assert fake_upstream["calls"] == 4
+    assert first[0] == second[0] and first[2] == second[2]
@@ -0,0 +1,66 @@
+"""
+上游錄製 / 重播測試：錄下的生成流程可在沒有網路與 API key 時重現，串流保留 chunk 時間
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app import cache, cassette, openrouter
+from app.services import generate_saga_from_repo
+
+
+@pytest.fixture
+def tape(tmp_path):
+    path = str(tmp_path / "upstream.jsonl")
+    yield path
+    cassette.set_cassette(None)
+
+
+def test_record_then_replay_offline(fake_upstream, tape, monkeypatch):
+    presets = {"language": "English"}
+    cassette.set_cassette(cassette.Cassette(tape, cassette.RECORD))
+    recorded = asyncio.run(generate_saga_from_repo("https://github.com/psf/requests", presets))
+    calls = fake_upstream["calls"]
+
+    # 重播：沒有 API key、沒有上游，快取也清空
+    monkeypatch.delenv("OPENROUTER_API_KEY")
+    openrouter.set_transport(None)
+    cassette.set_cassette(cassette.Cassette(tape, cassette.REPLAY))
+    cache.set_cache(cache.TieredCache(path=None))
+    replayed = asyncio.run(generate_saga_from_repo("https://github.com/psf/requests", presets))
+
+    assert replayed == recorded
+    assert fake_upstream["calls"] == calls
+
+
+def test_stream_replay_keeps_chunk_timing(fake_upstream, tape):
+    messages = [{"role": "user", "content": "tell  me a\nstory"}]
+
+    async def record():
+        return [delta async for delta in openrouter.openrouter_stream(messages)]
+
+    cassette.set_cassette(cassette.Cassette(tape, cassette.RECORD))
+    deltas = asyncio.run(record())
+
+    replay = cassette.Cassette(tape, cassette.REPLAY, time_scale=1.0)
+    cassette.set_cassette(replay)
+    # 空白不同的同一段提示詞也會命中
+    normalized = [{"role": "user", "content": "tell me a story"}]
+
+    async def play():
+        started = time.perf_counter()
+        out = [delta async for delta in openrouter.openrouter_stream(normalized)]
+        return out, time.perf_counter() - started
+
+    replayed, elapsed = asyncio.run(play())
+    assert replayed == deltas and len(deltas) > 1
+    recorded_ms = replay.lookup(cassette.cassette_key(openrouter.DEFAULT_MODEL, messages, 0.7))[-1][0]
+    assert elapsed >= recorded_ms / 1000 * 0.9
+
+
+def test_replay_miss_raises(tape):
+    cassette.set_cassette(cassette.Cassette(tape, cassette.REPLAY))
+    with pytest.raises(cassette.CassetteMiss):
+        asyncio.run(openrouter.openrouter_chat_async([{"role": "user", "content": "never recorded"}]))
@@ -0,0 +1,59 @@
+"""
+階段檢查點測試：部分失敗時回傳成功的段落與各段狀態，重試只重跑失敗的階段
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app import openrouter, services
+from app.main import app
+
+
+@pytest.fixture
+def flaky_novel(monkeypatch):
+    """小說階段在 state["fail"] 為 True 時回應 400，其餘階段正常"""
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    state = {"fail": True, "calls": []}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        section = "novel" if "novelist" in body["messages"][0]["content"] else "other"
+        state["calls"].append(section)
+        if section == "novel" and state["fail"]:
+            return httpx.Response(400, json={"error": {"message": "bad request"}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"{section} text"}}]})
+
+    openrouter.set_transport(httpx.MockTransport(handler))
+    yield state
+    openrouter.set_transport(None)
+
+
+def test_partial_result_then_resume(flaky_novel):
+    payload = {"url": "https://github.com/psf/requests", "lang": "en"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = (await client.post("/generate", json=payload)).json()
+            calls = len(flaky_novel["calls"])
+            flaky_novel["fail"] = False
+            second = (await client.post("/generate", json=payload)).json()
+            return first, second, flaky_novel["calls"][calls:]
+
+    resumed = services.CHECKPOINT_RESUMED.value(stage="poem")
+    first, second, retry_calls = asyncio.run(run())
+
+    assert first["sections"]["insight"]["status"] == "ok"
+    assert first["sections"]["poem"]["status"] == "ok"
+    assert first["sections"]["novel"]["status"] == "error"
+    assert first["poem"] == "other text"
+    assert first["novel"].startswith("In a corner of the digital world")
+
+    # 重試只呼叫失敗的小說階段
+    assert retry_calls == ["novel"]
+    assert services.CHECKPOINT_RESUMED.value(stage="poem") == resumed + 1
+    assert all(status["status"] == "ok" for status in second["sections"].values())
+    assert second["poem"] == first["poem"] and second["novel"] == "novel text"
@@ -0,0 +1,95 @@
+"""
+提示詞 token 預算測試：聊天歷史由新到舊保留並摘要舊對話、洞察報告挑選高價值段落、
+生成流程的提示詞不超過預算
+"""
+
+import asyncio
+
+from app import context
+from app.limits import estimate_messages_tokens, estimate_tokens
+from app.services import _insight_messages, generate_saga_from_repo
+
+REPORT = "\n\n".join([
+    "## Overview\n" + "A fast web framework for building APIs. " * 10,
+    "## Installation\n" + "pip install the package and its extras. " * 30,
+    "## Core Features\n" + "Type hints drive validation and docs. " * 10,
+    "## License\n" + "MIT licensed, see the LICENSE file for details. " * 30,
+    "## Design Philosophy\n" + "Standards first, developer experience second to none. " * 10,
+])
+
+
+def test_chat_keeps_newest_turns_and_summarizes_the_rest():
+    history = []
+    for i in range(30):
+        history.append({"role": "user", "content": f"Question {i}. " + "Some details here. " * 20})
+        history.append({"role": "assistant", "content": f"Answer {i}. " + "More explanation. " * 20})
+    history.append({"role": "tool", "content": "ignored"})
+
+    messages, stats = context.pack_chat_history("You are helpful.", history, "Latest question?", budget=800)
+
+    assert estimate_messages_tokens(messages) <= 800
+    assert messages[0]["content"] == "You are helpful."
+    assert messages[1]["role"] == "system" and "Earlier conversation" in messages[1]["content"]
+    assert messages[-2]["content"].startswith("Answer 29.")
+    assert messages[-1] == {"role": "user", "content": "Latest question?"}
+    assert stats["dropped"] > 0 and stats["kept"] > 0
+    assert stats["after"] < stats["before"]
+
+
+def test_short_chat_history_is_untouched():
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    messages, stats = context.pack_chat_history("sys", history, "next")
+    assert [m["content"] for m in messages] == ["sys", "hi", "hello", "next"]
+    assert stats["dropped"] == 0
+
+
+def test_trim_insight_prefers_high_value_sections():
+    trimmed = context.trim_insight(REPORT, 350)
+    assert estimate_tokens(trimmed) <= 350
+    assert "## Overview" in trimmed and "## Core Features" in trimmed and "## Design Philosophy" in trimmed
+    assert "## License" not in trimmed and "## Installation" not in trimmed
+    # 依原順序輸出
+    assert trimmed.index("Overview") < trimmed.index("Core Features") < trimmed.index("Design Philosophy")
+    assert context.trim_insight("short report", 350) == "short report"
+
+
+def test_truncate_to_tokens():
+    text = "word " * 1000
+    assert estimate_tokens(context.truncate_to_tokens(text, 100)) <= 100
+    assert context.truncate_to_tokens("tiny", 100) == "tiny"
+
+
+def test_downstream_prompts_fit_their_budget(monkeypatch):
+    monkeypatch.setitem(context.PROMPT_BUDGETS, "poem", 325)
+    monkeypatch.setitem(context.PROMPT_BUDGETS, "novel", 325)
+    # REPORT 以重複句子湊長度，會被輸出防護當成迴圈截斷
+    monkeypatch.setattr("app.services.GUARDS_ENABLED", False)
+
+    prompts = []
+
+    async def fake_chat(messages, **kwargs):
+        prompts.append(messages)
+        return REPORT if len(prompts) == 1 else "ok"
+
+    monkeypatch.setattr("app.services.openrouter_chat_async", fake_chat)
+
+    async def run():
+        await generate_saga_from_repo("https://github.com/a/b", {"language": "English"})
+
+    asyncio.run(run())
+    assert len(prompts) == 3
+    for messages in prompts[1:]:
+        assert estimate_messages_tokens(messages) <= 325
+        assert "Core Features" in messages[-1]["content"]
+
+
+def test_insight_digest_prompt_fits_budget(monkeypatch):
+    monkeypatch.setitem(context.PROMPT_BUDGETS, "insight", 300)
+    digest = "Repository layout and key modules. " * 400
+    messages = context.fit_prompt(
+        "insight", lambda text: _insight_messages("a", "b", True, text if digest else None), digest,
+        trim=context.truncate_to_tokens,
+    )
+    # 開銷以摘要模板量測（不是較短的推斷模板），縮減後不超過預算
+    assert "analysis of the repository" in messages[-1]["content"]
+    assert estimate_messages_tokens(messages) <= 300
@@ -0,0 +1,243 @@
+"""
+串流輸出防護測試：重複迴圈、長度上限與語言漂移的判斷，以及觸發時提早關閉上游串流並乾淨截斷
+"""
+
+import json
+import random
+import asyncio
+
+import httpx
+
+from app import guards, openrouter
+from app.limits import estimate_tokens
+from app.main import app
+from app.routing import resolve_route
+from app.services import build_presets, generate_saga_sections
+from test_streaming import parse_sse
+
+LOOP = "The tests are green and the build is bright,\nwe ship the code again tonight.\n"
+PROSE = (
+    "Requests was written to make HTTP feel human. Sessions keep cookies and pooled connections, "
+    "adapters let callers mount custom transports, and hooks expose every response before it returns. "
+)
+
+
+def natural_english(count):
+    """不重複的自然英文（每隔幾個詞附上編號，避免 n-gram 重複）"""
+    words = PROSE.split() * (count // len(PROSE.split()) + 1)
+    return " ".join(f"{word}{i}" if i % 3 else word for i, word in enumerate(words[:count])) + "."
+
+
+def feed_all(guard, text, size=7):
+    """以固定大小的 delta 餵入，回傳觸發的 GuardTripped（沒有觸發時為 None）"""
+    for i in range(0, len(text), size):
+        try:
+            guard.feed(text[i:i + size])
+        except guards.GuardTripped as trip:
+            return trip
+    return None
+
+
+def test_repetition_loop_trips_with_clean_cut():
+    text = "A poem about requests.\n\n" + LOOP * 40
+    guard = guards.OutputGuard("poem", "English")
+    trip = feed_all(guard, text)
+    assert trip is not None and trip.reason == guards.REPETITION
+    assert len(guard.text) < len(text) // 2
+    kept = guards.clean_cut(guard.text, trip.cut)
+    # 保留迴圈開始前的內容，並在換行 / 句子邊界結束
+    assert kept.startswith("A poem about requests.") and kept.count(LOOP.strip()) <= 1
+    assert kept[-1] in ".,\n" or kept.endswith("requests.")
+
+
+def test_natural_text_only_hits_length_limit(monkeypatch):
+    # 不重複的自然英文：不觸發重複或語言判斷
+    text = natural_english(600)
+    assert feed_all(guards.OutputGuard("insight", "English"), text[:3000]) is None
+
+    monkeypatch.setitem(guards.GUARD_LIMITS, "insight", (1000, 0))
+    guard = guards.OutputGuard("insight", "English")
+    trip = feed_all(guard, text)
+    assert trip.reason == guards.LENGTH and trip.cut == 1000
+    assert len(guards.clean_cut(guard.text, trip.cut)) <= 1000
+
+
+def test_token_ceiling_cuts_where_estimate_crosses_limit(monkeypatch):
+    monkeypatch.setitem(guards.GUARD_LIMITS, "novel", (0, 400))
+    text = "".join(chr(0x4E00 + i * 37 % 20000) for i in range(600))
+    # 非串流：整段一次餵入，仍在估算 token 超過上限處截斷，而不是從頭截成空字串
+    guard = guards.OutputGuard("novel")
+    try:
+        guard.feed(text)
+    except guards.GuardTripped as trip:
+        assert trip.reason == guards.LENGTH
+        assert estimate_tokens(text[:trip.cut]) <= 400 < estimate_tokens(text[:trip.cut + 1])
+    else:
+        raise AssertionError("token ceiling not enforced")
+
+    streamed = guards.OutputGuard("novel")
+    trip = feed_all(streamed, text, size=4)
+    assert streamed.tokens == estimate_tokens(streamed.text)
+    assert estimate_tokens(text[:trip.cut]) <= 400 < estimate_tokens(text[:trip.cut + 1])
+
+
+def test_default_token_ceiling_sits_below_route_cap():
+    route = resolve_route("poem")
+    guard = guards.OutputGuard("poem", "English", route.max_tokens)
+    # 預設上限來自路由：在上游的 max_tokens 截斷之前觸發，剩餘的部分計為省下的 token
+    assert 0 < guard.max_tokens < route.max_tokens
+    text = natural_english(route.max_tokens * 2)
+    trip = feed_all(guard, text)
+    assert trip is not None and trip.reason == guards.LENGTH
+    assert estimate_tokens(text[:trip.cut]) <= guard.max_tokens < route.max_tokens
+
+
+def test_language_drift():
+    drifted = "這是一份關於專案的報告。" * 3 + natural_english(400)
+    guard = guards.OutputGuard("novel", "Traditional Chinese")
+    trip = feed_all(guard, drifted)
+    assert trip is not None and trip.reason == guards.LANGUAGE
+
+    # 中文內容夾雜英文專有名詞不算漂移
+    rng = random.Random(0)
+    terms = ["Requests", "Session", "HTTPAdapter", "urllib3", "cookies"]
+    mixed = "".join(
+        "".join(rng.choice("工程師打開連線池修好錯誤夜裡測試通過程式碼發光專案維護者社群") for _ in range(12)) + f" {rng.choice(terms)} "
+        for _ in range(60)
+    )
+    assert feed_all(guards.OutputGuard("novel", "Traditional Chinese"), mixed) is None
+    # 沒有指定語言時不檢查
+    assert feed_all(guards.OutputGuard("novel"), drifted) is None
+
+
+def code_lines(count, seed=0):
+    """不重複的 Python 程式碼行（識別字隨機組合，避免被當成重複迴圈）"""
+    rng = random.Random(seed)
+    words = ["session", "adapter", "retry", "pool", "cookie", "header", "proxy", "stream", "auth", "hook", "timeout", "cert"]
+    return "\n".join(
+        f"{rng.choice(words)}_{rng.choice(words)} = {rng.choice(words)}.{rng.choice(words)}({rng.choice(words)}={i})"
+        for i in range(count)
+    )
+
+
+def test_code_is_not_language_drift():
+    code = "```python\n" + code_lines(80) + "\n```\n"
+    rng = random.Random(1)
+    words = ["get", "post", "mount", "close", "send", "prepare", "merge", "resolve"]
+    filler = "工程師打開連線池修好錯誤夜裡測試通過程式碼發光專案維護者社群"
+    inline = "".join(
+        "".join(rng.choice(filler) for _ in range(8)) + f" `session.{rng.choice(words)}(url_{i}, {rng.choice(words)}_hook)` "
+        for i in range(40)
+    )
+    prose = "這個專案讓 HTTP 請求變得像人類語言一樣自然，維護者們在夜裡修好了連線池。"
+    # 程式碼區塊與行內程式碼不計入語言比例
+    assert feed_all(guards.OutputGuard("novel", "Traditional Chinese"), prose + code + prose + inline + prose) is None
+    # 程式碼之外的英文仍會觸發
+    trip = feed_all(guards.OutputGuard("novel", "Traditional Chinese"), prose + code + natural_english(300))
+    assert trip is not None and trip.reason == guards.LANGUAGE
+
+
+def test_zh_insight_with_code_block_is_not_drift():
+    deps = ["fastapi", "httpx", "pydantic", "uvicorn", "starlette", "anyio", "idna", "certifi", "sniffio", "h11"]
+    report = (
+        "## 專案概覽\n這是一個 Python HTTP 函式庫，提供連線池、重試與串流下載。\n\n## 依賴與模組\n"
+        + "".join(f"- {dep} (src/{dep}/core_{i}.py): used by the {dep} integration layer {i}\n" for i, dep in enumerate(deps * 3))
+        + "\n```python\n" + code_lines(40, seed=2) + "\n```\n"
+    )
+    assert feed_all(guards.OutputGuard("insight", "Traditional Chinese"), report) is None
+
+
+def looping_upstream(state, poem=LOOP, chunks=400):
+    """poem 階段陷入無窮迴圈的上游；記錄每次串流實際送出的 chunk 數"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        system = body["messages"][0]["content"]
+        is_poem = "poet" in system or "诗歌" in system
+        reply = state["replies"].pop(0) if is_poem and state["replies"] else None
+
+        async def sse():
+            index = state.setdefault("streams", 0)
+            state["streams"] += 1
+            state.setdefault("sent", []).append(0)
+            for i in range(chunks if is_poem else 3):
+                text = (reply or poem) if is_poem else f"section line {i}. "
+                state["sent"][index] += 1
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n".encode()
+                await asyncio.sleep(0)
+                if reply is not None:
+                    break
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=sse())
+
+    return handler
+
+
+def run_stream(handler, payload):
+    async def run():
+        openrouter.set_transport(httpx.MockTransport(handler))
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                resp = await client.post("/generate/stream", json=payload)
+        finally:
+            await openrouter.aclose_client()
+            openrouter.set_transport(None)
+        return parse_sse(resp.text)
+
+    return asyncio.run(run())
+
+
+def test_stream_stops_runaway_poem_early(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    state = {"replies": []}
+    trips = guards.GUARD_TRIPS.value(stage="poem", reason="repetition", action="truncated")
+    saved = guards.GUARD_TOKENS_SAVED.value(stage="poem")
+
+    events = run_stream(looping_upstream(state), {"url": "https://github.com/psf/requests", "lang": "en"})
+
+    truncated = [data for name, data in events if name == "stage_truncated"]
+    assert [data["section"] for data in truncated] == ["poem"]
+    poem = truncated[0]["text"]
+    assert poem.startswith(LOOP.strip()) and len(poem) < len(LOOP) * 3
+    assert events[-1][0] == "summary" and events[-1][1]["sections"]["poem"] == len(poem)
+    # 上游串流在迴圈被偵測到後即關閉，而不是送完 400 個 chunk
+    assert max(state["sent"]) < 100
+    assert guards.GUARD_TRIPS.value(stage="poem", reason="repetition", action="truncated") == trips + 1
+    assert guards.GUARD_TOKENS_SAVED.value(stage="poem") > saved
+
+
+def test_language_drift_retries_once(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    state = {"replies": [natural_english(160), "程式碼在夜裡發光，\n測試一一通過。\n"]}
+
+    events = run_stream(looping_upstream(state), {"url": "https://github.com/psf/requests", "lang": "zh"})
+
+    retries = [data for name, data in events if name == "stage_retry"]
+    assert retries == [{"section": "poem", "reason": "language"}]
+    assert not [name for name, _ in events if name == "stage_truncated"]
+    assert guards.GUARD_TRIPS.value(stage="poem", reason="language", action="retried") >= 1
+
+
+def test_empty_truncation_fails_stage_and_is_not_cached(monkeypatch):
+    calls = []
+
+    async def fake_chat(messages, **kwargs):
+        system = messages[0]["content"]
+        stage = "poem" if "诗歌" in system else "novel" if "小说" in system else "insight"
+        calls.append(stage)
+        # poem 從第一個字就不是要求的語言：截斷後沒有內容
+        return natural_english(160) if stage == "poem" else f"{stage}：程式碼在夜裡發光。"
+
+    monkeypatch.setattr("app.services.openrouter_chat_async", fake_chat)
+
+    async def run():
+        return await generate_saga_sections("https://github.com/psf/requests", build_presets(lang="zh"))
+
+    results, errors = asyncio.run(run())
+    assert "poem" in errors and "poem" not in results and results["novel"]
+    assert calls.count("poem") == 1 + guards.GUARD_RETRIES
+
+    asyncio.run(run())
+    # 失敗的階段沒有寫入空字串，下次照常重新生成
+    assert calls.count("poem") == 2 * (1 + guards.GUARD_RETRIES)
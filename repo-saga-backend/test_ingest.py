@@ -0,0 +1,153 @@
+"""
+倉庫分析測試：語言統計、相依清單、入口點、README 摘要、大小與二進位限制、
+以 commit SHA 索引，以及 tarball 來源與洞察提示詞注入
+"""
+
+import asyncio
+import io
+import json
+import os
+import tarfile
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response
+
+from app import ingest, openrouter
+from app.services import generate_saga_from_repo
+
+SHA = "0123456789abcdef0123456789abcdef01234567"
+
+
+def make_repo(root):
+    root = str(root)
+    files = {
+        "README.md": "[![ci](badge.svg)](x)\n# Demo\n\nA tiny demo service.\n",
+        "pyproject.toml": '[project]\nname = "demo"\ndependencies = ["fastapi>=0.100", "httpx[http2]"]\n'
+                          '[project.scripts]\ndemo = "demo.cli:main"\n',
+        "package.json": json.dumps({"main": "web/index.js", "dependencies": {"vue": "^3"}}),
+        "demo/main.py": "import os\n" * 40,
+        "demo/util.py": "x = 1\n",
+        "web/index.js": "console.log(1)\n" * 5,
+        "node_modules/vue/index.js": "ignored\n",
+    }
+    for rel, content in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+    with open(os.path.join(root, "logo.png"), "wb") as f:
+        f.write(b"\x89PNG\0\0data")
+    with open(os.path.join(root, "huge.py"), "w") as f:
+        f.write("#" * (ingest.MAX_FILE_BYTES + 1))
+    os.makedirs(os.path.join(root, ".git", "refs", "heads"))
+    with open(os.path.join(root, ".git", "HEAD"), "w") as f:
+        f.write("ref: refs/heads/main\n")
+    with open(os.path.join(root, ".git", "refs", "heads", "main"), "w") as f:
+        f.write(SHA + "\n")
+
+
+def test_digest_of_local_tree(tmp_path):
+    repo = tmp_path / "repo"
+    make_repo(repo)
+    digest = ingest.ingest_path(str(repo), "me/demo")
+
+    assert digest["revision"] == SHA
+    assert digest["languages"][0]["language"] == "Python"
+    assert digest["skipped"]["binary"] == 1
+    assert digest["skipped"]["too_large"] == 1
+    assert digest["skipped"]["excluded"] >= 1
+    manifests = {m["path"]: m for m in digest["manifests"]}
+    assert manifests["pyproject.toml"]["dependencies"] == ["fastapi", "httpx"]
+    assert manifests["package.json"]["dependencies"] == ["vue"]
+    assert {"demo/main.py", "web/index.js", "demo = demo.cli:main"} <= set(digest["entry_points"])
+    assert digest["readme"].startswith("# Demo")
+    assert digest["largest_modules"][0] == {"path": "demo/main.py", "lines": 40}
+
+    text = ingest.format_digest(digest)
+    assert "Python" in text and "README excerpt" in text
+
+
+def test_unchanged_revision_is_not_rescanned(tmp_path, monkeypatch):
+    repo = tmp_path / "repo"
+    make_repo(repo)
+    first = ingest.ingest_path(str(repo), "me/demo")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("should be served from the index")
+
+    monkeypatch.setattr(ingest, "build_digest", fail)
+    assert ingest.ingest_path(str(repo), "me/demo") == first
+
+
+def test_fork_at_same_revision_gets_its_own_digest(tmp_path):
+    repo = tmp_path / "repo"
+    make_repo(repo)
+    upstream = ingest.ingest_path(str(repo), "me/demo")
+    fork = ingest.ingest_path(str(repo), "someone/demo-fork")
+
+    # 相同 SHA 但不同倉庫：各自一筆，摘要中的倉庫名稱正確，也不會互相覆寫
+    assert fork["revision"] == upstream["revision"] == SHA
+    assert "someone/demo-fork" in ingest.format_digest(fork)
+    assert ingest.ingest_path(str(repo), "Me/Demo")["repo"] == upstream["repo"]
+
+
+def test_process_pool_matches_inline_scan(tmp_path, monkeypatch):
+    repo = tmp_path / "repo"
+    make_repo(repo)
+    files, _ = ingest._list_tree(str(repo))
+    rels = [rel for rel, _, _ in files]
+    inline = ingest._scan_tree(str(repo), rels)
+    monkeypatch.setattr(ingest, "POOL_MIN_FILES", 1)
+    monkeypatch.setattr(ingest, "POOL_WORKERS", 2)
+    assert sorted(ingest._scan_tree(str(repo), rels)) == sorted(inline)
+
+
+def test_tarball_source_feeds_insight_prompt(tmp_path, monkeypatch, fake_upstream):
+    src = tmp_path / "src"
+    make_repo(str(src))
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        tar.add(str(src), arcname="me-demo-0123456")
+    github = FastAPI()
+    downloads = []
+
+    @github.get("/repos/{owner}/{repo}/commits/HEAD")
+    async def head(owner: str, repo: str):
+        return PlainTextResponse(SHA)
+
+    @github.get("/{owner}/{repo}/tar.gz/{sha}")
+    async def tarball(owner: str, repo: str, sha: str):
+        downloads.append(sha)
+        return Response(buf.getvalue(), media_type="application/gzip")
+
+    monkeypatch.setattr(ingest, "INGEST_DOWNLOAD", True)
+    monkeypatch.setattr(ingest, "GITHUB_API_BASE", "http://github.test")
+    monkeypatch.setattr(ingest, "GITHUB_CODELOAD_BASE", "http://github.test")
+    ingest.set_transport(httpx.ASGITransport(app=github))
+
+    async def run():
+        await generate_saga_from_repo("https://github.com/me/demo", {"language": "English"})
+        digest = await ingest.get_repo_digest("me", "demo")
+        await openrouter.aclose_client()
+        return digest
+
+    try:
+        digest = asyncio.run(run())
+    finally:
+        ingest.set_transport(None)
+
+    assert digest["revision"] == SHA
+    # 第二次只查詢 HEAD，命中索引不再下載
+    assert downloads == [SHA]
+    insight_prompt = fake_upstream["prompts"][0]
+    assert "demo/main.py" in insight_prompt and "reasonable inferences" not in insight_prompt
+
+
+def test_ingestion_failure_falls_back_to_inference(fake_upstream):
+    async def run():
+        await generate_saga_from_repo("https://github.com/me/missing", {"language": "English"})
+        await openrouter.aclose_client()
+
+    asyncio.run(run())
+    assert "reasonable inferences" in fake_upstream["prompts"][0]
@@ -0,0 +1,116 @@
+"""
+非同步工作 API 測試：提交、查詢、取得結果、取消，以及重啟後不重算已完成的階段
+"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import jobs
+from app.main import app
+
+
+def wait_for(client, job_id, status, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] == status:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} never reached {status}: {job}")
+
+
+def test_submit_poll_and_fetch(job_db, fake_upstream):
+    with TestClient(app) as client:
+        resp = client.post("/jobs", json={"url": "https://github.com/psf/requests", "lang": "en"})
+        assert resp.status_code == 202
+        job_id = resp.json()["job_id"]
+
+        assert client.get(f"/jobs/{job_id}/result").status_code == 409
+        job = wait_for(client, job_id, "done")
+        assert set(job["stages"]) == {"insight", "poem", "novel"}
+        assert all(stage["status"] == "done" and "output" not in stage for stage in job["stages"].values())
+
+        result = client.get(f"/jobs/{job_id}/result").json()
+        assert result["poem"].startswith("fake reply to:")
+        assert client.get("/jobs/missing").status_code == 404
+
+
+def test_cancel_stops_upstream_calls(job_db, fake_upstream):
+    with TestClient(app) as client:
+        job_id = client.post("/jobs", json={"url": "https://github.com/vuejs/vue"}).json()["job_id"]
+        wait_for(client, job_id, "running")
+        time.sleep(0.05)
+        assert client.delete(f"/jobs/{job_id}").json()["status"] == "cancelled"
+        time.sleep(0.5)
+        # 洞察報告呼叫被中止，後續階段從未開始
+        assert fake_upstream["calls"] == 1
+        assert fake_upstream["in_flight"] == 0
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "cancelled"
+
+
+def test_restart_resumes_without_recomputing_finished_stages(job_db, fake_upstream):
+    store = jobs.JobStore(job_db)
+    job = store.create({"url": "https://github.com/expressjs/express", "presets": {"language": "English"}})
+    store.claim(job["id"])
+    store.save_stages(job["id"], {"insight": {"status": "done", "chars": 9, "output": "stored insight"}})
+    # 模擬執行它的 worker 已經結束
+    store._connect().execute("UPDATE jobs SET owner = ? WHERE id = ?", (f"{jobs.socket.gethostname()}:999999999", job["id"]))
+
+    with TestClient(app) as client:
+        wait_for(client, job["id"], "done")
+        result = client.get(f"/jobs/{job['id']}/result").json()
+
+    assert result["insight_report"] == "stored insight"
+    assert fake_upstream["calls"] == 2
+    assert all("stored insight" in prompt for prompt in fake_upstream["prompts"])
+
+
+def test_submit_rejects_when_queue_full(job_db):
+    manager = jobs.JobManager(jobs.JobStore(job_db), workers=0, queue_size=1)
+
+    async def run():
+        await manager.submit("https://github.com/a/b", {})
+        with pytest.raises(jobs.JobQueueFull):
+            await manager.submit("https://github.com/a/c", {})
+
+    asyncio.run(run())
+
+
+def test_recovered_jobs_beyond_queue_size_are_fed_in(job_db, fake_upstream):
+    store = jobs.JobStore(job_db)
+    created = [store.create({"url": f"https://github.com/psf/repo{i}", "presets": {}})["id"] for i in range(3)]
+    manager = jobs.JobManager(store, workers=1, queue_size=1)
+
+    async def run():
+        await manager.start()
+        try:
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline and any(store.status(job_id) != "done" for job_id in created):
+                await asyncio.sleep(0.05)
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
+    assert [store.status(job_id) for job_id in created] == ["done"] * 3
+
+
+def test_unexpected_error_fails_job(job_db):
+    store = jobs.JobStore(job_db)
+    job = store.create({"url": "not a github url", "presets": {}})
+    manager = jobs.JobManager(store, workers=1)
+
+    async def run():
+        await manager.start()
+        try:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and store.status(job["id"]) in ("queued", "running"):
+                await asyncio.sleep(0.05)
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
+    failed = store.get(job["id"])
+    assert failed["status"] == "failed" and failed["error"]
@@ -0,0 +1,78 @@
+"""
+上游限制器測試：並發上限、Retry-After 退避、token bucket，以及 HTTP 層的准入控制
+"""
+
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app import limits, openrouter
+from app.main import app
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def test_max_in_flight_is_enforced(fake_upstream):
+    async def run():
+        limits.set_limiter(limits.UpstreamLimiter(max_in_flight=2))
+        await asyncio.gather(*[openrouter.openrouter_chat_async(MESSAGES) for _ in range(6)])
+        await openrouter.aclose_client()
+
+    asyncio.run(run())
+    assert fake_upstream["calls"] == 6
+    assert fake_upstream["peak"] == 2
+
+
+def test_429_honours_retry_after(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    upstream = FastAPI()
+    seen = []
+
+    @upstream.post("/{path:path}")
+    async def completions():
+        seen.append(time.perf_counter())
+        if len(seen) == 1:
+            return JSONResponse({"error": "rate limited"}, status_code=429, headers={"Retry-After": "0.3"})
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {"total_tokens": 12}}
+
+    openrouter.set_transport(httpx.ASGITransport(app=upstream))
+    throttled_before = limits.THROTTLED.value()
+
+    async def run():
+        limits.set_limiter(limits.UpstreamLimiter())
+        reply = await openrouter.openrouter_chat_async(MESSAGES)
+        await openrouter.aclose_client()
+        return reply
+
+    try:
+        assert asyncio.run(run()) == "ok"
+    finally:
+        openrouter.set_transport(None)
+    assert seen[1] - seen[0] >= 0.3
+    assert limits.THROTTLED.value() == throttled_before + 1
+
+
+def test_token_bucket_reserves_in_order():
+    bucket = limits.TokenBucket(per_minute=60, capacity=2)
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    # 每秒補 1：第三、四個呼叫分別約需等 1 秒、2 秒
+    assert 0.9 < bucket.reserve(1) <= 1.0
+    assert 1.9 < bucket.reserve(1) <= 2.0
+
+
+def test_admission_control_rejects_when_queue_is_deep(fake_upstream, monkeypatch):
+    monkeypatch.setattr(limits, "ADMISSION_MAX_QUEUE", 0)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/generate", json={"url": "https://github.com/a/b"})
+
+    resp = asyncio.run(run())
+    assert resp.status_code == 503
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert fake_upstream["calls"] == 0
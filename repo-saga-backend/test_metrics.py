@@ -0,0 +1,34 @@
+"""
+觀測性測試：/generate 的 Server-Timing 標頭，以及 /metrics 中的階段、上游、token 與快取指標
+"""
+
+import asyncio
+import re
+
+import httpx
+
+from app.main import app
+
+
+def test_server_timing_and_metrics(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            generated = await client.post("/generate", json={"url": "https://github.com/encode/httpx", "lang": "en"})
+            await client.post("/chat", json={"message": "hello", "lang": "en"})
+            metrics = await client.get("/metrics")
+            return generated, metrics
+
+    generated, metrics = asyncio.run(run())
+    timing = dict(re.findall(r"(\w+);dur=([\d.]+)", generated.headers["Server-Timing"]))
+    assert set(timing) == {"insight", "poem", "novel", "total"}
+    assert float(timing["total"]) >= float(timing["insight"]) + max(float(timing["poem"]), float(timing["novel"]))
+
+    text = metrics.text
+    for stage in ("insight", "poem", "novel"):
+        assert f'saga_stage_seconds_count{{stage="{stage}",outcome="ok"}}' in text
+        assert re.search(rf'saga_upstream_request_seconds_count\{{stage="{stage}",model="[^"]+",outcome="ok"}}', text)
+        assert re.search(rf'saga_upstream_tokens_total\{{stage="{stage}",model="[^"]+",kind="completion"}}', text)
+    assert re.search(r'saga_upstream_request_seconds_count\{stage="chat",', text)
+    assert 'saga_cache_lookups_total{namespace="insight",result="miss"}' in text
+    assert "saga_upstream_wait_seconds_count" in text
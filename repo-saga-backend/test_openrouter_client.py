@@ -0,0 +1,46 @@
+"""
+非同步 OpenRouter 客戶端測試
+以本機假上游驗證：並發的 /generate 與 /chat 請求會在同一個 worker 上重疊執行
+"""
+
+import asyncio
+import time
+
+import httpx
+
+from app import openrouter
+from app.main import app
+from conftest import UPSTREAM_DELAY
+
+
+def test_concurrent_generations_overlap(fake_upstream):
+    concurrency = 5
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/generate", json={"url": f"https://github.com/octo/repo{i}", "lang": "en"})
+                for i in range(concurrency)
+            ], client.post("/chat", json={"message": "hi", "lang": "en"}))
+            elapsed = time.perf_counter() - started
+        await openrouter.aclose_client()
+        return responses, elapsed
+
+    responses, elapsed = asyncio.run(run())
+
+    for resp in responses[:concurrency]:
+        assert resp.status_code == 200
+        assert resp.json()["poem"].startswith("fake reply")
+    assert responses[-1].json()["response"].startswith("fake reply")
+
+    # 每次生成包含 3 個上游呼叫；序列執行需要 concurrency * 3 * delay
+    assert fake_upstream["calls"] == concurrency * 3 + 1
+    assert fake_upstream["peak"] >= concurrency
+    assert elapsed < concurrency * 3 * UPSTREAM_DELAY / 2
+
+
+def test_sync_wrapper_for_scripts(fake_upstream):
+    reply = openrouter.openrouter_chat([{"role": "user", "content": "hello"}])
+    assert reply == "fake reply to: hello"
@@ -0,0 +1,87 @@
+"""
+階段圖執行器測試：獨立階段並發、失敗時取消兄弟階段、逾時
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.pipeline import Stage, StageError, StageSkipped, run_stages
+
+
+def sleeper(delay, output, log=None):
+    async def run(deps):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f"cancelled:{output}")
+            raise
+        return output + "".join(f"<{deps[k]}" for k in sorted(deps))
+    return run
+
+
+def test_independent_stages_run_concurrently():
+    stages = [
+        Stage("insight", sleeper(0.1, "I")),
+        Stage("poem", sleeper(0.2, "P"), deps=("insight",)),
+        Stage("novel", sleeper(0.2, "N"), deps=("insight",)),
+    ]
+    started = time.perf_counter()
+    results = asyncio.run(run_stages(stages))
+    elapsed = time.perf_counter() - started
+
+    assert results == {"insight": "I", "poem": "P<I", "novel": "N<I"}
+    # insight + max(poem, novel)，而非三者總和
+    assert elapsed < 0.45
+
+
+def test_failure_cancels_siblings():
+    log = []
+
+    async def broken(deps):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream 500")
+
+    stages = [
+        Stage("insight", sleeper(0, "I")),
+        Stage("poem", broken, deps=("insight",)),
+        Stage("novel", sleeper(5, "N", log), deps=("insight",)),
+    ]
+    with pytest.raises(StageError) as info:
+        asyncio.run(run_stages(stages))
+    assert info.value.stage == "poem"
+    assert log == ["cancelled:N"]
+
+
+def test_stage_timeout():
+    stages = [Stage("slow", sleeper(5, "S"), timeout=0.05)]
+    with pytest.raises(StageError) as info:
+        asyncio.run(run_stages(stages))
+    assert isinstance(info.value.cause, TimeoutError)
+
+
+def test_rejects_cycles_and_unknown_deps():
+    with pytest.raises(ValueError):
+        asyncio.run(run_stages([Stage("a", sleeper(0, "a"), deps=("b",)), Stage("b", sleeper(0, "b"), deps=("a",))]))
+    with pytest.raises(ValueError):
+        asyncio.run(run_stages([Stage("a", sleeper(0, "a"), deps=("missing",))]))
+
+
+def test_partial_mode_keeps_independent_results():
+    async def broken(deps):
+        raise RuntimeError("upstream 500")
+
+    stages = [
+        Stage("insight", sleeper(0, "I")),
+        Stage("poem", broken, deps=("insight",)),
+        Stage("novel", sleeper(0.05, "N"), deps=("insight",)),
+        Stage("review", sleeper(0, "R"), deps=("poem",)),
+    ]
+    errors = {}
+    results = asyncio.run(run_stages(stages, errors=errors))
+
+    assert results == {"insight": "I", "novel": "N<I"}
+    assert isinstance(errors["poem"].cause, RuntimeError)
+    assert isinstance(errors["review"].cause, StageSkipped) and errors["review"].cause.dep == "poem"
@@ -0,0 +1,72 @@
+"""
+提示詞模板測試：固定前綴在不同請求間位元組相同、覆寫與欄位檢查，以及上游回報 cached_tokens 時的命中率
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from app import openrouter, prompts
+from app.services import _insight_messages, _novel_messages, _poem_messages
+
+
+def test_static_prefix_is_shared_across_requests():
+    first = _poem_messages("psf", "requests", "report A", {"poem_style": "haiku", "tone": "calm"}, True)
+    second = _poem_messages("pallets", "flask", "report B", {}, True)
+    # system 訊息完全相同，所有變動內容都在 user 訊息
+    assert first[0] == second[0]
+    assert "psf/requests" not in first[0]["content"] and "haiku" not in first[0]["content"]
+    # 風格提示放在最後，只改風格時洞察報告仍在共同前綴內
+    user = first[1]["content"]
+    assert user.index("psf/requests") < user.index("report A") < user.index("Style: haiku.")
+    assert second[1]["content"].endswith("report B")
+
+    zh = _novel_messages("psf", "requests", "報告", {"novel_genre": "科幻"}, False)
+    assert zh[1]["content"].endswith("小說類型：科幻。")
+    assert _insight_messages("psf", "requests", True)[0] == _insight_messages("a", "b", True, "digest")[0]
+
+
+def test_overrides_and_field_validation():
+    registry = prompts.PromptRegistry.from_config({"poem": {"en": {"system": "Short poet."}}})
+    assert registry.get("poem", True).system == "Short poet."
+    assert registry.get("poem", False).system == prompts.DEFAULT_TEMPLATES["poem"]["zh"]["system"]
+    assert registry.get("poem", True).prefix_tokens < registry.get("novel", True).prefix_tokens
+    assert prompts.PROMPT_PREFIX_TOKENS.value(stage="poem", language="en") == registry.get("poem", True).prefix_tokens
+
+    with pytest.raises(ValueError):
+        prompts.PromptRegistry.from_config({"poem": {"en": {"user": "{repo} {secret}"}}})
+    with pytest.raises(ValueError):
+        prompts.PromptRegistry.from_config({"haiku": {}})
+    prompts.set_prompts(None)
+
+
+def test_cached_token_usage_reported(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "text"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 5, "prompt_tokens_details": {"cached_tokens": 80}},
+        })
+
+    openrouter.set_transport(httpx.MockTransport(handler))
+    try:
+        asyncio.run(openrouter.openrouter_chat_async(
+            _poem_messages("psf", "requests", "report", {}, True), model="cache/model",
+        ))
+    finally:
+        openrouter.set_transport(None)
+
+    assert openrouter.PROMPT_CACHE_TOKENS.value(stage="other", model="cache/model", kind="cached") == 80
+    assert openrouter.PROMPT_CACHE_HIT_RATIO.value(stage="other", model="cache/model") == 0.8
+
+
+def test_chat_summary_prompt_has_static_prefix():
+    registry = prompts.get_prompts()
+    first = registry.render("chat_summary", True, summary="(none)", transcript="user: hello there")
+    second = registry.render("chat_summary", True, summary="likes vue", transcript="user: and react?")
+    # 固定指示在 system 前綴，摘要與對話內容都在 user 訊息
+    assert first[0] == second[0] and "hello there" not in first[0]["content"]
+    assert second[1]["content"].startswith("Current summary:\nlikes vue")
+    assert registry.render("chat_summary", False, summary="（無）", transcript="user: 你好")[1]["content"].endswith("你好")
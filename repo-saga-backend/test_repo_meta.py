@@ -0,0 +1,124 @@
+"""
+倉庫版本偵測測試：條件式請求（304）、TTL 內不發請求，以及快取的作品只在 head 移動時重新生成
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+from app import repo_meta, warming
+from app.cache import get_cache
+from app.services import build_presets, saga_key
+
+EN = build_presets(lang="en")
+DEMO = "https://github.com/me/demo"
+
+
+@pytest.fixture
+def github():
+    """會回應 ETag / 304 的假 GitHub；state["sha"] 即目前 main 分支的 head"""
+    fake = FastAPI()
+    state = {"sha": "a" * 40, "pushed_at": "2025-01-01T00:00:00Z", "requests": []}
+
+    def conditional(request: Request, body: str, media_type: str) -> Response:
+        etag = f'"{abs(hash(body))}"'
+        state["requests"].append((request.url.path, request.headers.get("if-none-match") == etag))
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(body, media_type=media_type, headers={"ETag": etag})
+
+    @fake.get("/repos/{owner}/{repo}")
+    async def info(owner: str, repo: str, request: Request):
+        body = json.dumps({"default_branch": "main", "pushed_at": state["pushed_at"], "stargazers_count": 7})
+        return conditional(request, body, "application/json")
+
+    @fake.get("/repos/{owner}/{repo}/commits/{ref}")
+    async def head(owner: str, repo: str, ref: str, request: Request):
+        assert ref == "main"
+        return conditional(request, state["sha"], "text/plain")
+
+    def push(sha: str) -> None:
+        state["sha"] = sha
+        state["pushed_at"] = f"2025-01-02T00:00:{len(state['requests']):02d}Z"
+
+    resolver = repo_meta.RepoMetaResolver(
+        base_url="http://github.test", transport=httpx.ASGITransport(app=fake), ttl=0, remote=True,
+    )
+    repo_meta.set_repo_meta(resolver)
+    state["push"] = push
+    state["resolver"] = resolver
+    return state
+
+
+def test_conditional_requests_and_memo(github):
+    resolver = github["resolver"]
+
+    async def run():
+        first = await resolver.lookup("me", "demo")
+        # 沒有新的 push：倉庫資訊 304，不再查詢 commit
+        second = await resolver.lookup("me", "demo")
+        github["push"]("b" * 40)
+        third = await resolver.lookup("me", "demo")
+        resolver.ttl = 60
+        await resolver.lookup("me", "demo")
+        return first, second, third
+
+    sent = github["requests"]
+    not_modified = repo_meta.REPO_META_LOOKUPS.value(result="not_modified")
+    memo = repo_meta.REPO_META_LOOKUPS.value(result="memo")
+    first, second, third = asyncio.run(run())
+
+    assert first.head_sha == "a" * 40 and first.default_branch == "main" and first.stars == 7
+    assert second.head_sha == "a" * 40
+    assert third.head_sha == "b" * 40
+    assert sent == [
+        ("/repos/me/demo", False), ("/repos/me/demo/commits/main", False),
+        ("/repos/me/demo", True),
+        ("/repos/me/demo", False), ("/repos/me/demo/commits/main", False),
+    ]
+    assert repo_meta.REPO_META_LOOKUPS.value(result="not_modified") == not_modified + 1
+    assert repo_meta.REPO_META_LOOKUPS.value(result="memo") == memo + 1
+
+
+def test_lookup_failure_keeps_last_known_head(github):
+    resolver = github["resolver"]
+
+    async def run():
+        await resolver.lookup("me", "demo")
+        resolver.base_url = "http://github.test/broken"
+        return await resolver.head_sha("me", "demo")
+
+    assert asyncio.run(run()) == "a" * 40
+
+
+def test_saga_regenerated_only_when_head_moves(github, fake_upstream, monkeypatch):
+    monkeypatch.setattr(warming, "popularity", warming.Popularity())
+    key = saga_key("me/demo", EN)
+
+    async def run():
+        await warming.cached_saga(DEMO, EN)
+        tagged = await warming.load_result(key)
+        # 很久以前生成，但倉庫沒有變：不重新生成
+        tagged["generated_at"] = time.time() - 10 ** 6
+        await get_cache().set(warming._result_key(key), json.dumps(tagged))
+        calls = fake_upstream["calls"]
+        await warming.cached_saga(DEMO, EN)
+        await asyncio.gather(*warming._refresh_tasks)
+        unchanged_calls = fake_upstream["calls"] - calls
+
+        github["push"]("c" * 40)
+        await warming.cached_saga(DEMO, EN)
+        await asyncio.gather(*warming._refresh_tasks)
+        return tagged, unchanged_calls, await warming.load_result(key)
+
+    tagged, unchanged_calls, refreshed = asyncio.run(run())
+    assert tagged["head_sha"] == "a" * 40
+    assert unchanged_calls == 0
+    assert refreshed["head_sha"] == "c" * 40
+    # 新的 head 讓洞察報告的快取鍵改變而重新生成；假上游回傳相同的洞察報告，詩歌與小說沿用快取
+    assert fake_upstream["calls"] == 4
@@ -0,0 +1,128 @@
+"""
+上游韌性策略測試：重試、改用備援模型、hedging，以及在隨機故障下與無重試基準的比較
+"""
+
+import asyncio
+import random
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app import limits, openrouter
+from app.resilience import LatencyTracker, ResiliencePolicy
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def make_faulty_upstream(fault):
+    """fault(model, call_index) 回傳 (狀態碼, 延遲秒數)；狀態碼 200 時正常回應"""
+    upstream = FastAPI()
+    calls = []
+
+    @upstream.post("/{path:path}")
+    async def completions(body: dict):
+        model = body["model"]
+        calls.append(model)
+        status, delay = fault(model, len(calls))
+        await asyncio.sleep(delay)
+        if status != 200:
+            return JSONResponse({"error": {"code": status}}, status_code=status)
+        return {"choices": [{"message": {"content": f"ok from {model}"}}]}
+
+    return upstream, calls
+
+
+@pytest.fixture
+def faulty_upstream(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+
+    def install(fault):
+        upstream, calls = make_faulty_upstream(fault)
+        openrouter.set_transport(httpx.ASGITransport(app=upstream))
+        return calls
+
+    yield install
+    openrouter.set_transport(None)
+
+
+def call(policy, model="primary/model", n=1):
+    async def run():
+        limits.set_limiter(limits.UpstreamLimiter())
+        results = await asyncio.gather(
+            *[openrouter.openrouter_chat_async(MESSAGES, model=model, policy=policy) for _ in range(n)],
+            return_exceptions=True,
+        )
+        await openrouter.aclose_client()
+        return results
+
+    results = asyncio.run(run())
+    return results[0] if n == 1 else results
+
+
+def test_retries_transient_errors(faulty_upstream):
+    calls = faulty_upstream(lambda model, i: (503 if i <= 2 else 200, 0))
+    policy = ResiliencePolicy(max_attempts=3, backoff_base=0.01, fallback_models=())
+    assert call(policy) == "ok from primary/model"
+    assert len(calls) == 3
+
+
+def test_falls_back_to_next_model(faulty_upstream):
+    calls = faulty_upstream(lambda model, i: (404 if model == "primary/model" else 200, 0))
+    policy = ResiliencePolicy(max_attempts=3, backoff_base=0.01, fallback_models=("backup/model",))
+    assert call(policy) == "ok from backup/model"
+    # 404 不可重試：主模型只試一次就改用備援
+    assert calls == ["primary/model", "backup/model"]
+
+
+def test_auth_errors_are_not_retried(faulty_upstream):
+    calls = faulty_upstream(lambda model, i: (401, 0))
+    policy = ResiliencePolicy(max_attempts=3, backoff_base=0.01, fallback_models=("backup/model",))
+    error = call(policy)
+    assert isinstance(error, httpx.HTTPStatusError)
+    assert calls == ["primary/model"]
+
+
+def test_hedge_wins_over_slow_request(faulty_upstream):
+    calls = faulty_upstream(lambda model, i: (200, 2.0 if i == 1 else 0.02))
+    latencies = LatencyTracker()
+    for _ in range(5):
+        latencies.record("primary/model", 0.05)
+    policy = ResiliencePolicy(
+        hedge=True, hedge_min_delay=0.05, hedge_min_samples=5, fallback_models=(), latencies=latencies,
+    )
+
+    async def run():
+        limits.set_limiter(limits.UpstreamLimiter())
+        started = asyncio.get_running_loop().time()
+        reply = await openrouter.openrouter_chat_async(MESSAGES, model="primary/model", policy=policy)
+        elapsed = asyncio.get_running_loop().time() - started
+        await openrouter.aclose_client()
+        return reply, elapsed
+
+    reply, elapsed = asyncio.run(run())
+    assert reply == "ok from primary/model"
+    assert len(calls) == 2
+    assert elapsed < 1.0
+
+
+def test_policy_reduces_failures_under_random_faults(faulty_upstream):
+    rng = random.Random(42)
+
+    def fault(model, i):
+        # 主模型 30% 機率 503，備援模型 10%
+        rate = 0.3 if model == "primary/model" else 0.1
+        return (503 if rng.random() < rate else 200, 0)
+
+    faulty_upstream(fault)
+    baseline = ResiliencePolicy(max_attempts=1, fallback_models=())
+    resilient = ResiliencePolicy(max_attempts=3, backoff_base=0.001, fallback_models=("backup/model",))
+
+    def failures(policy):
+        return sum(isinstance(r, Exception) for r in call(policy, n=100))
+
+    baseline_failures = failures(baseline)
+    resilient_failures = failures(resilient)
+    assert baseline_failures >= 15
+    assert resilient_failures <= 1
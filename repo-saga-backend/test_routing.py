@@ -0,0 +1,68 @@
+"""
+模型路由測試：各階段使用自己的模型 / 溫度 / max_tokens，presets 覆寫，輸出被截斷時記錄指標
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app import openrouter, routing
+from app.services import generate_saga_from_repo
+
+CONFIG = {
+    "insight": {"model": "big/model", "max_tokens": 1200},
+    "poem": {
+        "model": "small/model", "temperature": 1.0, "max_tokens": 300,
+        "overrides": [{"when": {"poem_style": "haiku"}, "max_tokens": 60}],
+    },
+}
+
+
+@pytest.fixture
+def bodies(monkeypatch):
+    """記錄每個上游請求主體的假上游；max_tokens 很小時回報 finish_reason=length"""
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        seen.append(body)
+        finish = "length" if body.get("max_tokens", 1000) < 100 else "stop"
+        return httpx.Response(200, json={"choices": [{"message": {"content": "text"}, "finish_reason": finish}]})
+
+    openrouter.set_transport(httpx.MockTransport(handler))
+    routing.set_routing(routing.RoutingTable.from_config(CONFIG))
+    yield seen
+    routing.set_routing(None)
+    openrouter.set_transport(None)
+
+
+def by_model(bodies):
+    return {body["model"]: body for body in bodies}
+
+
+def test_stages_use_their_routes(bodies):
+    asyncio.run(generate_saga_from_repo("https://github.com/psf/requests", {"language": "English"}))
+    sent = by_model(bodies)
+    assert sent["big/model"]["max_tokens"] == 1200
+    assert sent["small/model"]["max_tokens"] == 300 and sent["small/model"]["temperature"] == 1.0
+    # 未設定的階段沿用環境變數預設值
+    novel = sent[routing.DEFAULT_ROUTES["novel"].model]
+    assert novel["max_tokens"] == routing.DEFAULT_ROUTES["novel"].max_tokens
+
+
+def test_preset_override_and_truncation_metric(bodies):
+    before = openrouter.UPSTREAM_TRUNCATED.value(stage="poem", model="small/model")
+    asyncio.run(generate_saga_from_repo(
+        "https://github.com/psf/requests", {"language": "English", "poem_style": "haiku"},
+    ))
+    assert by_model(bodies)["small/model"]["max_tokens"] == 60
+    assert openrouter.UPSTREAM_TRUNCATED.value(stage="poem", model="small/model") == before + 1
+    assert routing.ROUTE_DECISIONS.value(stage="poem", model="small/model", source="override") >= 1
+
+
+def test_unknown_stage_rejected():
+    with pytest.raises(ValueError):
+        routing.RoutingTable.from_config({"haiku": {"model": "x"}})
@@ -0,0 +1,88 @@
+"""
+以 id 定址的作品資源測試：/generate 回傳 saga_id，GET /sagas/{id} 帶 ETag / Cache-Control，支援 304 與 gzip
+"""
+
+import asyncio
+import gzip
+import json
+
+import httpx
+
+from app import routing, sagas
+from app.main import app
+from app.services import build_presets
+
+PAYLOAD = {"url": "https://github.com/psf/requests", "lang": "en"}
+
+
+def run_client(steps):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await steps(client)
+
+    return asyncio.run(run())
+
+
+def test_generate_links_to_cacheable_saga(fake_upstream):
+    async def steps(client):
+        generated = await client.post("/generate", json=PAYLOAD)
+        sid = generated.json()["saga_id"]
+        first = await client.get(f"/sagas/{sid}")
+        again = await client.get(f"/sagas/{sid}", headers={"If-None-Match": first.headers["etag"]})
+        return generated, first, again
+
+    generated, first, again = run_client(steps)
+    sid = generated.json()["saga_id"]
+    assert generated.headers["content-location"] == f"/sagas/{sid}"
+    # 相同的倉庫與 presets 永遠得到相同的 id
+    assert sid == sagas.saga_id_for("https://github.com/psf/requests/", build_presets(lang="en"))
+
+    assert first.status_code == 200
+    assert first.json()["poem"] == generated.json()["poem"] and first.json()["id"] == sid
+    assert first.headers["etag"].startswith('"') and "max-age=" in first.headers["cache-control"]
+    assert "Accept-Encoding" in first.headers["vary"]
+
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+
+
+def test_gzip_variant_has_its_own_etag(fake_upstream, monkeypatch):
+    monkeypatch.setattr(sagas, "SAGA_COMPRESS_MIN_BYTES", 0)
+
+    async def steps(client):
+        sid = (await client.post("/generate", json=PAYLOAD)).json()["saga_id"]
+        plain = await client.get(f"/sagas/{sid}", headers={"Accept-Encoding": "identity"})
+        # 以 stream 讀取原始位元組，避免 httpx 自動解壓
+        async with client.stream("GET", f"/sagas/{sid}", headers={"Accept-Encoding": "gzip"}) as zipped:
+            raw = b"".join([chunk async for chunk in zipped.aiter_raw()])
+        return plain, zipped, raw
+
+    plain, zipped, raw = run_client(steps)
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert zipped.headers["etag"] != plain.headers["etag"]
+    assert json.loads(gzip.decompress(raw)) == plain.json()
+
+
+def test_redirect_and_unknown_id(fake_upstream):
+    async def steps(client):
+        redirected = await client.post("/generate?redirect=true", json=PAYLOAD)
+        missing = await client.get("/sagas/" + "0" * 32)
+        invalid = await client.get("/sagas/not-an-id")
+        return redirected, missing, invalid
+
+    redirected, missing, invalid = run_client(steps)
+    assert redirected.status_code == 303 and redirected.headers["location"].startswith("/sagas/")
+    assert missing.status_code == 404 and invalid.status_code == 404
+
+
+def test_saga_id_follows_routing():
+    presets = build_presets(lang="en")
+    before = sagas.saga_id_for("https://github.com/psf/requests", presets)
+    routing.set_routing(routing.RoutingTable.from_config({"novel": {"model": "other/model"}}))
+    try:
+        # 換模型後是另一份作品：不同的 id（與 ETag），不會沿用舊模型的結果
+        assert sagas.saga_id_for("https://github.com/psf/requests", presets) != before
+    finally:
+        routing.set_routing(None)
+    assert sagas.saga_id_for("https://github.com/psf/requests", presets) == before
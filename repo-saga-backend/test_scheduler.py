@@ -0,0 +1,107 @@
+"""
+上游排程測試：優先等級（chat > generate > batch）、客戶端之間的加權公平佇列、aging 與取消
+"""
+
+import asyncio
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from app import limits
+
+
+def run_order(scheduler, submissions, before_release=None):
+    """先佔滿唯一名額，依序排入 submissions [(priority, client)]，再逐一釋放並回傳取得名額的順序"""
+    async def run():
+        await scheduler.acquire("generate", "holder", 1)
+        order = []
+
+        async def call(priority, client, index):
+            await scheduler.acquire(priority, client, 100)
+            order.append((priority, client, index))
+            await asyncio.sleep(0)
+            scheduler.release()
+
+        tasks = []
+        for index, (priority, client) in enumerate(submissions):
+            tasks.append(asyncio.create_task(call(priority, client, index)))
+            await asyncio.sleep(0)
+        if before_release is not None:
+            await before_release(tasks)
+        scheduler.release()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return order
+
+    return asyncio.run(run())
+
+
+def test_priority_classes():
+    order = run_order(limits.FairScheduler(1, aging=0), [("batch", "a"), ("generate", "a"), ("chat", "a")])
+    assert [priority for priority, _, _ in order] == ["chat", "generate", "batch"]
+    assert limits.SCHED_WAIT.count(priority="chat") >= 1
+
+
+def test_heavy_client_cannot_starve_others():
+    submissions = [("generate", "heavy")] * 6 + [("generate", "light")] * 2
+    order = run_order(limits.FairScheduler(1, aging=0), submissions)
+    clients = [client for _, client, _ in order]
+    # light 的兩個呼叫與 heavy 交錯，而不是排在 heavy 的六個之後
+    assert clients.index("light") <= 1 and max(i for i, c in enumerate(clients) if c == "light") <= 3
+    # 同一客戶端內維持送出順序
+    assert [index for _, client, index in order if client == "heavy"] == list(range(6))
+
+
+def test_client_weights():
+    submissions = [("generate", "partner")] * 4 + [("generate", "other")] * 4
+    order = run_order(limits.FairScheduler(1, aging=0, weights={"partner": 3}), submissions)
+    assert [client for _, client, _ in order[:4]].count("partner") == 3
+
+
+def test_aging_promotes_waiting_batch_work():
+    scheduler = limits.FairScheduler(1, aging=0.05)
+
+    async def run():
+        await scheduler.acquire("generate", "holder", 1)
+        order = []
+
+        async def call(priority):
+            await scheduler.acquire(priority, "x", 1)
+            order.append(priority)
+            scheduler.release()
+
+        batch = asyncio.create_task(call("batch"))
+        await asyncio.sleep(0.15)  # 等待超過兩個 aging 週期，已提升到 chat 之上
+        chat = asyncio.create_task(call("chat"))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(batch, chat)
+        return order
+
+    assert asyncio.run(run()) == ["batch", "chat"]
+    assert limits.SCHED_DISPATCHED.value(priority="batch", aged="true") >= 1
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def cancel_first(tasks):
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+
+    scheduler = limits.FairScheduler(1, aging=0)
+    order = run_order(scheduler, [("chat", "a"), ("generate", "b")], before_release=cancel_first)
+    assert order == [("generate", "b", 1)]
+    assert scheduler.free == 1 and scheduler.queued() == 0
+
+
+def test_dependency_tags_request_context():
+    app = FastAPI()
+
+    @app.get("/", dependencies=[Depends(limits.scheduling("chat"))])
+    async def probe():
+        return {"priority": limits.current_priority.get(), "client": limits.current_client.get()}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app, client=("10.0.0.7", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.get("/")).json()
+
+    assert asyncio.run(run()) == {"priority": "chat", "client": "10.0.0.7"}
@@ -0,0 +1,109 @@
+"""
+伺服器端聊天對話測試：只送 session id 與新訊息、背景滾動摘要壓縮、LRU 與 TTL 淘汰
+"""
+
+import asyncio
+import time
+
+import httpx
+
+from app import routing, sessions
+from app.main import app
+
+
+def test_session_keeps_history_server_side(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = (await client.post("/chat", json={"message": "first question", "lang": "en"})).json()
+            second = (await client.post(
+                "/chat", json={"message": "second question", "session_id": first["session_id"], "lang": "en"},
+            )).json()
+            return first, second
+
+    first, second = asyncio.run(run())
+    assert first["session_id"] and second["session_id"] == first["session_id"]
+    session = sessions.get_session_store().get(first["session_id"])
+    assert [t["content"] for t in session.turns[::2]] == ["first question", "second question"]
+
+
+def test_unknown_session_starts_a_new_one(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.post("/chat", json={"message": "hi", "session_id": "expired"})).json()
+
+    assert asyncio.run(run())["session_id"] not in (None, "expired")
+
+
+def test_background_compaction_bounds_history(fake_upstream, monkeypatch):
+    monkeypatch.setattr(sessions, "CHAT_COMPACT_AFTER", 4)
+    monkeypatch.setattr(sessions, "CHAT_COMPACT_KEEP", 2)
+    store = sessions.SessionStore()
+
+    async def run():
+        session = store.create(is_english=True)
+        for i in range(3):
+            store.append(session, f"question {i}", f"answer {i}")
+        await asyncio.gather(*store._tasks)
+        return session
+
+    session = asyncio.run(run())
+    assert session.summary.startswith("fake reply to:")
+    assert [t["content"] for t in session.turns] == ["question 2", "answer 2"]
+    assert fake_upstream["calls"] == 1
+
+
+def test_compaction_uses_chat_summary_route(monkeypatch):
+    monkeypatch.setattr(sessions, "CHAT_COMPACT_AFTER", 2)
+    monkeypatch.setattr(sessions, "CHAT_COMPACT_KEEP", 0)
+    calls = []
+
+    async def fake_chat(messages, **options):
+        calls.append(options)
+        return "summary"
+
+    monkeypatch.setattr(sessions, "openrouter_chat_async", fake_chat)
+    routing.set_routing(routing.RoutingTable.from_config({"chat_summary": {"model": "tiny/model", "max_tokens": 150}}))
+    store = sessions.SessionStore()
+
+    async def run():
+        session = store.create(is_english=True)
+        store.append(session, "question", "answer")
+        store.append(session, "another", "reply")
+        await asyncio.gather(*store._tasks)
+
+    try:
+        asyncio.run(run())
+    finally:
+        routing.set_routing(None)
+    assert calls == [{"model": "tiny/model", "temperature": 0.2, "max_tokens": 150, "timeout": calls[0]["timeout"]}]
+
+
+def test_compaction_falls_back_to_extractive_summary(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "")
+    monkeypatch.setattr(sessions, "CHAT_COMPACT_AFTER", 2)
+    monkeypatch.setattr(sessions, "CHAT_COMPACT_KEEP", 0)
+    store = sessions.SessionStore()
+
+    async def run():
+        session = store.create(is_english=True)
+        store.append(session, "Tell me about fastapi. Thanks.", "It is fast.")
+        store.append(session, "And vue?", "It is reactive.")
+        await asyncio.gather(*store._tasks)
+        return session
+
+    session = asyncio.run(run())
+    assert "Tell me about fastapi." in session.summary
+    assert session.turns == []
+
+
+def test_store_is_bounded_by_lru_and_ttl():
+    store = sessions.SessionStore(maxsize=2, ttl=0.05)
+    a, b = store.create(), store.create()
+    store.get(a.id)
+    c = store.create()
+    assert store.get(b.id) is None
+    assert store.get(a.id) is a and store.get(c.id) is c
+    time.sleep(0.06)
+    assert store.get(a.id) is None
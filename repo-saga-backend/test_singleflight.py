@@ -0,0 +1,72 @@
+"""
+單飛合併測試：相同的並發生成請求只觸發一次上游流程，不同詩歌風格共用進行中的洞察報告
+"""
+
+import asyncio
+
+import httpx
+
+from app import openrouter
+from app.main import app
+from app.services import generate_saga_from_repo
+from app.singleflight import SINGLEFLIGHT_CALLS, SingleFlight
+
+
+def test_identical_requests_share_one_execution():
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        flight = SingleFlight("test")
+        return await asyncio.gather(*[flight.do("k", work) for _ in range(10)])
+
+    assert asyncio.run(run()) == ["done"] * 10
+    assert len(runs) == 1
+    assert SINGLEFLIGHT_CALLS.value(scope="test", result="coalesced") >= 9
+
+
+def test_errors_propagate_to_every_waiter():
+    async def broken():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        flight = SingleFlight("test-errors")
+        return await asyncio.gather(*[flight.do("k", broken) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(run()))
+
+
+def test_burst_of_identical_generates(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*[
+                client.post("/generate", json={"url": "https://github.com/vuejs/vue", "lang": "en"})
+                for _ in range(8)
+            ])
+            metrics = await client.get("/metrics")
+        await openrouter.aclose_client()
+        return responses, metrics
+
+    responses, metrics = asyncio.run(run())
+    assert len({r.json()["novel"] for r in responses}) == 1
+    assert fake_upstream["calls"] == 3
+    assert 'saga_singleflight_hit_ratio{scope="saga"}' in metrics.text
+
+
+def test_different_poem_styles_share_inflight_insight(fake_upstream):
+    async def run():
+        await asyncio.gather(
+            generate_saga_from_repo("https://github.com/expressjs/express", {"language": "English", "poem_style": "haiku"}),
+            generate_saga_from_repo("https://github.com/expressjs/express", {"language": "English", "poem_style": "ode"}),
+        )
+        await openrouter.aclose_client()
+
+    asyncio.run(run())
+    # 1 次洞察 + 2 首詩 + 1 篇小說（小說的 presets 相同，也被合併）
+    assert fake_upstream["calls"] == 4
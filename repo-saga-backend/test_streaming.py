@@ -0,0 +1,57 @@
+"""
+SSE 串流測試：事件依 section 標記，上游的每個 delta 逐一轉送
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from app import openrouter
+from app.main import app
+
+
+def parse_sse(raw: str):
+    events = []
+    for block in raw.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_emits_tagged_events(fake_upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/generate/stream", json={"url": "https://github.com/psf/requests", "lang": "en"})
+            assert resp.headers["content-type"].startswith("text/event-stream")
+        await openrouter.aclose_client()
+        return resp.text
+
+    raw = asyncio.run(run())
+    events = parse_sse(raw)
+    names = [name for name, _ in events]
+
+    assert names[0] == "stage_start" and events[0][1]["section"] == "insight"
+    assert names[-1] == "summary"
+    assert {data["section"] for name, data in events if name == "stage_done"} == {"insight", "poem", "novel"}
+
+    poem_tokens = [data["text"] for name, data in events if name == "token" and data["section"] == "poem"]
+    poem = "".join(poem_tokens)
+    assert len(poem_tokens) > 1
+    assert poem.startswith("fake reply to: Project: psf/requests")
+    assert events[-1][1]["sections"]["poem"] == len(poem)
+
+
+def test_stream_reports_stage_error(fake_upstream, monkeypatch):
+    monkeypatch.delenv("OPENROUTER_API_KEY")
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/generate/stream", json={"url": "https://github.com/psf/requests"})
+        return resp.text
+
+    events = parse_sse(asyncio.run(run()))
+    assert events[-1][0] == "error"
+    assert events[-1][1]["section"] == "insight"
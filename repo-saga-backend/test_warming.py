@@ -0,0 +1,102 @@
+"""
+預熱與 stale-while-revalidate 測試：過期結果立即回傳並背景更新，預熱依熱門度挑選且受上游預算限制
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from app import routing, warming
+from app.cache import get_cache
+from app.services import StageCheckpoint, build_presets, canonical_repo, saga_key
+
+EN = build_presets(lang="en")
+REQUESTS = "https://github.com/psf/requests"
+
+
+@pytest.fixture(autouse=True)
+def fresh_popularity(monkeypatch):
+    monkeypatch.setattr(warming, "popularity", warming.Popularity())
+
+
+def test_stale_result_served_then_revalidated(fake_upstream):
+    key = saga_key(canonical_repo(REQUESTS), EN)
+    stale = {"sections": {"insight": "old", "poem": "old", "novel": "old"}, "generated_at": time.time() - 10 ** 6}
+
+    async def run():
+        await get_cache().set(warming._result_key(key), json.dumps(stale))
+        started = time.perf_counter()
+        results, errors = await warming.cached_saga(REQUESTS, EN)
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*warming._refresh_tasks)
+        return results, errors, elapsed, await warming.load_result(key)
+
+    results, errors, elapsed, refreshed = asyncio.run(run())
+    assert results["poem"] == "old" and not errors
+    assert elapsed < 0.1
+    assert refreshed["sections"]["poem"].startswith("fake reply") and refreshed["generated_at"] > stale["generated_at"]
+    assert warming.SAGA_RESULTS.value(state="stale") >= 1
+
+
+def test_warm_once_picks_popular_within_budget(fake_upstream):
+    for _ in range(3):
+        warming.popularity.record(REQUESTS, EN)
+    warming.popularity.record("https://github.com/pallets/flask", EN)
+    # 預算只夠一次生成：最熱門的 requests 先預熱
+    warmer = warming.Warmer(budget_per_hour=warming.CALLS_PER_SAGA)
+
+    async def run():
+        warmed = await warmer.warm_once()
+        return warmed, await warming.load_result(saga_key("psf/requests", EN)), await warming.load_result(saga_key("pallets/flask", EN))
+
+    warmed, hot, cold = asyncio.run(run())
+    assert warmed == 1 and hot is not None and cold is None
+
+
+def test_warm_skips_when_busy(fake_upstream, monkeypatch):
+    monkeypatch.setattr(warming, "WARM_QUIET_RPM", 0)
+    warming.popularity.record(REQUESTS, EN)
+    assert asyncio.run(warming.Warmer().warm_once()) == 0
+    assert fake_upstream["calls"] == 0
+
+
+def test_routing_change_bypasses_cached_result_and_checkpoint(fake_upstream):
+    old = {"sections": {"insight": "old", "poem": "old", "novel": "old"}, "generated_at": time.time(), "head_sha": None}
+    checkpoint = StageCheckpoint(get_cache(), saga_key(canonical_repo(REQUESTS), EN)).key
+
+    async def run():
+        await get_cache().set(warming._result_key(saga_key(canonical_repo(REQUESTS), EN)), json.dumps(old))
+        routing.set_routing(routing.RoutingTable.from_config({"poem": {"model": "new/model"}}))
+        try:
+            new_checkpoint = StageCheckpoint(get_cache(), saga_key(canonical_repo(REQUESTS), EN)).key
+            results, _ = await warming.cached_saga(REQUESTS, EN)
+        finally:
+            routing.set_routing(None)
+        return results, new_checkpoint
+
+    results, new_checkpoint = asyncio.run(run())
+    # 新路由下沒有可用的完整結果與檢查點：重新生成，而不是沿用舊模型的作品
+    assert results["poem"].startswith("fake reply")
+    assert new_checkpoint != checkpoint
+
+
+def test_revalidation_with_unknown_head_calls_upstream(fake_upstream):
+    key = saga_key(canonical_repo(REQUESTS), EN)
+
+    async def run():
+        await warming.cached_saga(REQUESTS, EN)
+        generated = fake_upstream["calls"]
+        # head 未知（離線）：以生成時間判斷過期
+        entry = await warming.load_result(key)
+        assert entry["head_sha"] is None
+        entry["generated_at"] -= 10 ** 6
+        await get_cache().set(warming._result_key(key), json.dumps(entry))
+        await warming.cached_saga(REQUESTS, EN)
+        await asyncio.gather(*warming._refresh_tasks)
+        return generated
+
+    generated = asyncio.run(run())
+    # 背景重新驗證真的重新生成三個階段，而不是從各階段快取重組舊內容
+    assert generated == 3 and fake_upstream["calls"] == 6
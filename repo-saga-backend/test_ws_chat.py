@@ -0,0 +1,97 @@
+"""
+/ws/chat 測試：同一連線多輪對話逐段送出回覆、取消會中止上游串流
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import openrouter, sessions
+from app.main import app
+
+
+@pytest.fixture
+def slow_stream(monkeypatch):
+    """逐段真正串流（每 50ms 一段，共 100 段）的上游，記錄串流是否被中止"""
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    state = {"open": 0, "sent": 0}
+
+    async def body():
+        state["open"] += 1
+        try:
+            for i in range(100):
+                state["sent"] += 1
+                chunk = {"choices": [{"delta": {"content": f"word{i} "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+                await asyncio.sleep(0.05)
+            yield b"data: [DONE]\n\n"
+        finally:
+            state["open"] -= 1
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    openrouter.set_transport(httpx.MockTransport(handler))
+    yield state
+    openrouter.set_transport(None)
+
+
+def receive_reply(ws):
+    events = []
+    while True:
+        event = ws.receive_json()
+        events.append(event)
+        if event["type"] in ("done", "cancelled", "error"):
+            return events
+
+
+def test_streams_tokens_over_one_connection(fake_upstream):
+    client = TestClient(app)
+    with client.websocket_connect("/ws/chat?lang=en") as ws:
+        session_id = ws.receive_json()["session_id"]
+        ws.send_json({"type": "message", "text": "first question"})
+        first = receive_reply(ws)
+        ws.send_json({"type": "message", "text": "second question"})
+        second = receive_reply(ws)
+
+    tokens = [e["text"] for e in first if e["type"] == "token"]
+    assert first[0]["type"] == "start" and first[-1]["type"] == "done"
+    assert len(tokens) > 1 and "".join(tokens).startswith("fake reply to:")
+    assert second[-1]["type"] == "done" and second[-1]["id"] == 2
+    turns = sessions.get_session_store().get(session_id).turns
+    assert [t["content"] for t in turns[::2]] == ["first question", "second question"]
+
+
+def test_malformed_frame_keeps_socket_open(fake_upstream):
+    client = TestClient(app)
+    with client.websocket_connect("/ws/chat?lang=en") as ws:
+        ws.receive_json()
+        ws.send_text("not json")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_text("[1, 2]")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"type": "message", "text": "still there?"})
+        assert receive_reply(ws)[-1]["type"] == "done"
+
+
+def test_cancel_aborts_upstream(slow_stream):
+    client = TestClient(app)
+    with client.websocket_connect("/ws/chat?lang=en") as ws:
+        session_id = ws.receive_json()["session_id"]
+        ws.send_json({"type": "message", "text": "tell me a long story"})
+        assert ws.receive_json()["type"] == "start"
+        assert ws.receive_json()["type"] == "token"
+        ws.send_json({"type": "cancel"})
+        events = receive_reply(ws)
+
+    assert events[-1]["type"] == "cancelled"
+    deadline = time.time() + 2
+    while slow_stream["open"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert slow_stream["open"] == 0 and slow_stream["sent"] < 100
+    # 未完成的回覆不記入對話
+    assert sessions.get_session_store().get(session_id).turns == []
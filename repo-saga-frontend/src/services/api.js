@@ -19,6 +19,41 @@ export const generateWork = async (url, presets = {}) => {
   }
 }
 
+// 串流版生成：透過 SSE 逐字接收 insight / poem / novel
+// onEvent(eventName, data) 會在每個事件到達時被呼叫
+export const generateWorkStream = async (url, presets = {}, onEvent = () => {}, signal = undefined) => {
+  const response = await fetch(`${API_BASE_URL}/generate/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ url, ...presets }),
+    signal
+  })
+  if (!response.ok || !response.body) {
+    throw new Error(`Stream request failed: HTTP ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      let eventName = 'message'
+      let data = ''
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) eventName = line.slice(7)
+        else if (line.startsWith('data: ')) data += line.slice(6)
+      }
+      if (data) onEvent(eventName, JSON.parse(data))
+    }
+  }
+}
+
 export const getExample = async () => {
   try {
     const response = await api.get('/example')
@@ -29,15 +64,48 @@ export const getExample = async () => {
   }
 }
 
-export const chatWithAssistant = async (message, conversationHistory = [], lang = null, locale = null) => {
+// WebSocket 聊天：一個連線對應一段對話，回覆逐段以 token 事件送達
+// onEvent(data) 依 data.type 處理 session / start / token / done / cancelled / error；onClose(event) 在連線關閉時呼叫
+// 回傳 { ready, send(text), cancel(), close() }，ready 在收到 session 事件後 resolve
+export const openChatSocket = ({ sessionId = null, lang = null, locale = null, onEvent = () => {}, onClose = () => {} } = {}) => {
+  const url = new URL('/ws/chat', API_BASE_URL.replace(/^http/, 'ws'))
+  if (sessionId) url.searchParams.set('session_id', sessionId)
+  if (lang) url.searchParams.set('lang', lang)
+  if (locale) url.searchParams.set('locale', locale)
+
+  const socket = new WebSocket(url)
+  const ready = new Promise((resolve, reject) => {
+    socket.addEventListener('message', (message) => {
+      const data = JSON.parse(message.data)
+      if (data.type === 'session') resolve(data.session_id)
+      onEvent(data)
+    })
+    socket.addEventListener('error', () => reject(new Error('Chat socket failed')))
+    socket.addEventListener('close', (event) => {
+      reject(new Error(`Chat socket closed (${event.code})`))
+      onClose(event)
+    })
+  })
+
+  return {
+    ready,
+    send: (text) => socket.send(JSON.stringify({ type: 'message', text })),
+    cancel: () => socket.send(JSON.stringify({ type: 'cancel' })),
+    close: () => socket.close(),
+    isOpen: () => socket.readyState === WebSocket.OPEN
+  }
+}
+
+// 對話歷史保存在伺服器端：只送出 session id 與新訊息，回傳 { response, session_id }
+export const chatWithAssistant = async (message, sessionId = null, lang = null, locale = null) => {
   try {
     const response = await api.post('/chat', {
       message,
-      conversation_history: conversationHistory,
+      session_id: sessionId,
       lang,
       locale
     })
-    return response.data.response
+    return response.data
   } catch (error) {
     console.error('Chat API call failed:', error)
     throw error